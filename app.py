@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_from_directory, g
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_from_directory, send_file, g
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user, fresh_login_required
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
@@ -7,37 +7,53 @@ import jwt
 from datetime import datetime, timedelta
 from functools import wraps
 import json
-from dotenv import load_dotenv
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib import colors
+import mimetypes
 import tempfile
+import shutil
 import sqlite3
+# Eerst: laadt .env in de omgeving voor de os.getenv-constanten van de andere modules
+from modules.email_config import get_smtp_config, get_mail_config, install_reload_signal
+from modules.database import DATABASE_PATH, init_db
 from modules.upload_tool import process_upload
 from PIL import Image
-from modules.word_generator import generate_word_from_template
+from modules.word_generator import discard_word_document, render_word_document
+from modules.docx_template import compile_template
+from modules.attachment_budget import fit_attachments
+from modules.pdf_dossier import build_dossier
+from modules.form_schema import convert_form
+from modules.email_templates import get_email_environment, render_email
+from modules.prerender import get_prerenderer
+from modules.smtp_pool import close_all_pools
+from modules.mail_transport import get_transport
+from modules.resilience import breaker_stats, OPEN
+from modules.mail_queue import get_mail_queue, combined_status, MAIL_QUEUE_WORKER, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from modules.mail_digest import get_mail_digest
+from modules.email_events import get_email_event_hub, EMAIL_EVENTS_LONG_POLL_SECONDS
+from modules.stripe_events import get_stripe_event_inbox
+from modules.payment_ledger import get_payment_ledger
+from modules.entitlements import Entitlement, ACTIVE, get_user_cache
+from modules.mime_stream import StreamedMessage
 import logging
 import re
 import secrets
+import hmac
 from io import BytesIO
 
 # Import Stripe configuratie
 from modules.stripe_config import (
-    create_payment_intent, get_payment_intent, create_customer, 
     get_customer, verify_webhook_signature, get_price_info, is_stripe_configured
 )
 
-# Import email configuratie
-from modules.email_config import get_smtp_config
-
 def cleanup_uploaded_files():
     """Clean up all files in the uploads directory for the current session."""
+    # Het gerenderde Word document (persoonsgegevens) hoort bij de uploads van deze sessie
+    if session.get('form_data'):
+        try:
+            discard_word_document(convert_form(session['form_data']).docx, WORD_TEMPLATE_PATH)
+        except Exception as e:
+            logging.error(f"Error discarding cached Word document: {str(e)}")
     if 'uploads' in session:
         upload_dir = app.config['UPLOAD_FOLDER']
         for filename in session['uploads'].values():
@@ -73,25 +89,24 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-# Laad environment variables
-load_dotenv()
-
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key-please-change-in-production')
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 
-# SMTP configuratie
-config = get_smtp_config()
-SMTP_SERVER = config['server']
-SMTP_PORT = config['port']
-SMTP_USERNAME = config['user']
-SMTP_PASSWORD = config['password']
-SMTP_FROM = os.getenv('SMTP_FROM') or SMTP_USERNAME
+# SMTP configuratie: één keer geladen en ontsleuteld, opnieuw bij SIGHUP of een gewijzigde .env
+get_mail_config().add_listener(close_all_pools)  # sessies met oude inloggegevens niet hergebruiken
+install_reload_signal()
 
 # Zorg dat upload directory bestaat
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Word template één keer compileren bij het opstarten
+WORD_TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'templates', 'atk_template.docx')
+compile_template(WORD_TEMPLATE_PATH)
+# E-mailtemplates (met inline CSS) ook direct compileren
+get_email_environment()
+
 # Login manager setup
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -99,7 +114,7 @@ login_manager.login_view = 'login'
 
 # User class voor Flask-Login
 class User(UserMixin):
-    def __init__(self, id, email, name=None, vergunningnummer=None, terms_accepted=False, privacy_accepted=False, terms_accepted_date=None, privacy_accepted_date=None):
+    def __init__(self, id, email, name=None, vergunningnummer=None, terms_accepted=False, privacy_accepted=False, terms_accepted_date=None, privacy_accepted_date=None, entitlement=None):
         self.id = id
         self.email = email
         self.name = name
@@ -108,14 +123,16 @@ class User(UserMixin):
         self.privacy_accepted = privacy_accepted
         self.terms_accepted_date = terms_accepted_date
         self.privacy_accepted_date = privacy_accepted_date
+        # Toegang tot de betaalde tool, één keer berekend uit de users-rij
+        self.entitlement = entitlement or Entitlement(False)
 
-@login_manager.user_loader
-def load_user(user_id):
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    conn.close()
-    if user:
-        return User(
+    @property
+    def is_paid_user(self):
+        return self.entitlement.allows()
+
+    @classmethod
+    def from_row(cls, user):
+        return cls(
             user['id'], 
             user['email'], 
             user['name'], 
@@ -123,10 +140,39 @@ def load_user(user_id):
             user['terms_accepted'],
             user['privacy_accepted'],
             user['terms_accepted_date'],
-            user['privacy_accepted_date']
+            user['privacy_accepted_date'],
+            Entitlement.from_row(user)
         )
+
+# Ingelogde gebruikers (met hun toegang) blijven per proces even in het geheugen; zie modules/entitlements.py
+user_cache = get_user_cache()
+
+def _load_user_from_db(user_id):
+    conn = get_db_connection()
+    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    conn.close()
+    if user:
+        return User.from_row(user)
     return None
 
+@login_manager.user_loader
+def load_user(user_id):
+    return user_cache.get(user_id, _load_user_from_db)
+
+def paid_required(f):
+    """Alleen voor gebruikers met toegang (betaald of in de respijttermijn); zonder Stripe staat de betaalmuur uit."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if is_stripe_configured() and not current_user.entitlement.allows():
+            # Een weigering altijd tegen de database controleren: de betaling kan in een ander proces binnengekomen zijn
+            user_cache.invalidate(current_user.id)
+            user = load_user(current_user.id)
+            if user is None or not user.entitlement.allows():
+                flash('Je hebt (nog) geen toegang tot de tool. Rond eerst de betaling af.', 'warning')
+                return redirect(url_for('betaal'))
+        return f(*args, **kwargs)
+    return decorated
+
 # JWT token decorator
 def token_required(f):
     @wraps(f)
@@ -142,81 +188,18 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
-def generate_pdf(form_data, uploaded_files):
-    # Maak een tijdelijk bestand voor de PDF met een duidelijke naam
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    pdf_filename = f"aanvraag_beveiligingspas_{timestamp}.pdf"
-    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], pdf_filename)
-    
-    # Maak de PDF
-    c = canvas.Canvas(pdf_path, pagesize=A4)
-    width, height = A4
-    
-    # Voeg content toe
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, height - 50, "Aanvraag Beveiligingspas")
-    
-    y = height - 100
-    c.setFont("Helvetica", 12)
-    
-    # Persoonlijke gegevens
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, "Persoonlijke gegevens")
-    y -= 30
-    c.setFont("Helvetica", 12)
-    
-    for key, value in form_data.items():
-        if key.startswith('voornaam') or key.startswith('achternaam') or key.startswith('geboorte'):
-            c.drawString(50, y, f"{key.replace('_', ' ').title()}: {value}")
-            y -= 20
-    
-    # Contactgegevens
-    y -= 20
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, "Contactgegevens")
-    y -= 30
-    c.setFont("Helvetica", 12)
-    
-    for key, value in form_data.items():
-        if key in ['email', 'telefoon', 'adres', 'postcode', 'plaats']:
-            c.drawString(50, y, f"{key.replace('_', ' ').title()}: {value}")
-            y -= 20
-    
-    # Werkgever gegevens
-    y -= 20
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, "Werkgever gegevens")
-    y -= 30
-    c.setFont("Helvetica", 12)
-    
-    for key, value in form_data.items():
-        if key.startswith('bedrijf'):
-            c.drawString(50, y, f"{key.replace('_', ' ').title()}: {value}")
-            y -= 20
+def send_email(to_email, subject, body, attachments=None, reply_to=None, bcc=None, html_body=None, logo_path=None, logo_cid=None, user_id=None, form_data_id=None, email_id=None, priority=PRIORITY_NORMAL):
+    # Bouwt het bericht en zet het in de mailqueue; True betekent 'in de wachtrij', niet 'afgeleverd'
+    # Unieke email ID voor tracking (de aanroeper geeft die mee als de trackingpixel al in de HTML staat)
+    email_id = email_id or secrets.token_urlsafe(32)
     
-    # Bijgevoegde documenten
-    y -= 20
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y, "Bijgevoegde documenten")
-    y -= 30
-    c.setFont("Helvetica", 12)
-    
-    for file in uploaded_files:
-        c.drawString(50, y, os.path.basename(file))
-        y -= 20
-    
-    c.save()
-    return pdf_path
-
-def send_email(to_email, subject, body, attachments=None, reply_to=None, bcc=None, html_body=None, logo_path=None, logo_cid=None, user_id=None, form_data_id=None):
-    # Genereer unieke email ID voor tracking
-    email_id = secrets.token_urlsafe(32)
-    
-    msg = MIMEMultipart('related')
+    # Bijlagen worden pas bij het spoolen in blokken van schijf gelezen (niet als geheel in het geheugen)
+    msg = StreamedMessage('related')
     alt = MIMEMultipart('alternative')
     
     # Verbeterde email headers voor betere deliverability
-    msg['From'] = f"ATK-WPBR Tool <{SMTP_FROM}>"
+    smtp_from = get_smtp_config()['from']
+    msg['From'] = f"ATK-WPBR Tool <{smtp_from}>"
     msg['To'] = to_email
     msg['Subject'] = subject
     msg['X-Mailer'] = 'ATK-WPBR Tool v2.0'
@@ -224,26 +207,13 @@ def send_email(to_email, subject, body, attachments=None, reply_to=None, bcc=Non
     msg['X-MSMail-Priority'] = 'Normal'
     msg['Importance'] = 'Normal'
     
-    # Reply-To header instellen
+    # Reply-To header instellen (de vermelding in de tekst staat in het e-mailtemplate)
     if reply_to:
         msg['Reply-To'] = reply_to
-        # Voeg duidelijke vermelding toe aan email body voor Korpscheftaken
-        reply_notice = f"\n\n---\nAntwoord op deze email wordt verwacht op: {reply_to}"
-        body += reply_notice
-        if html_body:
-            reply_notice_html = f'<hr><p><strong>Antwoord op deze email wordt verwacht op:</strong> <a href="mailto:{reply_to}">{reply_to}</a></p>'
-            html_body += reply_notice_html
     
     if bcc:
         msg['Bcc'] = bcc
     
-    # Voeg tracking pixel toe aan HTML body
-    if html_body:
-        tracking_pixel = f'<img src="{url_for("email_tracking_pixel", email_id=email_id, _external=True)}" width="1" height="1" style="display:none;" />'
-        html_body = html_body.replace('</body>', f'{tracking_pixel}</body>')
-        if '</body>' not in html_body:
-            html_body += tracking_pixel
-    
     alt.attach(MIMEText(body, 'plain', 'utf-8'))
     if html_body:
         alt.attach(MIMEText(html_body, 'html', 'utf-8'))
@@ -251,55 +221,42 @@ def send_email(to_email, subject, body, attachments=None, reply_to=None, bcc=Non
     
     if attachments:
         for file_path in attachments:
-            with open(file_path, 'rb') as f:
-                part = MIMEApplication(f.read(), Name=os.path.basename(file_path))
-                part['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-                msg.attach(part)
+            msg.attach_file(file_path)
     
     # Voeg logo inline toe als cid-image
     if logo_path and logo_cid:
-        from email.mime.image import MIMEImage
-        with open(logo_path, 'rb') as img:
-            mime_img = MIMEImage(img.read())
-            mime_img.add_header('Content-ID', f'<{logo_cid}>')
-            mime_img.add_header('Content-Disposition', 'inline', filename=os.path.basename(logo_path))
-            msg.attach(mime_img)
+        content_type = mimetypes.guess_type(logo_path)[0] or 'image/png'
+        msg.attach_file(logo_path, content_type=content_type, disposition='inline', content_id=logo_cid)
     
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            recipients = [to_email]
-            if bcc:
-                if isinstance(bcc, str):
-                    recipients.append(bcc)
-                else:
-                    recipients.extend(bcc)
-            
-            # Logging voor debugging
-            logging.info(f"E-mail From: {msg['From']}")
-            logging.info(f"E-mail To: {to_email}")
-            logging.info(f"E-mail Reply-To: {reply_to}")
-            logging.info(f"E-mail Bcc: {bcc}")
-            logging.info(f"E-mail ID: {email_id}")
-            logging.info(f"E-mail Subject: {subject}")
-            
-            server.sendmail(SMTP_FROM, recipients, msg.as_string())
-            
-            # Sla email tracking op in database
-            conn = get_db_connection()
-            conn.execute('''INSERT INTO email_tracking 
-                           (email_id, to_email, subject, user_id, form_data_id) 
-                           VALUES (?, ?, ?, ?, ?)''', 
-                        (email_id, to_email, subject, user_id, form_data_id))
-            conn.commit()
-            conn.close()
-            
+        recipients = [to_email]
+        if bcc:
+            if isinstance(bcc, str):
+                recipients.append(bcc)
+            else:
+                recipients.extend(bcc)
+
+        # Logging voor debugging
+        logging.info(f"E-mail From: {msg['From']}")
+        logging.info(f"E-mail To: {to_email}")
+        logging.info(f"E-mail Reply-To: {reply_to}")
+        logging.info(f"E-mail Bcc: {bcc}")
+        logging.info(f"E-mail ID: {email_id}")
+        logging.info(f"E-mail Subject: {subject}")
+
+        # In de wachtrij (met email tracking); de mailqueue-worker levert het bericht af
+        get_mail_queue().enqueue(msg, smtp_from, recipients, email_id=email_id, priority=priority, tracking={
+            'to_email': to_email,
+            'subject': subject,
+            'user_id': user_id,
+            'form_data_id': form_data_id,
+        })
+
         return True
     except Exception as e:
         import traceback
-        logging.error(f"Error sending email: {e}\n{traceback.format_exc()}")
-        print(f"Error sending email: {e}\n{traceback.format_exc()}")
+        logging.error(f"Error queueing email: {e}\n{traceback.format_exc()}")
+        print(f"Error queueing email: {e}\n{traceback.format_exc()}")
         return False
 
 # Routes
@@ -329,84 +286,48 @@ def login():
                     'success': False, 
                     'message': 'Je e-mailadres is nog niet geverifieerd. Controleer je inbox voor de verificatie-e-mail.'
                 })
-            login_user(User(
-                user['id'], 
-                user['email'], 
-                user['name'], 
-                user['vergunningnummer'],
-                user['terms_accepted'],
-                user['privacy_accepted'],
-                user['terms_accepted_date'],
-                user['privacy_accepted_date']
-            ))
+            logged_in = User.from_row(user)
+            login_user(logged_in)
+            user_cache.put(logged_in)
             return jsonify({'success': True, 'redirect': url_for('form')})
         else:
             return jsonify({'success': False, 'message': 'Ongeldige inloggegevens.'})
             
     return render_template('login.html')
 
-# --- User database helpers ---
+# --- User database helpers (schema in modules/database.py) ---
 def get_db_connection():
-    conn = sqlite3.connect('users.db')
+    conn = sqlite3.connect(DATABASE_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_db():
-    conn = get_db_connection()
-    conn.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        hashed_password TEXT NOT NULL,
-        vergunningnummer TEXT,
-        terms_accepted BOOLEAN DEFAULT 0,
-        privacy_accepted BOOLEAN DEFAULT 0,
-        terms_accepted_date TIMESTAMP,
-        privacy_accepted_date TIMESTAMP,
-        telefoon TEXT,
-        is_paid_user BOOLEAN DEFAULT 0,
-        email_verified BOOLEAN DEFAULT 0,
-        verification_token TEXT,
-        verification_token_expires TIMESTAMP,
-        stripe_customer_id TEXT,
-        subscription_status TEXT DEFAULT 'inactive',
-        subscription_expires TIMESTAMP
-    )''')
-    
-    # Email tracking tabel voor lees- en ontvangstbevestiging
-    conn.execute('''CREATE TABLE IF NOT EXISTS email_tracking (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email_id TEXT UNIQUE NOT NULL,
-        to_email TEXT NOT NULL,
-        subject TEXT NOT NULL,
-        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        delivered_at TIMESTAMP,
-        read_at TIMESTAMP,
-        read_count INTEGER DEFAULT 0,
-        user_id INTEGER,
-        form_data_id TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )''')
-    
-    # Betalingsinformatie tabel
-    conn.execute('''CREATE TABLE IF NOT EXISTS payments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        stripe_payment_intent_id TEXT UNIQUE NOT NULL,
-        stripe_customer_id TEXT,
-        amount INTEGER NOT NULL,
-        currency TEXT NOT NULL,
-        status TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        metadata TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )''')
-    
-    conn.commit()
-    conn.close()
+init_db(DATABASE_PATH)
+
+# Uitgaande e-mail loopt via de wachtrij; de worker levert af via het transport van het account
+mail_queue = get_mail_queue()
+mail_queue.register_account('default', lambda: get_transport('default'))
+mail_queue.register_account('gmail', lambda: get_transport('gmail'))
+if MAIL_QUEUE_WORKER:
+    mail_queue.start()
+
+# Statuswijzigingen van e-mails gaan als server-sent events naar de bevestigingspagina
+email_events = get_email_event_hub()
+mail_queue.add_listener(email_events.notify)
+
+# Stripe-webhooks gaan via een inbox en worden op de achtergrond verwerkt (zelfde schakelaar als de mailqueue)
+stripe_events = get_stripe_event_inbox()
+if MAIL_QUEUE_WORKER:
+    stripe_events.start()
 
-init_db()
+# Betaalstatus uit het lokale grootboek; de Stripe-customer komt na de betaling, op de achtergrond
+payment_ledger = get_payment_ledger()
+stripe_events.add_listener(payment_ledger.create_missing_customer)
+stripe_events.add_listener(user_cache.on_stripe_event)
+
+# Aanvragen voor adressen in MAIL_DIGEST_ADDRESSES gaan gebundeld de wachtrij in
+mail_digest = get_mail_digest()
+if MAIL_QUEUE_WORKER:
+    mail_digest.start()
 
 def check_vergunningnummer(vergunningnummer, wpbr_lijst):
     # wpbr_lijst: lijst van dicts met o.a. 'Vergunning nummer'
@@ -438,10 +359,7 @@ def send_verification_email(email, token):
     msg.attach(MIMEText(body, 'plain'))
     
     try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(os.getenv('EMAIL_USER'), os.getenv('EMAIL_PASSWORD'))
-            server.send_message(msg)
+        get_mail_queue().enqueue(msg, account='gmail')
         return True
     except Exception as e:
         logging.error(f"Error sending verification email: {str(e)}")
@@ -579,6 +497,7 @@ KORPSCHEFTAKEN = {
 
 SESSION_TIMEOUT_MINUTES = 30
 ADMIN_EMAIL = 'snuushco@gmail.com'  # Deze admin blijft altijd ingelogd
+HEALTH_TOKEN = os.getenv('HEALTH_TOKEN')  # Bearer-token voor /health/details vanuit monitoring
 
 @app.before_request
 def check_session_timeout():
@@ -601,6 +520,7 @@ def cleanup_on_request_end(exception=None):
 
 @app.route('/form', methods=['GET', 'POST'])
 @login_required
+@paid_required
 def form():
     edit_mode = False
     if request.method == 'GET' and request.args.get('edit') == '1':
@@ -673,11 +593,11 @@ def form():
                                 flash(f"Fout bij verwerken van {key}: {result['error']}", 'error')
                                 return render_template('form.html', korpscheftaken=json.dumps(KORPSCHEFTAKEN), form_data=form_data, uploads=existing_uploads, edit_mode=edit_mode)
                             # Sla geresizede afbeelding op met _resized in de naam
-                            name, ext = os.path.splitext(filename)
-                            resized_filename = f"{name}_resized{ext}"
+                            name, _ = os.path.splitext(filename)
+                            resized_filename = f"{name}_resized{result['ext']}"
                             file_path = os.path.join(app.config['UPLOAD_FOLDER'], resized_filename)
-                            fmt = 'JPEG' if ext in ['.jpg', '.jpeg'] else 'PNG'
-                            result['image'].save(file_path, format=fmt)
+                            with open(file_path, 'wb') as out:
+                                out.write(result['data'])
                             uploads[key] = resized_filename
                             continue
                     
@@ -689,6 +609,15 @@ def form():
                     uploads[key] = existing_uploads[key]
             
             session['uploads'] = uploads
+            
+            # Word document alvast op de achtergrond renderen voor /download_word en /verzenden
+            prerenderer = get_prerenderer()
+            prerenderer.discard(session.pop('prerender_id', None))
+            prerender_id = secrets.token_urlsafe(16)
+            session['prerender_id'] = prerender_id
+            prerenderer.submit(prerender_id, {
+                'word': (prerender_word_document, convert_form(form_data).docx),
+            })
             return redirect(url_for('controle'))
             
         except Exception as e:
@@ -710,8 +639,24 @@ def form():
     
     return render_template('form.html', korpscheftaken=json.dumps(KORPSCHEFTAKEN), form_data=form_data, uploads={}, edit_mode=False)
 
+def prerender_word_document(template_data):
+    """Achtergrondtaak: render het Word document alvast in de cache."""
+    render_word_document(template_data, WORD_TEMPLATE_PATH)
+    return True
+
+def word_download_name(form_data):
+    """Bestandsnaam van het ingevulde aanvraagformulier."""
+    achternaam = re.sub(r'[\\/]', '-', form_data.get('achternaam', ''))
+    return f"241209 Nieuw Aanvraagformulier {achternaam}.docx"
+
+def dossier_name(form_data):
+    """Bestandsnaam van het PDF-dossier met alle bijlagen."""
+    achternaam = re.sub(r'[\\/]', '-', form_data.get('achternaam', ''))
+    return f"Dossier aanvraag {achternaam}.pdf"
+
 @app.route('/controle', methods=['GET', 'POST'])
 @login_required
+@paid_required
 def controle():
     form_data = session.get('form_data', {})
     uploads = session.get('uploads', {}) or {}
@@ -722,10 +667,11 @@ def controle():
         return redirect(url_for('verzenden'))
 
     # Bereid de bevestigingsinformatie voor
+    email_ctx = convert_form(form_data).email
     bevestiging_info = {
-        'naam': f"{form_data.get('voornamen', '')} {form_data.get('achternaam', '')}",
-        'afdeling': form_data.get('afdeling_select', ''),
-        'email_afdeling': form_data.get('email_opties_select', ''),
+        'naam': email_ctx['naam'],
+        'afdeling': email_ctx['afdeling'],
+        'email_afdeling': email_ctx['email_afdeling'],
         'datum': datetime.now().strftime('%d-%m-%Y %H:%M'),
         'aantal_bijlagen': len(uploads),
         'Kopie wordt verstuurd naar': user_email
@@ -836,74 +782,6 @@ def controle():
             else:
                 resized_files.append(v)
 
-    # --- Word-template mapping (zoals bij verzenden) ---
-    template_data = {
-        "bedrijfsnaam": form_data.get("bedrijfsnaam", ""),
-        "straat_bedrijf": form_data.get("straat_bedrijf", ""),
-        "postcode_bedrijf": form_data.get("postcode_bedrijf", ""),
-        "plaats_bedrijf": form_data.get("plaats_bedrijf", ""),
-        "vergunning_type": form_data.get("vergunning_type", ""),
-        "vergunning_nummer": form_data.get("vergunning_nummer", ""),
-        "email_bedrijf": form_data.get("email_bedrijf", ""),
-        "telefoon_bedrijf": form_data.get("telefoon_bedrijf", ""),
-        "bsn": form_data.get("bsn", ""),
-        "voorvoegsel": form_data.get("voorvoegsel", ""),
-        "achternaam": form_data.get("achternaam", ""),
-        "voornamen": form_data.get("voornamen", ""),
-        "geboortedatum": form_data.get("geboortedatum", ""),
-        "geboorteplaats": form_data.get("geboorteplaats", ""),
-        "geboorteland": form_data.get("geboorteland", ""),
-        "straat_medewerker": form_data.get("straat_medewerker", ""),
-        "huisnummer": form_data.get("huisnummer", ""),
-        "postcode_medewerker": form_data.get("postcode_medewerker", ""),
-        "woonplaats": form_data.get("woonplaats_medewerker", ""),
-        "telefoon_medewerker": form_data.get("telefoon_medewerker", ""),
-        "email_medewerker": form_data.get("email_medewerker", ""),
-        "svpb_nummer": form_data.get("svpb_nummer", ""),
-        "in_opleiding": "ja" if form_data.get("in_opleiding") in ["on", True, "ja"] else "",
-        "certificaat_winkelsurveillant": "☒" if form_data.get("certificaat_winkelsurveillant") in ["on", True, "ja"] else "",
-        "persoonsbeveiliger": "ja" if form_data.get("persoonsbeveiliger") in ["on", True, "ja"] else "",
-        "naam_contactpersoon": form_data.get("naam_contactpersoon", ""),
-        "plaats_ondertekening": form_data.get("plaats_ondertekening", ""),
-        # Uitbreiding voor alle placeholders uit het screenshot:
-        "is_opsporingsambtenaar": "ja" if form_data.get("is_opsporingsambtenaar") in ["on", True, "ja"] else "",
-        "sinds": form_data.get("sinds", ""),
-        "organisatie": form_data.get("organisatie", ""),
-        "functie": form_data.get("functie", ""),
-        "functie_gediplomeerd": form_data.get("functie_gediplomeerd", ""),
-        "certificaat_persoonsbeveiliger": "ja" if form_data.get("certificaat_persoonsbeveiliger") in ["on", True, "ja"] else "",
-        "latere_begindatum": form_data.get("latere_begindatum", ""),
-        "einddatum_svpb": form_data.get("einddatum_svpb", ""),
-        # Type aanvraag (let op exacte waarde)
-        "eerste_aanvraag": "☒" if form_data.get("type_aanvraag") in ["eerste_aanvraag", "Eerste aanvraag"] else "",
-        "verlenging_aanvraag": "☒" if form_data.get("type_aanvraag") in ["verlenging_aanvraag", "Verlenging/herscreening"] else "",
-        "vervanging_aanvraag": "☒" if form_data.get("type_aanvraag") in ["vervanging_aanvraag", "Vervanging legitimatiebewijs (vermissing/diefstal)"] else "",
-        # Bijlagen (checkboxen, direct uit form_data)
-        "bijlagen_id": "☒" if form_data.get("id") else "",
-        "bijlagen_pasfoto": "☒" if form_data.get("pasfoto") else "",
-        "bijlagen_handtekening": "☒" if form_data.get("handtekening") else "",
-        "bijlagen_svpb": "☒" if form_data.get("svpb") else "",
-        "bijlagen_horeca": "☒" if form_data.get("horeca") else "",
-        "bijlagen_voetbal": "☒" if form_data.get("voetbal") else "",
-        "bijlagen_logo": "☒" if form_data.get("logo") else "",
-        "bijlagen_straf_belgie": "☒" if form_data.get("straf_belgie") else "",
-        "bijlagen_fuhrung": "☒" if form_data.get("fuhrung") else "",
-        "bijlagen_straf_herkomst": "☒" if form_data.get("straf_herkomst") else "",
-        "bijlagen_pv": "☒" if form_data.get("pv") else "",
-        "bijlagen_certificaat_winkelsurveillant": "☒" if form_data.get("certificaat_winkelsurveillant") in ["on", True, "ja"] else "",
-        "datum_aanvraag": form_data.get("datum_aanvraag", ""),
-    }
-    # Genereer Word-document en sla pad op in sessie
-    template_path = os.path.join(os.path.dirname(__file__), 'templates', 'atk_template.docx')
-    # Genereer bestandsnaam met vaste waarde en achternaam
-    achternaam = form_data.get('achternaam', '')
-    word_filename = f"241209 Nieuw Aanvraagformulier {achternaam}.docx"
-    word_path = os.path.join(app.config['UPLOAD_FOLDER'], word_filename)
-    
-    # Genereer Word document
-    generate_word_from_template(template_data, template_path, word_path)
-    session['word_output_path'] = word_path
-
     return render_template('controle.html', form_data=form_data, uploads=uploads_clean, bevestiging_info=bevestiging_info, previews=previews, resized_success=resized_success, resized_files_info=resized_files_info)
 
 @app.route('/uploads/<filename>')
@@ -916,6 +794,7 @@ def uploaded_file(filename):
 
 @app.route('/verzenden', methods=['POST'])
 @login_required
+@paid_required
 def verzenden():
     try:
         # Get form data from session
@@ -933,106 +812,32 @@ def verzenden():
         # Genereer unieke form data ID
         form_data_id = secrets.token_urlsafe(16)
         
-        # Prepare email content
-        afdeling_email = form_data.get('email_opties_select', '')
+        # Prepare email content: Word-invulmap, e-mailcontext en dossiersecties in één doorloop
+        view = convert_form(form_data)
+        email_ctx = view.email
+        afdeling_email = email_ctx['email_afdeling']
         user_email = session.get('user_email', '')
         
         # Email naar afdeling Korpscheftaken
-        subject = f"Aanvraag Beveiligingspas - {form_data.get('voornamen', '')} {form_data.get('achternaam', '')}"
-        
-        # HTML email body
-        html_body = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Aanvraag Beveiligingspas</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin-bottom: 20px; }}
-                .section {{ margin-bottom: 20px; }}
-                .footer {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; margin-top: 20px; font-size: 12px; }}
-                .reply-notice {{ background-color: #e3f2fd; padding: 15px; border-left: 4px solid #2196f3; margin-top: 20px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h2>Aanvraag Beveiligingspas</h2>
-                    <p><strong>Datum:</strong> {datetime.now().strftime('%d-%m-%Y %H:%M')}</p>
-                </div>
-                
-                <div class="section">
-                    <h3>Persoonlijke gegevens</h3>
-                    <p><strong>Medewerker:</strong> {form_data.get('voornamen', '')} {form_data.get('achternaam', '')}</p>
-                    <p><strong>Bedrijf:</strong> {form_data.get('bedrijfsnaam', '')}</p>
-                    <p><strong>Vergunningnummer:</strong> {form_data.get('vergunning_type', '')} {form_data.get('vergunning_nummer', '')}</p>
-                    <p><strong>Datum aanvraag:</strong> {form_data.get('datum_aanvraag', '')}</p>
-                    <p><strong>Type aanvraag:</strong> {form_data.get('type_aanvraag', '')}</p>
-                    <p><strong>Afdeling:</strong> {form_data.get('afdeling_select', '')}</p>
-                </div>
-                
-                <div class="section">
-                    <h3>Bijlagen</h3>
-                    <ul>
-        """
+        subject = f"Aanvraag Beveiligingspas - {email_ctx['naam']}"
         
-        # Voeg bijlagen toe aan email body
+        # Bijlagen voor het overzicht in de e-mail
+        bijlagen = []
         for key, files in uploaded_files.items():
             if files:
-                if isinstance(files, list):
-                    for file in files:
-                        html_body += f"<li>{key}: {file}</li>"
-                else:
-                    html_body += f"<li>{key}: {files}</li>"
-        
-        html_body += f"""
-                    </ul>
-                </div>
-                
-                <div class="reply-notice">
-                    <p><strong>⚠️ Belangrijk:</strong> Antwoord op deze email wordt verwacht op: <a href="mailto:{user_email}">{user_email}</a></p>
-                </div>
-                
-                <div class="footer">
-                    <p>Deze aanvraag is automatisch gegenereerd door de ATK-WPBR Tool.</p>
-                    <p>Met vriendelijke groet,<br>ATK-WPBR Tool</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # Plain text body
-        body = f"""
-        Aanvraag Beveiligingspas
-        ========================
-        
-        Datum: {datetime.now().strftime('%d-%m-%Y %H:%M')}
-        
-        Persoonlijke gegevens:
-        ----------------------
-        Medewerker: {form_data.get('voornamen', '')} {form_data.get('achternaam', '')}
-        Bedrijf: {form_data.get('bedrijfsnaam', '')}
-        Vergunningnummer: {form_data.get('vergunning_type', '')} {form_data.get('vergunning_nummer', '')}
-        Datum aanvraag: {form_data.get('datum_aanvraag', '')}
-        Type aanvraag: {form_data.get('type_aanvraag', '')}
-        Afdeling: {form_data.get('afdeling_select', '')}
+                for file in (files if isinstance(files, list) else [files]):
+                    bijlagen.append((key, file))
         
-        Bijlagen:
-        ---------
-        {', '.join([str(f) for f in uploaded_files.values() if f])}
-        
-        ---
-        BELANGRIJK: Antwoord op deze email wordt verwacht op: {user_email}
-        ---
-        
-        Deze aanvraag is automatisch gegenereerd door de ATK-WPBR Tool.
-        
-        Met vriendelijke groet,
-        ATK-WPBR Tool
-        """
+        # E-mailteksten uit de voorgecompileerde templates; de trackingpixel hoort bij email_id
+        email_id = secrets.token_urlsafe(32)
+        body, html_body = render_email(
+            'aanvraag',
+            form=email_ctx,
+            datum=datetime.now().strftime('%d-%m-%Y %H:%M'),
+            bijlagen=bijlagen,
+            reply_to=user_email,
+            tracking_pixel_url=url_for('email_tracking_pixel', email_id=email_id, _external=True)
+        )
         
         # Prepare attachments
         attachments = []
@@ -1048,97 +853,74 @@ def verzenden():
                     if os.path.exists(file_path):
                         attachments.append(file_path)
         
-        # Send email to afdeling Korpscheftaken
-        email_sent = send_email(
-            to_email=afdeling_email,
-            subject=subject,
-            body=body,
-            html_body=html_body,
-            attachments=attachments,
-            reply_to=user_email,
-            user_id=current_user.id,
-            form_data_id=form_data_id
-        )
+        # Bewaak de maximale berichtgrootte: comprimeer bijlagen vóór verzenden i.p.v. een geweigerde mail
+        budget_dir = tempfile.mkdtemp(prefix='atk_budget_')
+        try:
+            # Ingevuld aanvraagformulier (uit de cache als de gegevens sinds /controle niet zijn gewijzigd)
+            get_prerenderer().result(session.get('prerender_id'), 'word')
+            word_path = os.path.join(budget_dir, word_download_name(form_data))
+            with open(word_path, 'wb') as f:
+                f.write(render_word_document(view.docx, WORD_TEMPLATE_PATH))
+            
+            # Afbeeldingen en PDF's samenvoegen tot één dossier; lukt dat niet, dan gaan ze los mee
+            dossier = build_dossier(view.pdf_sections, attachments, os.path.join(budget_dir, dossier_name(form_data)))
+            if dossier['success']:
+                attachments = [dossier['path']] + dossier['skipped']
+            attachments.insert(0, word_path)
+            
+            budget = fit_attachments(attachments, budget_dir, bodies=(body, html_body))
+            if not budget['success']:
+                flash(budget['error'], 'error')
+                return redirect(url_for('controle'))
+            
+            # Send email to afdeling Korpscheftaken (of bewaar de aanvraag voor de bundel naar dat adres)
+            if mail_digest.enabled_for(afdeling_email):
+                try:
+                    mail_digest.add(
+                        to_email=afdeling_email,
+                        subject=subject,
+                        form=email_ctx,
+                        attachments=budget['attachments'],
+                        reply_to=user_email,
+                        tracking_pixel_url=url_for('email_tracking_pixel', email_id=email_id, _external=True),
+                        user_id=current_user.id,
+                        form_data_id=form_data_id,
+                        email_id=email_id
+                    )
+                    email_sent = True
+                except Exception as e:
+                    logging.error(f"Aanvraag niet bewaard voor de bundel naar {afdeling_email}: {e}")
+                    email_sent = False
+            else:
+                email_sent = send_email(
+                    to_email=afdeling_email,
+                    subject=subject,
+                    body=body,
+                    html_body=html_body,
+                    attachments=budget['attachments'],
+                    reply_to=user_email,
+                    user_id=current_user.id,
+                    form_data_id=form_data_id,
+                    email_id=email_id,
+                    priority=PRIORITY_HIGH
+                )
+        finally:
+            shutil.rmtree(budget_dir, ignore_errors=True)
         
         if not email_sent:
             flash('Er is een fout opgetreden bij het verzenden van de email.', 'error')
             return redirect(url_for('controle'))
         
-        # Send confirmation email to user
+        # Send confirmation email to user (alleen als de aanvraag in de wachtrij staat);
+        # de mailqueue levert beide berichten daarna tegelijk af
         confirmation_subject = "Bevestiging aanvraag Beveiligingspas"
-        confirmation_body = f"""
-        Bevestiging aanvraag Beveiligingspas
-        ===================================
-        
-        Beste {form_data.get('voornamen', '')} {form_data.get('achternaam', '')},
-        
-        Uw aanvraag voor een beveiligingspas is succesvol verzonden naar de afdeling Korpscheftaken.
-        
-        Details van uw aanvraag:
-        ------------------------
-        - Medewerker: {form_data.get('voornamen', '')} {form_data.get('achternaam', '')}
-        - Bedrijf: {form_data.get('bedrijfsnaam', '')}
-        - Vergunningnummer: {form_data.get('vergunning_type', '')} {form_data.get('vergunning_nummer', '')}
-        - Afdeling: {form_data.get('afdeling_select', '')}
-        - Datum verzending: {datetime.now().strftime('%d-%m-%Y %H:%M')}
-        - Verzonden naar: {afdeling_email}
-        
-        U ontvangt een reactie van de afdeling Korpscheftaken zodra uw aanvraag is verwerkt.
-        
-        Met vriendelijke groet,
-        ATK-WPBR Tool
-        """
-        
-        confirmation_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Bevestiging aanvraag</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background-color: #4caf50; color: white; padding: 20px; border-radius: 5px; margin-bottom: 20px; text-align: center; }}
-                .section {{ margin-bottom: 20px; }}
-                .details {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; }}
-                .footer {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; margin-top: 20px; font-size: 12px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h2>✅ Bevestiging aanvraag Beveiligingspas</h2>
-                    <p>Uw aanvraag is succesvol verzonden</p>
-                </div>
-                
-                <div class="section">
-                    <p>Beste {form_data.get('voornamen', '')} {form_data.get('achternaam', '')},</p>
-                    <p>Uw aanvraag voor een beveiligingspas is succesvol verzonden naar de afdeling Korpscheftaken.</p>
-                </div>
-                
-                <div class="section">
-                    <h3>Details van uw aanvraag:</h3>
-                    <div class="details">
-                        <p><strong>Medewerker:</strong> {form_data.get('voornamen', '')} {form_data.get('achternaam', '')}</p>
-                        <p><strong>Bedrijf:</strong> {form_data.get('bedrijfsnaam', '')}</p>
-                        <p><strong>Vergunningnummer:</strong> {form_data.get('vergunning_type', '')} {form_data.get('vergunning_nummer', '')}</p>
-                        <p><strong>Afdeling:</strong> {form_data.get('afdeling_select', '')}</p>
-                        <p><strong>Datum verzending:</strong> {datetime.now().strftime('%d-%m-%Y %H:%M')}</p>
-                        <p><strong>Verzonden naar:</strong> {afdeling_email}</p>
-                    </div>
-                </div>
-                
-                <div class="section">
-                    <p>U ontvangt een reactie van de afdeling Korpscheftaken zodra uw aanvraag is verwerkt.</p>
-                </div>
-                
-                <div class="footer">
-                    <p>Met vriendelijke groet,<br>ATK-WPBR Tool</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        confirmation_email_id = secrets.token_urlsafe(32)
+        confirmation_body, confirmation_html = render_email(
+            'bevestiging',
+            form=email_ctx,
+            datum=datetime.now().strftime('%d-%m-%Y %H:%M'),
+            tracking_pixel_url=url_for('email_tracking_pixel', email_id=confirmation_email_id, _external=True)
+        )
         
         # Send confirmation email
         confirmation_sent = send_email(
@@ -1147,11 +929,14 @@ def verzenden():
             body=confirmation_body,
             html_body=confirmation_html,
             user_id=current_user.id,
-            form_data_id=form_data_id
+            form_data_id=form_data_id,
+            email_id=confirmation_email_id
         )
         
         # Store email tracking info in session for bevestiging page
         session['last_email_id'] = form_data_id
+        session['main_email_id'] = email_id
+        session['confirmation_email_id'] = confirmation_email_id if confirmation_sent else None
         session['email_sent_to'] = afdeling_email
         session['confirmation_sent'] = confirmation_sent
         
@@ -1160,6 +945,7 @@ def verzenden():
         
         # Clear form data from session
         session.pop('form_data', None)
+        get_prerenderer().discard(session.pop('prerender_id', None))
         
         return redirect(url_for('bevestiging'))
     except Exception as e:
@@ -1197,34 +983,42 @@ def bevestiging():
         try:
             conn = get_db_connection()
             tracking = conn.execute('''SELECT * FROM email_tracking 
-                                     WHERE form_data_id = ? AND user_id = ? 
-                                     ORDER BY sent_at DESC''', 
+                                     WHERE form_data_id = ? AND user_id = ?''', 
                                       (last_email_id, current_user.id)).fetchall()
             conn.close()
             
+            # Status per bericht; zolang de mailqueue het nog niet heeft afgeleverd is sent_at leeg
+            by_id = {row['email_id']: row for row in tracking}
+            def tracking_status(email_id):
+                row = by_id.get(email_id)
+                return {
+                    'email_id': email_id,
+                    'status': row['status'] if row else None,
+                    'attempts': row['attempts'] if row else 0,
+                    'sent_at': row['sent_at'] if row else None,
+                    'delivered_at': row['delivered_at'] if row else None,
+                    'read_at': row['read_at'] if row else None,
+                    'read_count': row['read_count'] if row else 0
+                }
+            
             if tracking:
+                main_email = tracking_status(session.get('main_email_id'))
+                confirmation_email = tracking_status(session.get('confirmation_email_id'))
                 email_tracking_info = {
-                    'main_email': {
-                        'sent_at': tracking[0]['sent_at'],
-                        'delivered_at': tracking[0]['delivered_at'],
-                        'read_at': tracking[0]['read_at'],
-                        'read_count': tracking[0]['read_count']
-                    },
-                    'confirmation_email': {
-                        'sent_at': tracking[1]['sent_at'] if len(tracking) > 1 else None,
-                        'delivered_at': tracking[1]['delivered_at'] if len(tracking) > 1 else None,
-                        'read_at': tracking[1]['read_at'] if len(tracking) > 1 else None,
-                        'read_count': tracking[1]['read_count'] if len(tracking) > 1 else 0
-                    }
+                    'main_email': main_email,
+                    'confirmation_email': confirmation_email,
+                    # Eén uitkomst voor de hele verzending; de aanvraag aan de afdeling is leidend
+                    'verzending': combined_status([main_email['status'], confirmation_email['status']])
                 }
         except Exception as e:
             logging.error(f"Error getting email tracking info: {str(e)}")
     
     # Bereid de bevestigingsinformatie voor
+    email_ctx = convert_form(form_data).email
     bevestiging_info = {
-        'naam': f"{form_data.get('voornamen', '')} {form_data.get('achternaam', '')}",
-        'afdeling': form_data.get('afdeling_select', ''),
-        'email_afdeling': form_data.get('email_opties_select', ''),
+        'naam': email_ctx['naam'],
+        'afdeling': email_ctx['afdeling'],
+        'email_afdeling': email_ctx['email_afdeling'],
         'datum': datetime.now().strftime('%d-%m-%Y %H:%M'),
         'aantal_bijlagen': len(uploads),
         'Kopie wordt verstuurd naar': session.get('user_email', ''),
@@ -1235,6 +1029,8 @@ def bevestiging():
     
     # Clear email tracking session data
     session.pop('last_email_id', None)
+    session.pop('main_email_id', None)
+    session.pop('confirmation_email_id', None)
     session.pop('email_sent_to', None)
     session.pop('confirmation_sent', None)
     
@@ -1242,15 +1038,20 @@ def bevestiging():
 
 @app.route('/download_word')
 @login_required
+@paid_required
 def download_word():
-    word_path = session.get('word_output_path')
-    if not word_path or not os.path.exists(word_path):
+    form_data = session.get('form_data', {})
+    if not form_data:
         flash('Geen Word-bestand beschikbaar voor download.', 'error')
         return redirect(url_for('controle'))
-    return send_from_directory(
-        directory=os.path.dirname(word_path),
-        path=os.path.basename(word_path),
-        as_attachment=True
+    # Pas hier renderen; ongewijzigde gegevens komen uit de cache (wacht eventueel op de achtergrondtaak)
+    get_prerenderer().result(session.get('prerender_id'), 'word')
+    document = render_word_document(convert_form(form_data).docx, WORD_TEMPLATE_PATH)
+    return send_file(
+        BytesIO(document),
+        mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        as_attachment=True,
+        download_name=word_download_name(form_data)
     )
 
 @app.before_request
@@ -1300,6 +1101,7 @@ def profiel_update():
         conn.execute('UPDATE users SET name = ?, email = ? WHERE id = ?', (name, email, current_user.id))
         conn.commit()
         conn.close()
+        user_cache.invalidate(current_user.id)
         # Update current_user direct
         current_user.name = name
         current_user.email = email
@@ -1438,10 +1240,7 @@ def send_feedback_email(user_data, feedback_data):
     msg.attach(MIMEText(body, 'plain'))
     
     try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(os.getenv('EMAIL_USER'), os.getenv('EMAIL_PASSWORD'))
-            server.send_message(msg)
+        get_mail_queue().enqueue(msg, account='gmail', priority=PRIORITY_LOW)
         return True
     except Exception as e:
         logging.error(f"Error sending feedback email: {str(e)}")
@@ -1493,6 +1292,7 @@ def feedback():
 
 @app.route('/wijzigen')
 @login_required
+@paid_required
 def wijzigen():
     """Route voor het wijzigen van het formulier - verwijdert uploads uit sessie."""
     try:
@@ -1521,6 +1321,7 @@ def email_tracking_pixel(email_id):
                        WHERE email_id = ?''', (email_id,))
         conn.commit()
         conn.close()
+        email_events.notify()
         
         # Return 1x1 transparent GIF
         gif_data = b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00\x00\x21\xf9\x04\x01\x00\x00\x00\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x44\x01\x00\x3b'
@@ -1541,6 +1342,7 @@ def email_delivered(email_id):
                        WHERE email_id = ?''', (email_id,))
         conn.commit()
         conn.close()
+        email_events.notify()
         return jsonify({'success': True})
     except Exception as e:
         logging.error(f"Error in email delivered callback: {str(e)}")
@@ -1565,7 +1367,9 @@ def email_status(email_id):
                 'sent_at': tracking['sent_at'],
                 'delivered_at': tracking['delivered_at'],
                 'read_at': tracking['read_at'],
-                'read_count': tracking['read_count']
+                'read_count': tracking['read_count'],
+                'status': tracking['status'],
+                'attempts': tracking['attempts']
             })
         else:
             return jsonify({'error': 'Email not found'}), 404
@@ -1573,10 +1377,91 @@ def email_status(email_id):
         logging.error(f"Error getting email status: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/health')
+def health():
+    """Liveness voor de load balancer: alleen SELECT 1 en de circuit breakers (in het geheugen), geen tellingen."""
+    try:
+        conn = get_db_connection()
+        conn.execute('SELECT 1')
+        conn.close()
+    except Exception as e:
+        logging.error(f"Health check: database niet bereikbaar: {e}")
+        return jsonify({'status': 'down', 'database': 'error'}), 503
+    breakers = breaker_stats()
+    # Een open breaker betekent een storing bij een externe dienst; deze instantie zelf werkt nog
+    degraded = any(breaker['state'] == OPEN for breaker in breakers.values())
+    return jsonify({
+        'status': 'degraded' if degraded else 'ok',
+        'database': 'ok',
+        'breakers': {name: breaker['state'] for name, breaker in breakers.items()}
+    })
+
+def _may_see_health_details():
+    """Monitoring met HEALTH_TOKEN als Bearer-token, of de ingelogde beheerder."""
+    auth = request.headers.get('Authorization', '')
+    if HEALTH_TOKEN and auth.startswith('Bearer ') and hmac.compare_digest(auth[7:], HEALTH_TOKEN):
+        return True
+    return current_user.is_authenticated and current_user.email == ADMIN_EMAIL
+
+@app.route('/health/details')
+def health_details():
+    """Mailqueue, e-mailevents, Stripe-inbox, gebruikerscache en breakers; dit zijn queries over hele tabellen."""
+    if not _may_see_health_details():
+        return jsonify({'message': 'Niet toegestaan'}), 403
+    return jsonify({
+        'mail_queue': mail_queue.stats(),
+        'email_events': email_events.stats(),
+        'stripe_events': stripe_events.stats(),
+        'user_cache': user_cache.stats(),
+        'breakers': breaker_stats()
+    })
+
+@app.route('/email-events')
+@login_required
+def email_events_stream():
+    """Server-sent events met de verzend-, aflever- en leesstatus van de berichten van één aanvraag (?email_id=..., aanvraag eerst)."""
+    email_ids = request.args.getlist('email_id')[:2]
+    if not email_ids:
+        return jsonify({'error': 'email_id ontbreekt'}), 400
+    # Login en gebruiker één keer bij het openen van de stream, niet per update.
+    # Een sync worker (geen threads) bedient maar één request: dan een korte long-poll in plaats van een lange stream.
+    if request.environ.get('wsgi.multithread'):
+        stream = email_events.stream(current_user.id, email_ids)
+    else:
+        stream = email_events.stream(current_user.id, email_ids, seconds=EMAIL_EVENTS_LONG_POLL_SECONDS,
+                                     long_poll=True)
+    return app.response_class(stream, mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/verzending-status')
+@login_required
+def verzending_status():
+    """Status van de berichten van één aanvraag (?email_id=...&email_id=..., aanvraag eerst) en de gezamenlijke uitkomst."""
+    email_ids = request.args.getlist('email_id')[:2]
+    if not email_ids:
+        return jsonify({'error': 'email_id ontbreekt'}), 400
+    try:
+        conn = get_db_connection()
+        placeholders = ', '.join('?' * len(email_ids))
+        rows = conn.execute(f'''SELECT email_id, sent_at, status, attempts FROM email_tracking
+                               WHERE email_id IN ({placeholders}) AND user_id = ?''',
+                            (*email_ids, current_user.id)).fetchall()
+        conn.close()
+        by_id = {row['email_id']: dict(row) for row in rows}
+        emails = [by_id[email_id] for email_id in email_ids if email_id in by_id]
+        return jsonify({
+            'status': combined_status([by_id.get(email_id, {}).get('status') for email_id in email_ids]),
+            'emails': emails
+        })
+    except Exception as e:
+        logging.error(f"Error getting verzending status: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/betaal')
 @login_required
 def betaal():
-    if current_user.is_authenticated and getattr(current_user, 'is_paid_user', False):
+    # Verlengen kan al in de respijttermijn; alleen bij een lopend abonnement is betalen niet nodig
+    if current_user.entitlement.status() == ACTIVE:
         flash('Je hebt al toegang tot de tool.', 'success')
         return redirect(url_for('form'))
     price_info = get_price_info()
@@ -1590,34 +1475,11 @@ def betaal():
 @app.route('/create-payment-intent', methods=['POST'])
 @login_required
 def create_payment_intent_route():
-    data = request.get_json()
-    user_id = current_user.id
-    email = current_user.email
-    name = current_user.name
-    # Maak Stripe customer aan indien niet aanwezig
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-    stripe_customer_id = user['stripe_customer_id']
-    if not stripe_customer_id:
-        customer, err = create_customer(email=email, name=name)
-        if not customer:
-            return jsonify({'success': False, 'message': f'Fout bij aanmaken Stripe klant: {err}'}), 400
-        stripe_customer_id = customer['id']
-        conn.execute('UPDATE users SET stripe_customer_id = ? WHERE id = ?', (stripe_customer_id, user_id))
-        conn.commit()
-    conn.close()
-    # Maak payment intent aan
-    metadata = {'user_id': user_id, 'email': email}
-    intent, err = create_payment_intent(metadata=metadata)
-    if not intent:
+    # Hergebruikt de openstaande intent van de gebruiker; alleen zonder die intent gaat er een aanroep naar Stripe
+    client_secret, err = payment_ledger.open_intent(current_user.id, current_user.email)
+    if not client_secret:
         return jsonify({'success': False, 'message': f'Fout bij aanmaken betaling: {err}'}), 400
-    # Sla payment intent op in payments tabel
-    conn = get_db_connection()
-    conn.execute('''INSERT OR IGNORE INTO payments (user_id, stripe_payment_intent_id, stripe_customer_id, amount, currency, status, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)''',
-        (user_id, intent['id'], stripe_customer_id, intent['amount'], intent['currency'], intent['status'], json.dumps(metadata)))
-    conn.commit()
-    conn.close()
-    return jsonify({'success': True, 'client_secret': intent['client_secret']})
+    return jsonify({'success': True, 'client_secret': client_secret})
 
 @app.route('/payment-success')
 @login_required
@@ -1626,19 +1488,12 @@ def payment_success():
     if not payment_intent_id:
         flash('Geen payment_intent_id opgegeven.', 'error')
         return redirect(url_for('betaal'))
-    # Controleer status bij Stripe
-    intent = get_payment_intent(payment_intent_id)
-    if not intent or intent['status'] != 'succeeded':
-        flash('Betaling niet succesvol of niet gevonden.', 'error')
+    # Status uit het grootboek (bijgewerkt door de webhook); alleen als die er nog niet is, bij Stripe
+    ok, err = payment_ledger.confirm(current_user.id, payment_intent_id)
+    user_cache.invalidate(current_user.id)
+    if not ok:
+        flash(err, 'error')
         return redirect(url_for('betaal'))
-    # Markeer gebruiker als betaald
-    conn = get_db_connection()
-    conn.execute('UPDATE users SET is_paid_user = 1, subscription_status = ?, subscription_expires = ? WHERE id = ?',
-        ('active', (datetime.now() + timedelta(days=365)).strftime('%Y-%m-%d %H:%M:%S'), current_user.id))
-    conn.execute('UPDATE payments SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE stripe_payment_intent_id = ?',
-        ('succeeded', payment_intent_id))
-    conn.commit()
-    conn.close()
     flash('Betaling succesvol! Je hebt nu toegang tot de tool.', 'success')
     return redirect(url_for('form'))
 
@@ -1650,32 +1505,12 @@ def stripe_webhook():
     if not event:
         logging.error(f"Stripe webhook signature error: {err}")
         return 'Invalid signature', 400
-    # Verwerk relevante Stripe events
-    if event['type'] == 'payment_intent.succeeded':
-        intent = event['data']['object']
-        payment_intent_id = intent['id']
-        metadata = intent.get('metadata', {})
-        user_id = metadata.get('user_id')
-        # Update payment en gebruiker
-        conn = get_db_connection()
-        conn.execute('UPDATE payments SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE stripe_payment_intent_id = ?',
-            ('succeeded', payment_intent_id))
-        if user_id:
-            conn.execute('UPDATE users SET is_paid_user = 1, subscription_status = ?, subscription_expires = ? WHERE id = ?',
-                ('active', (datetime.now() + timedelta(days=365)).strftime('%Y-%m-%d %H:%M:%S'), user_id))
-        conn.commit()
-        conn.close()
-        logging.info(f"PaymentIntent {payment_intent_id} succeeded, user {user_id} geactiveerd.")
-    elif event['type'] == 'payment_intent.payment_failed':
-        intent = event['data']['object']
-        payment_intent_id = intent['id']
-        conn = get_db_connection()
-        conn.execute('UPDATE payments SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE stripe_payment_intent_id = ?',
-            ('failed', payment_intent_id))
-        conn.commit()
-        conn.close()
-        logging.info(f"PaymentIntent {payment_intent_id} failed.")
-    # Andere events kunnen hier worden toegevoegd
+    # Alleen vastleggen en direct bevestigen; de inbox verwerkt het event op de achtergrond (één keer per event-id)
+    try:
+        stripe_events.receive(payload)
+    except Exception as e:
+        logging.error(f"Stripe webhook {event['id']} niet vastgelegd: {e}")
+        return 'Event niet opgeslagen', 500  # Stripe probeert het later opnieuw
     return '', 200
 
 if __name__ == '__main__':
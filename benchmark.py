@@ -0,0 +1,328 @@
+"""
+Benchmarks voor de ATK-WPBR Tool.
+
+Gebruik:
+    python benchmark.py                # alle benchmarks
+    python benchmark.py signature      # alleen de handtekening-opschoning
+    python benchmark.py backends       # imaging backends (Pillow/pyvips) vergelijken
+    python benchmark.py docx           # gecompileerd Word template vs. python-docx
+    python benchmark.py email          # Jinja e-mailtemplates vs. f-string HTML
+    python benchmark.py transport      # mailtransports (memory/file/smtp/http): berichten per seconde
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def make_signature_photo(width=3024, height=1512, seed=0):
+    """Synthetische telefoonfoto van een handtekening: grijs papier met lichtverloop, kleurruis en een pennenstreek."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    shade = 150 + 60 * (xx / width) - 30 * (yy / height)
+    rgb = np.stack([shade + 8, shade + 4, shade], axis=-1) + rng.normal(0, 6, (height, width, 3))
+    photo = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), 'RGB')
+    draw = ImageDraw.Draw(photo)
+    t = np.linspace(0, 4 * np.pi, 400)
+    points = list(zip(width * (0.2 + 0.6 * t / t[-1]), height * (0.5 + 0.15 * np.sin(3 * t) * np.cos(t / 2))))
+    draw.line(points, fill=(30, 30, 60), width=max(4, width // 300))
+    return photo.filter(ImageFilter.GaussianBlur(1))
+
+
+def _jpeg_bytes(image, quality=90):
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def make_pasfoto_photo(width=4032, height=3024, seed=1):
+    """Synthetische telefoonfoto (12 MP, liggend) met een gezicht-achtig ovaal op een egale achtergrond."""
+    rng = np.random.default_rng(seed)
+    rgb = rng.normal(210, 8, (height, width, 3))
+    photo = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), 'RGB')
+    draw = ImageDraw.Draw(photo)
+    draw.ellipse((width * 0.4, height * 0.2, width * 0.6, height * 0.7), fill=(200, 150, 120))
+    draw.rectangle((width * 0.3, height * 0.7, width * 0.7, height), fill=(40, 40, 80))
+    return photo
+
+
+def make_logo(width=2000, height=800):
+    """Bedrijfslogo als RGBA PNG met tekstvlakken."""
+    logo = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(logo)
+    draw.rounded_rectangle((50, 50, width - 50, height - 50), radius=80, fill=(0, 60, 116, 255))
+    for i in range(6):
+        draw.rectangle((200 + i * 280, 300, 400 + i * 280, 500), fill=(255, 200, 0, 255))
+    return logo
+
+
+def _png_bytes(image):
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def bench_signature(rounds=10):
+    """Doorvoer en bestandsgrootte van de handtekening-opschoning t.o.v. alleen resizen."""
+    from modules.imaging import fit_size, process_image
+
+    print("\n=== Benchmark: handtekening opschonen ===")
+    contents = _jpeg_bytes(make_signature_photo())
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        image = Image.open(io.BytesIO(contents))
+        image = image.resize(fit_size(image.size, 'handtekening'), Image.LANCZOS)
+        legacy = _jpeg_bytes(image, quality=85)
+    legacy_s = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = process_image(contents, 'handtekening', 'handtekening.jpg', backend='pillow')
+    cleaned_s = (time.perf_counter() - start) / rounds
+    cleaned = result['data']
+
+    width, height = Image.open(io.BytesIO(contents)).size
+    megapixels = width * height / 1e6
+    print(f"Invoer:            {len(contents) / 1024:.0f} KB JPEG, {megapixels:.1f} MP")
+    print(f"Alleen resizen:    {legacy_s * 1000:.1f} ms/afbeelding, {len(legacy) / 1024:.1f} KB")
+    print(f"Opschonen (1-bit): {cleaned_s * 1000:.1f} ms/afbeelding, {len(cleaned) / 1024:.1f} KB "
+          f"({megapixels / cleaned_s:.1f} MP/s), {result['size'][0]}x{result['size'][1]}")
+    print(f"Verkleining:       {len(legacy) / len(cleaned):.1f}x t.o.v. resizen, {len(contents) / len(cleaned):.1f}x t.o.v. upload")
+
+
+def bench_backends(rounds=5):
+    """Vergelijk de imaging backends op uploads van realistische grootte."""
+    from modules.imaging import available_backends, process_image
+
+    print("\n=== Benchmark: imaging backends ===")
+    uploads = [
+        ('pasfoto', 'pasfoto.jpg', _jpeg_bytes(make_pasfoto_photo())),
+        ('handtekening', 'handtekening.jpg', _jpeg_bytes(make_signature_photo())),
+        ('bedrijfslogo', 'logo.png', _png_bytes(make_logo())),
+    ]
+    backends = available_backends()
+    if 'vips' not in backends:
+        print("pyvips niet geïnstalleerd: alleen Pillow wordt gemeten.")
+    for image_type, filename, contents in uploads:
+        print(f"{image_type} ({len(contents) / 1024:.0f} KB):")
+        for name in backends:
+            process_image(contents, image_type, filename, backend=name)  # opwarmen
+            start = time.perf_counter()
+            for _ in range(rounds):
+                result = process_image(contents, image_type, filename, backend=name)
+            elapsed = (time.perf_counter() - start) / rounds
+            print(f"  {name:<7} {elapsed * 1000:7.1f} ms  -> {result['size'][0]}x{result['size'][1]}, {len(result['data']) / 1024:.1f} KB")
+
+
+def bench_docx(rounds=50):
+    """Word-aanvraagformulier invullen: gecompileerd template t.o.v. de python-docx implementatie."""
+    from modules.docx_template import CompiledTemplate
+    from modules.word_generator import generate_word_python_docx
+
+    print("\n=== Benchmark: Word template invullen ===")
+    template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'atk_template.docx')
+    start = time.perf_counter()
+    template = CompiledTemplate(template_path)
+    compile_s = time.perf_counter() - start
+    data = {key: f"Waarde {key}" for key in sorted(template.placeholders)}
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.docx')
+        compiled_path = os.path.join(tmp, 'compiled.docx')
+        start = time.perf_counter()
+        for _ in range(rounds):
+            generate_word_python_docx(data, template_path, legacy_path)
+        legacy_s = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for _ in range(rounds):
+            template.render(data, compiled_path)
+        compiled_s = (time.perf_counter() - start) / rounds
+        print(f"Placeholders:  {len(template.placeholders)}, compileren eenmalig {compile_s * 1000:.1f} ms")
+        print(f"python-docx:   {legacy_s * 1000:.1f} ms/document, {os.path.getsize(legacy_path) / 1024:.1f} KB")
+        print(f"Gecompileerd:  {compiled_s * 1000:.1f} ms/document, {os.path.getsize(compiled_path) / 1024:.1f} KB")
+        print(f"Versnelling:   {legacy_s / compiled_s:.1f}x")
+
+
+def _legacy_department_email(ctx, bijlagen, user_email, tracking_pixel_url):
+    """Oorspronkelijke f-string opbouw uit verzenden(), inclusief het achteraf invoegen van de pixel."""
+    html_body = f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <title>Aanvraag Beveiligingspas</title>
+            <style>
+                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+                .header {{ background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin-bottom: 20px; }}
+                .section {{ margin-bottom: 20px; }}
+                .footer {{ background-color: #f8f9fa; padding: 15px; border-radius: 5px; margin-top: 20px; font-size: 12px; }}
+                .reply-notice {{ background-color: #e3f2fd; padding: 15px; border-left: 4px solid #2196f3; margin-top: 20px; }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <h2>Aanvraag Beveiligingspas</h2>
+                    <p><strong>Datum:</strong> {ctx['datum']}</p>
+                </div>
+                <div class="section">
+                    <h3>Persoonlijke gegevens</h3>
+                    <p><strong>Medewerker:</strong> {ctx['naam']}</p>
+                    <p><strong>Bedrijf:</strong> {ctx['bedrijfsnaam']}</p>
+                    <p><strong>Vergunningnummer:</strong> {ctx['vergunning']}</p>
+                    <p><strong>Datum aanvraag:</strong> {ctx['datum_aanvraag']}</p>
+                    <p><strong>Type aanvraag:</strong> {ctx['type_aanvraag']}</p>
+                    <p><strong>Afdeling:</strong> {ctx['afdeling']}</p>
+                </div>
+                <div class="section">
+                    <h3>Bijlagen</h3>
+                    <ul>
+        """
+    for key, filename in bijlagen:
+        html_body += f"<li>{key}: {filename}</li>"
+    html_body += f"""
+                    </ul>
+                </div>
+                <div class="reply-notice">
+                    <p><strong>Belangrijk:</strong> Antwoord op deze email wordt verwacht op: <a href="mailto:{user_email}">{user_email}</a></p>
+                </div>
+                <div class="footer">
+                    <p>Deze aanvraag is automatisch gegenereerd door de ATK-WPBR Tool.</p>
+                    <p>Met vriendelijke groet,<br>ATK-WPBR Tool</p>
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+    body = f"""
+        Aanvraag Beveiligingspas
+        ========================
+        Datum: {ctx['datum']}
+        Medewerker: {ctx['naam']}
+        Bedrijf: {ctx['bedrijfsnaam']}
+        Vergunningnummer: {ctx['vergunning']}
+        Datum aanvraag: {ctx['datum_aanvraag']}
+        Type aanvraag: {ctx['type_aanvraag']}
+        Afdeling: {ctx['afdeling']}
+        Bijlagen: {', '.join(f for _, f in bijlagen)}
+        BELANGRIJK: Antwoord op deze email wordt verwacht op: {user_email}
+        """
+    tracking_pixel = f'<img src="{tracking_pixel_url}" width="1" height="1" style="display:none;" />'
+    html_body = html_body.replace('</body>', f'{tracking_pixel}</body>')
+    return body, html_body
+
+
+def _measure(func, rounds):
+    """Gemiddelde tijd per aanroep en de geheugenpiek (tracemalloc) van één aanroep."""
+    func()  # opwarmen
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    elapsed = (time.perf_counter() - start) / rounds
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_email(rounds=2000):
+    """Render de aanvraagmail: voorgecompileerde Jinja templates t.o.v. de oude f-string opbouw."""
+    from modules.email_templates import get_email_environment, render_email
+    from modules.form_schema import convert_form
+
+    print("\n=== Benchmark: e-mail renderen ===")
+    start = time.perf_counter()
+    get_email_environment()
+    compile_s = time.perf_counter() - start
+    ctx = convert_form({'voornamen': 'Jan', 'achternaam': 'Jansen', 'bedrijfsnaam': 'Beveiliging & Co',
+                        'vergunning_type': 'ND', 'vergunning_nummer': '1234', 'datum_aanvraag': '01-01-2026',
+                        'type_aanvraag': 'Eerste aanvraag', 'afdeling_select': 'Amsterdam'}).email
+    bijlagen = [(f'bijlage_{i}', f'document_{i}.pdf') for i in range(10)]
+    pixel = 'https://example.org/email-tracking/abc'
+    datum = '01-01-2026 10:00'
+
+    def legacy():
+        return _legacy_department_email(dict(ctx, datum=datum), bijlagen, 'klant@example.org', pixel)
+
+    def jinja():
+        return render_email('aanvraag', form=ctx, datum=datum, bijlagen=bijlagen,
+                            reply_to='klant@example.org', tracking_pixel_url=pixel)
+
+    print(f"Templates compileren (eenmalig): {compile_s * 1000:.1f} ms")
+    for name, func in [('f-string', legacy), ('Jinja', jinja)]:
+        elapsed, peak = _measure(func, rounds)
+        print(f"{name:<9} {elapsed * 1e6:7.1f} µs/bericht, geheugenpiek {peak / 1024:6.1f} KB")
+
+
+def bench_transport(messages=200, size=50_000):
+    """Doorvoer van de mailtransports met een gespoold bericht, bij 1, 4 en 8 gelijktijdige verzenders."""
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    from standins import LocalHTTPMailServer, LocalSMTPServer
+    from modules.mail_transport import FileTransport, HTTPTransport, MemoryTransport, SMTPTransport
+    from modules.smtp_pool import SMTPPool
+
+    print(f"\n=== Benchmark: mailtransport ({messages} berichten van {size // 1000} KB) ===")
+    directory = tempfile.mkdtemp(prefix='bench_transport_')
+    spool_path = os.path.join(directory, 'bericht.eml')
+    with open(spool_path, 'wb') as f:
+        f.write(b'From: aanvraag@example.org\r\nTo: afdeling@example.org\r\nSubject: Benchmark\r\n\r\n')
+        f.write(b'x' * 76 + b'\r\n' * (size // 78))
+    smtp_server = LocalSMTPServer()
+    smtp_server.store = False
+    http_server = LocalHTTPMailServer()
+    http_server.store = False
+    try:
+        for threads in (1, 4, 8):
+            pool = SMTPPool('127.0.0.1', smtp_server.port, starttls=False, size=threads)
+            transports = [
+                MemoryTransport(),
+                FileTransport(os.path.join(directory, f'capture{threads}')),
+                SMTPTransport(pool),
+                HTTPTransport(http_server.url, http_server.api_key),
+            ]
+            for transport in transports:
+                def send(_):
+                    transport.send_file('aanvraag@example.org', ['afdeling@example.org'], spool_path)
+
+                with ThreadPoolExecutor(threads) as executor:
+                    list(executor.map(send, range(threads)))  # opwarmen: verbindingen openen
+                    start = time.perf_counter()
+                    list(executor.map(send, range(messages)))
+                    elapsed = time.perf_counter() - start
+                print(f"{transport.name:<7} {threads} thread(s): {messages / elapsed:8.0f} berichten/s")
+            pool.close()
+    finally:
+        smtp_server.stop()
+        http_server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+BENCHMARKS = {
+    'signature': bench_signature,
+    'backends': bench_backends,
+    'docx': bench_docx,
+    'email': bench_email,
+    'transport': bench_transport,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Onbekende benchmark: {name}. Kies uit: {', '.join(BENCHMARKS)}")
+            return 1
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+"""
+Gunicorn-configuratie; `gunicorn app:app` leest dit bestand automatisch uit de werkmap.
+
+De bevestigingspagina houdt een server-sent events-stream open (/email-events).
+Met de standaard sync workers kost elke open pagina een hele worker. Met
+gthread bedient elke worker GUNICORN_THREADS requests tegelijk, zodat een
+kijker alleen een thread bezet houdt. Draait de app toch met sync workers,
+dan valt /email-events terug op een korte long-poll (zie modules/email_events.py).
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:8000')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+# Per worker: open streams plus gewone requests
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+# Bij gthread bewaakt timeout de worker zelf, niet de duur van een request (streams duren tot 120 s)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
@@ -0,0 +1,166 @@
+"""
+Bijlagenbudget voor uitgaande e-mail.
+
+Berekent vóór het verzenden hoe groot het MIME-bericht wordt (base64 met
+regelafbrekingen plus headers per part). Past het niet binnen MAX_EMAIL_BYTES,
+dan worden afbeeldingen en PDF-scans stap voor stap opnieuw gecomprimeerd
+(eerst kwaliteit, daarna resolutie), grootste bestanden eerst, totdat het
+bericht past. Zo wordt een te groot bericht niet pas door de mailserver
+geweigerd.
+"""
+import logging
+import math
+import os
+
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+
+MAX_EMAIL_BYTES = int(os.getenv('MAX_EMAIL_BYTES', 20 * 1024 * 1024))  # 20MB incl. base64
+
+# Overhead per MIME-part (boundary, Content-Type, Content-Disposition, ...)
+PART_OVERHEAD_BYTES = 400
+# Vaste overhead voor de message headers en multipart-structuur
+MESSAGE_OVERHEAD_BYTES = 2048
+
+# Compressiestappen: (JPEG-kwaliteit, schaalfactor), steeds agressiever
+COMPRESSION_STEPS = [
+    (80, 1.0),
+    (70, 0.85),
+    (60, 0.7),
+    (50, 0.55),
+    (40, 0.4),
+]
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+PDF_EXTENSIONS = {'.pdf'}
+
+
+def encoded_size(raw_bytes):
+    """Grootte na base64-codering met regels van 76 tekens en CRLF."""
+    encoded = 4 * math.ceil(raw_bytes / 3)
+    return encoded + 2 * math.ceil(encoded / 76)
+
+
+def estimate_message_size(attachment_paths, bodies=()):
+    """Geschatte grootte van het volledige MIME-bericht in bytes."""
+    size = MESSAGE_OVERHEAD_BYTES
+    for body in bodies:
+        if body:
+            size += encoded_size(len(body.encode('utf-8'))) + PART_OVERHEAD_BYTES
+    for path in attachment_paths:
+        size += encoded_size(os.path.getsize(path)) + PART_OVERHEAD_BYTES
+    return size
+
+
+def _to_rgb(image):
+    """RGB voor JPEG; transparante pixels (logo's, scans als PNG) worden wit in plaats van zwart."""
+    if image.mode in ('RGBA', 'LA', 'PA', 'La', 'RGBa') or 'transparency' in image.info:
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _recompress_image(path, quality, scale, output_dir):
+    """Schrijf een opnieuw gecomprimeerde JPEG (altijd vanaf het origineel) naar output_dir."""
+    with Image.open(path) as image:
+        if image.mode in ('1', 'P') and os.path.splitext(path)[1].lower() == '.png':
+            return None  # Handtekeningen e.d. zijn al klein en verliezen leesbaarheid als JPEG
+        image = _to_rgb(image)
+        if scale < 1.0:
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+        name = os.path.splitext(os.path.basename(path))[0]
+        out_path = os.path.join(output_dir, f"{name}.jpg")
+        image.save(out_path, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return out_path
+
+
+def _recompress_pdf(path, quality, scale, output_dir):
+    """Downsample de afbeeldingen in een PDF-scan en comprimeer de content streams."""
+    writer = PdfWriter(clone_from=PdfReader(path))
+    for page in writer.pages:
+        for image_file in page.images:
+            try:
+                image = image_file.image
+                if image.mode in ('1', 'P'):
+                    continue  # Handtekening en andere 1-bit/palet-afbeeldingen: als JPEG groter en onscherper
+                if scale < 1.0:
+                    image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.LANCZOS)
+                if image.mode not in ('RGB', 'L'):
+                    image = _to_rgb(image)
+                image_file.replace(image, quality=quality)
+            except Exception as e:
+                logging.warning(f"Afbeelding in {os.path.basename(path)} niet gecomprimeerd: {e}")
+        page.compress_content_streams()
+    out_path = os.path.join(output_dir, os.path.basename(path))
+    with open(out_path, 'wb') as f:
+        writer.write(f)
+    return out_path
+
+
+def _recompress(path, quality, scale, output_dir):
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext in IMAGE_EXTENSIONS:
+            return _recompress_image(path, quality, scale, output_dir)
+        if ext in PDF_EXTENSIONS:
+            return _recompress_pdf(path, quality, scale, output_dir)
+    except Exception as e:
+        logging.error(f"Fout bij comprimeren van {os.path.basename(path)}: {e}")
+    return None
+
+
+def fit_attachments(attachment_paths, output_dir, bodies=(), limit=None):
+    """
+    Zorg dat het bericht binnen limit past. Gecomprimeerde kopieën worden in output_dir geschreven
+    (originelen blijven staan). Return dict met 'success', 'attachments', 'size', 'original_size',
+    'limit', 'steps' (lijst van toegepaste compressies) en 'error'.
+    """
+    limit = limit or MAX_EMAIL_BYTES
+    originals = list(attachment_paths)
+    current = {path: path for path in originals}
+    original_size = estimate_message_size(originals, bodies)
+    size = original_size
+    steps = []
+    if size > limit:
+        logging.info(f"E-mail te groot ({size} > {limit} bytes), bijlagen worden gecomprimeerd")
+        compressible = [p for p in originals if os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS | PDF_EXTENSIONS]
+        compressible.sort(key=os.path.getsize, reverse=True)
+        for step, (quality, scale) in enumerate(COMPRESSION_STEPS, start=1):
+            # Eigen map per stap: de bestandsnaam (= naam van de bijlage) blijft gelijk
+            step_dir = os.path.join(output_dir, f"stap{step}")
+            os.makedirs(step_dir, exist_ok=True)
+            for path in compressible:
+                if size <= limit:
+                    break
+                new_path = _recompress(path, quality, scale, step_dir)
+                if not new_path:
+                    continue
+                old_size = os.path.getsize(current[path])
+                new_size = os.path.getsize(new_path)
+                if new_size >= old_size:
+                    continue
+                current[path] = new_path
+                size -= encoded_size(old_size) - encoded_size(new_size)
+                steps.append({'file': os.path.basename(path), 'quality': quality, 'scale': scale,
+                              'from_bytes': old_size, 'to_bytes': new_size})
+            if size <= limit:
+                break
+    attachments = [current[path] for path in originals]
+    result = {
+        'success': size <= limit,
+        'attachments': attachments,
+        'size': size,
+        'original_size': original_size,
+        'limit': limit,
+        'steps': steps,
+        'error': None,
+    }
+    if not result['success']:
+        result['error'] = (f"De bijlagen zijn samen te groot om te verzenden ({size / 1024 / 1024:.1f} MB, "
+                           f"maximaal {limit / 1024 / 1024:.1f} MB).")
+        logging.error(result['error'])
+    elif steps:
+        logging.info(f"Bijlagen gecomprimeerd van {original_size} naar {size} bytes in {len(steps)} stappen")
+    return result
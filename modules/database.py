@@ -0,0 +1,82 @@
+"""
+Schema van de sqlite-database (users.db) voor de tabellen van de app zelf.
+
+init_db() maakt de tabellen aan en voegt kolommen toe die later zijn
+bijgekomen; het is veilig om bij elke start aan te roepen. De app roept het
+aan voor DATABASE_PATH, tests voor een eigen database. Tabellen van de
+mailqueue, de Stripe-inbox en de e-maileventhub maken die modules zelf aan.
+"""
+import os
+import sqlite3
+
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'users.db')
+
+
+def init_db(db_path=DATABASE_PATH):
+    """Maak users, email_tracking en payments aan (of werk ze bij) in db_path."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute('''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            hashed_password TEXT NOT NULL,
+            vergunningnummer TEXT,
+            terms_accepted BOOLEAN DEFAULT 0,
+            privacy_accepted BOOLEAN DEFAULT 0,
+            terms_accepted_date TIMESTAMP,
+            privacy_accepted_date TIMESTAMP,
+            telefoon TEXT,
+            is_paid_user BOOLEAN DEFAULT 0,
+            email_verified BOOLEAN DEFAULT 0,
+            verification_token TEXT,
+            verification_token_expires TIMESTAMP,
+            stripe_customer_id TEXT,
+            subscription_status TEXT DEFAULT 'inactive',
+            subscription_expires TIMESTAMP
+        )''')
+
+        # Email tracking tabel voor lees- en ontvangstbevestiging
+        conn.execute('''CREATE TABLE IF NOT EXISTS email_tracking (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email_id TEXT UNIQUE NOT NULL,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            delivered_at TIMESTAMP,
+            read_at TIMESTAMP,
+            read_count INTEGER DEFAULT 0,
+            user_id INTEGER,
+            form_data_id TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+        # Afleverstatus uit de mailqueue (bestaande rijen zijn al verzonden)
+        for column in ("status TEXT DEFAULT 'sent'", 'attempts INTEGER DEFAULT 0', 'last_error TEXT'):
+            try:
+                conn.execute(f'ALTER TABLE email_tracking ADD COLUMN {column}')
+            except sqlite3.OperationalError:
+                pass
+
+        # Betalingsinformatie tabel
+        conn.execute('''CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            stripe_payment_intent_id TEXT UNIQUE NOT NULL,
+            stripe_customer_id TEXT,
+            amount INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            metadata TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''')
+        # client_secret om een openstaande PaymentIntent te hergebruiken
+        try:
+            conn.execute('ALTER TABLE payments ADD COLUMN client_secret TEXT')
+        except sqlite3.OperationalError:
+            pass
+
+        conn.commit()
+    finally:
+        conn.close()
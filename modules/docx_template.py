@@ -0,0 +1,181 @@
+"""
+Gecompileerde DOCX-templates.
+
+Het template wordt één keer ingelezen: per XML-part worden alle {{placeholders}}
+opgezocht, ook als Word ze over meerdere runs (<w:t>-elementen) heeft verdeeld.
+Het resultaat is een invulplan: een lijst van letterlijke XML-stukken en slots.
+Renderen is daarna één doorloop die de gepatchte parts direct in een nieuw
+zip-bestand schrijft; python-docx is daarvoor niet meer nodig.
+
+Bij het compileren wordt het package eerst verkleind (zie docx_optimizer) en
+elk document wordt met maximale deflate-compressie geschreven.
+"""
+import bisect
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import zipfile
+from xml.sax.saxutils import escape
+
+from .docx_optimizer import optimize_package
+
+DOCX_OPTIMIZE = os.getenv('DOCX_OPTIMIZE', '1') != '0'
+DOCX_COMPRESSLEVEL = int(os.getenv('DOCX_COMPRESSLEVEL', 9))
+
+PLACEHOLDER_RE = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+TEXT_RE = re.compile(r'(<w:t(?:\s[^>]*)?>)([^<]*)(</w:t>)')
+PARAGRAPH_END = '</w:p>'
+PRESERVE_ATTR = 'xml:space="preserve"'
+# Een regeleinde in een waarde wordt een <w:br/> binnen dezelfde run
+LINE_BREAK = f'</w:t><w:br/><w:t {PRESERVE_ATTR}>'
+
+
+class CompiledTemplate:
+    """Invulplan voor een DOCX-template; render() schrijft een ingevuld document."""
+
+    def __init__(self, path, optimize=DOCX_OPTIMIZE):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.entries = []  # (ZipInfo, bytes) voor ongewijzigde parts, (ZipInfo, segmenten) voor templates
+        self.placeholders = set()
+        with open(path, 'rb') as f:
+            raw = f.read()
+        # Versie = inhoud van het template; onderdeel van de cache-sleutel voor gerenderde documenten
+        self.version = hashlib.sha256(raw).hexdigest()[:16] + ('-opt' if optimize else '')
+        with zipfile.ZipFile(io.BytesIO(raw)) as source:
+            infos = source.infolist()
+            parts = {info.filename: source.read(info) for info in infos}
+        self.report = {'removed_parts': [], 'template_bytes': len(raw)}
+        if optimize:
+            parts, report = optimize_package(parts)
+            self.report.update(report)
+        for info in infos:
+            data = parts.get(info.filename)
+            if data is None:
+                continue
+            segments = None
+            if info.filename.startswith('word/') and info.filename.endswith('.xml') and b'{{' in data:
+                segments = self._compile_part(data.decode('utf-8'))
+            self.entries.append((info, segments if segments is not None else data))
+        # Grootte van een document zonder ingevulde waarden t.o.v. het originele template
+        output = io.BytesIO()
+        self.render({}, output)
+        self.report['output_bytes'] = output.tell()
+        self.report['saved_bytes'] = len(raw) - self.report['output_bytes']
+        logging.info(f"DOCX-template {path} gecompileerd: {len(self.placeholders)} placeholders, "
+                     f"{len(self.report['removed_parts'])} parts verwijderd, "
+                     f"{self.report['saved_bytes']} bytes kleiner per document")
+
+    def _compile_part(self, xml):
+        """Splits een XML-part in letterlijke stukken en (key, origineel)-slots. None zonder placeholders."""
+        texts = list(TEXT_RE.finditer(xml))
+        if not texts:
+            return None
+        paragraph_ends = [m.start() for m in re.finditer(re.escape(PARAGRAPH_END), xml)]
+        # Aaneengeschakelde tekst van alle <w:t>, met per element de offset in die tekst
+        offsets = []
+        joined = []
+        position = 0
+        for match in texts:
+            offsets.append(position)
+            joined.append(match.group(2))
+            position += len(match.group(2))
+        full_text = ''.join(joined)
+
+        # Per <w:t>: lijst van (start, end, vervanging) binnen de eigen tekst
+        edits = {}
+        for match in PLACEHOLDER_RE.finditer(full_text):
+            first = bisect.bisect_right(offsets, match.start()) - 1
+            last = bisect.bisect_right(offsets, match.end() - 1) - 1
+            # Een placeholder mag niet over een alinea-grens lopen
+            if (bisect.bisect_left(paragraph_ends, texts[first].start())
+                    != bisect.bisect_left(paragraph_ends, texts[last].start())):
+                continue
+            key = match.group(1)
+            self.placeholders.add(key)
+            for index in range(first, last + 1):
+                start = max(match.start() - offsets[index], 0)
+                end = min(match.end() - offsets[index], len(texts[index].group(2)))
+                slot = (key, match.group(0)) if index == first else None
+                edits.setdefault(index, []).append((start, end, slot))
+        if not edits:
+            return None
+
+        segments = []
+        cursor = 0
+        for index, match in enumerate(texts):
+            if index not in edits:
+                continue
+            open_tag, text, close_tag = match.group(1), match.group(2), match.group(3)
+            segments.append(xml[cursor:match.start()])
+            if PRESERVE_ATTR not in open_tag:
+                open_tag = open_tag[:-1] + f' {PRESERVE_ATTR}>'
+            segments.append(open_tag)
+            text_cursor = 0
+            for start, end, slot in edits[index]:
+                segments.append(text[text_cursor:start])
+                if slot is not None:
+                    segments.append(slot)
+                text_cursor = end
+            segments.append(text[text_cursor:])
+            segments.append(close_tag)
+            cursor = match.end()
+        segments.append(xml[cursor:])
+
+        # Aangrenzende letterlijke stukken samenvoegen
+        merged = []
+        for segment in segments:
+            if isinstance(segment, str) and merged and isinstance(merged[-1], str):
+                merged[-1] += segment
+            elif segment != '':
+                merged.append(segment)
+        return merged
+
+    @staticmethod
+    def _render_part(segments, data):
+        for segment in segments:
+            if isinstance(segment, str):
+                yield segment
+                continue
+            key, original = segment
+            value = data.get(key)
+            if value is None:
+                yield original  # Onbekende placeholder blijft staan, zoals voorheen
+            else:
+                yield escape(str(value)).replace('\n', LINE_BREAK)
+
+    def render(self, data, output_path, compresslevel=DOCX_COMPRESSLEVEL):
+        """Vul het template in met data en schrijf het document naar output_path (pad of file-object)."""
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as target:
+            for info, content in self.entries:
+                entry = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                entry.compress_type = zipfile.ZIP_DEFLATED if info.compress_type != zipfile.ZIP_STORED else zipfile.ZIP_STORED
+                entry.external_attr = info.external_attr
+                if isinstance(content, bytes):
+                    target.writestr(entry, content)
+                    continue
+                with target.open(entry, 'w') as part:
+                    for chunk in self._render_part(content, data):
+                        part.write(chunk.encode('utf-8'))
+        return output_path
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def compile_template(path):
+    """Gecompileerd template voor path; opnieuw compileren als het bestand is gewijzigd."""
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    template = _templates.get(path)
+    if template is None or template.mtime != mtime:
+        with _templates_lock:
+            template = _templates.get(path)
+            if template is None or template.mtime != mtime:
+                template = CompiledTemplate(path)
+                _templates[path] = template
+    return template
@@ -1,5 +1,23 @@
+"""
+SMTP-configuratie voor de verzendpaden.
+
+De configuratie (server, poort, gebruiker, wachtwoord) komt uit de omgeving en
+het .env bestand; SMTP_PASSWORD kan met SMTP_KEY versleuteld zijn (AES-CBC).
+MailConfig leest en ontsleutelt alles één keer en houdt het resultaat in het
+geheugen, zodat een verzending geen bestand of crypto meer aanraakt. Opnieuw
+laden gebeurt op de achtergrond: bij SIGHUP of als de mtime van .env wijzigt
+(gecontroleerd door een watcher-thread). Variabelen die bij het starten al in
+de omgeving stonden gaan voor op .env, net als bij load_dotenv().
+
+Dit is de enige module die .env in os.environ zet (bij het importeren, direct
+na het vastleggen van de echte procesomgeving). Modules met os.getenv-
+constanten zoals stripe_config importeren deze module daarom eerst.
+"""
+import logging
 import os
-from dotenv import load_dotenv
+import signal
+import threading
+from dotenv import dotenv_values, load_dotenv
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 import base64
@@ -34,20 +52,180 @@ def encrypt_aes(plaintext, key_b64):
     ct = encryptor.update(padded_data) + encryptor.finalize()
     return base64.b64encode(iv + ct).decode('utf-8')
 
-def get_smtp_config():
-    load_dotenv()
-    smtp_password_enc = os.getenv('SMTP_PASSWORD')
-    smtp_key = os.getenv('SMTP_KEY')
+
+DOTENV_PATH = os.getenv('DOTENV_PATH') or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
+CONFIG_WATCH_SECONDS = float(os.getenv('CONFIG_WATCH_SECONDS', 5))
+PASSWORD_PLACEHOLDER = 'VUL_HIER_HET_WACHTWOORD_IN'
+
+# De echte procesomgeving, vóórdat .env in os.environ komt
+_PROCESS_ENV = dict(os.environ)
+# Voor de os.getenv-constanten van de andere modules (SECRET_KEY, STRIPE_*, ...); bestaande variabelen gaan voor
+load_dotenv(DOTENV_PATH)
+
+
+def _truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def resolve_config(env):
+    """Alle mailaccounts uit een omgeving (dict): {'default': {...}, 'gmail': {...}}."""
+    smtp_password_enc = env.get('SMTP_PASSWORD')
+    smtp_key = env.get('SMTP_KEY')
     if smtp_password_enc and smtp_key:
         try:
             password = decrypt_aes(smtp_password_enc, smtp_key)
         except Exception:
-            password = 'VUL_HIER_HET_WACHTWOORD_IN'
+            logging.warning("SMTP_PASSWORD kon niet worden ontsleuteld met SMTP_KEY")
+            password = PASSWORD_PLACEHOLDER
     else:
-        password = os.getenv('SMTP_PASSWORD', 'VUL_HIER_HET_WACHTWOORD_IN')
+        password = env.get('SMTP_PASSWORD', PASSWORD_PLACEHOLDER)
+    user = env.get('SMTP_USER', 'aanvraag@atk-wpbr.nl')
+    # Verzendbackend (zie modules/mail_transport.py), gelijk voor beide accounts
+    transport = {
+        'transport': env.get('MAIL_TRANSPORT', 'smtp').lower(),
+        'capture_dir': env.get('MAIL_CAPTURE_DIR', 'mail_capture'),
+        'http_url': env.get('MAIL_HTTP_URL'),
+        'http_api_key': env.get('MAIL_HTTP_API_KEY'),
+    }
+    rate_burst = int(env.get('MAIL_RATE_BURST', 5))  # berichten die na een rustige periode direct achter elkaar mogen
     return {
-        'server': os.getenv('SMTP_SERVER', 'smtp.strato.com'),
-        'port': int(os.getenv('SMTP_PORT', 587)),
-        'user': os.getenv('SMTP_USER', 'aanvraag@atk-wpbr.nl'),
-        'password': password,
-    } 
\ No newline at end of file
+        'default': {
+            'server': env.get('SMTP_SERVER', 'smtp.strato.com'),
+            'port': int(env.get('SMTP_PORT', 587)),
+            'user': user,
+            'password': password,
+            'starttls': _truthy(env.get('SMTP_USE_TLS', 'True')),
+            'from': env.get('SMTP_FROM') or user,
+            # Verzendlimieten van de provider (zie modules/send_rate.py); 0 = geen limiet
+            'rate_per_minute': float(env.get('SMTP_RATE_PER_MINUTE', 30)),
+            'rate_per_day': int(env.get('SMTP_RATE_PER_DAY', 1000)),
+            'rate_burst': rate_burst,
+            **transport,
+        },
+        # Verificatie- en feedbackmails gaan via Gmail
+        'gmail': {
+            'server': 'smtp.gmail.com',
+            'port': 587,
+            'user': env.get('EMAIL_USER'),
+            'password': env.get('EMAIL_PASSWORD'),
+            'starttls': True,
+            'from': env.get('EMAIL_USER'),
+            'rate_per_minute': float(env.get('EMAIL_RATE_PER_MINUTE', 20)),
+            'rate_per_day': int(env.get('EMAIL_RATE_PER_DAY', 500)),
+            'rate_burst': rate_burst,
+            **transport,
+        },
+    }
+
+
+class MailConfig:
+    def __init__(self, dotenv_path=DOTENV_PATH, watch_seconds=CONFIG_WATCH_SECONDS):
+        self.dotenv_path = dotenv_path
+        self.watch_seconds = watch_seconds
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._reload_requested = threading.Event()
+        self._watcher = None
+        self._pid = None
+        self.reloads = 0
+        self._mtime = None
+        self._accounts = self._load()
+
+    def _dotenv_mtime(self):
+        try:
+            return os.stat(self.dotenv_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        self._mtime = self._dotenv_mtime()
+        values = dotenv_values(self.dotenv_path) if self._mtime is not None else {}
+        env = {key: value for key, value in values.items() if value is not None}
+        env.update(_PROCESS_ENV)
+        return resolve_config(env)
+
+    def get(self, account='default'):
+        """Configuratie van een account uit het geheugen (kopie)."""
+        if self._pid != os.getpid():
+            self._start_watcher()
+        return dict(self._accounts[account])
+
+    def add_listener(self, callback):
+        """callback() wordt aangeroepen nadat de configuratie is gewijzigd."""
+        self._listeners.append(callback)
+
+    def reload(self):
+        """Lees .env opnieuw en ontsleutel opnieuw; listeners alleen bij een echte wijziging."""
+        with self._lock:
+            accounts = self._load()
+            changed = accounts != self._accounts
+            self._accounts = accounts
+            self.reloads += 1
+        if changed:
+            logging.info("E-mailconfiguratie opnieuw geladen")
+            for callback in self._listeners:
+                try:
+                    callback()
+                except Exception as e:
+                    logging.error(f"Fout na herladen e-mailconfiguratie: {e}")
+        return changed
+
+    def request_reload(self):
+        """Vraag de watcher om opnieuw te laden (veilig vanuit een signal handler)."""
+        self._reload_requested.set()
+
+    def _watch(self):
+        while True:
+            self._reload_requested.wait(self.watch_seconds)
+            requested = self._reload_requested.is_set()
+            self._reload_requested.clear()
+            try:
+                if requested or self._dotenv_mtime() != self._mtime:
+                    self.reload()
+            except Exception as e:
+                logging.error(f"E-mailconfiguratie niet herladen: {e}")
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._watcher = threading.Thread(target=self._watch, name='mail-config', daemon=True)
+            self._watcher.start()
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_mail_config():
+    """Gedeelde configuratie per proces."""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = MailConfig()
+    return _config
+
+
+def install_reload_signal():
+    """Herlaad de e-mailconfiguratie bij SIGHUP (alleen vanuit de main thread, niet op Windows)."""
+    if not hasattr(signal, 'SIGHUP'):
+        return False
+    previous = signal.getsignal(signal.SIGHUP)
+
+    def handle(signum, frame):
+        get_mail_config().request_reload()
+        if callable(previous):
+            previous(signum, frame)
+
+    try:
+        signal.signal(signal.SIGHUP, handle)
+    except ValueError:
+        return False
+    return True
+
+
+def get_smtp_config(account='default'):
+    """SMTP-configuratie (server, port, user, password, starttls, from) uit het geheugen."""
+    return get_mail_config().get(account)
@@ -0,0 +1,256 @@
+"""
+Live status van verzonden e-mails voor de bevestigingspagina (server-sent events).
+
+Elke wijziging van de verzend-, aflever- of leesstatus in email_tracking
+komt via een trigger als rij in email_events; dat werkt ongeacht welk proces
+of welke code de rij bijwerkt (mailqueue-worker, trackingpixel,
+afleverbevestiging). De id van email_events is de cursor.
+
+EmailEventHub verdeelt die events binnen een proces over de open
+SSE-verbindingen van de betreffende gebruiker. Eén thread per proces leest de
+nieuwe events met één query voor alle verbindingen samen. Schrijft dit proces
+zelf een wijziging, dan maakt notify() de thread direct wakker; wijzigingen
+uit andere gunicorn workers worden binnen EMAIL_EVENTS_POLL_SECONDS gezien.
+Zonder open verbindingen doet de thread niets. Het opruimen hangt daar niet
+van af: een trigger op email_events verwijdert bij elke
+EMAIL_EVENTS_PRUNE_EVERY-ste nieuwe rij wat ouder is dan
+EMAIL_EVENTS_RETENTION_HOURS.
+
+Een open stream houdt zijn request vast. Met gunicorn.conf.py (gthread: een
+worker bedient GUNICORN_THREADS requests tegelijk) kost een kijker dus een
+thread, geen worker. Draait de app met sync workers (wsgi.multithread is
+False), dan wordt de stream een long-poll: na de eerste wijziging of na
+EMAIL_EVENTS_LONG_POLL_SECONDS sluit de server hem en verbindt de browser
+opnieuw, zodat een kijker een worker hooguit zo lang bezet houdt.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from modules.mail_queue import MAIL_QUEUE_DB, combined_status
+
+EMAIL_EVENTS_POLL_SECONDS = float(os.getenv('EMAIL_EVENTS_POLL_SECONDS', 1))
+# Na deze tijd sluit de server de stream; de browser (EventSource) maakt zelf opnieuw verbinding
+EMAIL_EVENTS_STREAM_SECONDS = float(os.getenv('EMAIL_EVENTS_STREAM_SECONDS', 120))
+EMAIL_EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EMAIL_EVENTS_HEARTBEAT_SECONDS', 15))
+# Maximale duur van een stream onder sync workers (long-poll)
+EMAIL_EVENTS_LONG_POLL_SECONDS = float(os.getenv('EMAIL_EVENTS_LONG_POLL_SECONDS', 20))
+EMAIL_EVENTS_RETENTION_HOURS = float(os.getenv('EMAIL_EVENTS_RETENTION_HOURS', 24))
+EMAIL_EVENTS_PRUNE_EVERY = int(os.getenv('EMAIL_EVENTS_PRUNE_EVERY', 100))
+
+STATUS_COLUMNS = ('email_id', 'status', 'attempts', 'sent_at', 'delivered_at', 'read_at', 'read_count')
+
+
+def format_sse(event, data):
+    """Eén server-sent event met JSON-data."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EmailEventHub:
+    def __init__(self, db_path=MAIL_QUEUE_DB, poll_seconds=EMAIL_EVENTS_POLL_SECONDS,
+                 retention_hours=EMAIL_EVENTS_RETENTION_HOURS, prune_every=EMAIL_EVENTS_PRUNE_EVERY):
+        self.db_path = db_path
+        self.poll_seconds = poll_seconds
+        self.retention_hours = float(retention_hours)
+        self.prune_every = max(int(prune_every), 1)
+        self._lock = threading.Lock()
+        self._subscribers = {}  # user_id -> set van queue.Queue
+        self._cursor = 0
+        self._changed = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.delivered = 0
+        conn = self._connect()
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS email_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_id TEXT NOT NULL,
+                user_id INTEGER,
+                status TEXT,
+                attempts INTEGER,
+                sent_at TIMESTAMP,
+                delivered_at TIMESTAMP,
+                read_at TIMESTAMP,
+                read_count INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            conn.execute('''CREATE TRIGGER IF NOT EXISTS email_tracking_events AFTER UPDATE ON email_tracking
+                WHEN NEW.status IS NOT OLD.status OR NEW.sent_at IS NOT OLD.sent_at
+                  OR NEW.delivered_at IS NOT OLD.delivered_at OR NEW.read_count IS NOT OLD.read_count
+                BEGIN
+                    INSERT INTO email_events (email_id, user_id, status, attempts, sent_at, delivered_at, read_at,
+                                              read_count)
+                    VALUES (NEW.email_id, NEW.user_id, NEW.status, NEW.attempts, NEW.sent_at, NEW.delivered_at,
+                            NEW.read_at, NEW.read_count);
+                END''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_email_events_created ON email_events (created_at)')
+            # Opruimen bij het schrijven, ook als niemand kijkt; opnieuw aangemaakt zodat een gewijzigde
+            # bewaartermijn direct geldt (de waarden zijn getallen, dus veilig in de SQL-tekst)
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DROP TRIGGER IF EXISTS email_events_retention')
+            conn.execute(f'''CREATE TRIGGER email_events_retention AFTER INSERT ON email_events
+                WHEN NEW.id % {self.prune_every} = 0
+                BEGIN
+                    DELETE FROM email_events WHERE created_at < datetime('now', '-{self.retention_hours} hours');
+                END''')
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # --- Abonnementen ---
+
+    def subscribe(self, user_id):
+        """Queue die de events van user_id ontvangt (dicts met STATUS_COLUMNS); sluit af met unsubscribe()."""
+        subscription = queue.Queue()
+        with self._lock:
+            if not any(self._subscribers.values()):
+                # Eerste verbinding: alleen wat vanaf nu gebeurt; de stream begint met de actuele stand
+                conn = self._connect()
+                try:
+                    self._cursor = conn.execute('SELECT COALESCE(MAX(id), 0) FROM email_events').fetchone()[0]
+                finally:
+                    conn.close()
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        self._ensure_thread()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for user_id, subscriptions in list(self._subscribers.items()):
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[user_id]
+
+    def notify(self):
+        """Er is in dit proces iets in email_tracking gewijzigd: lees direct de nieuwe events."""
+        self._changed.set()
+
+    # --- Verdelen ---
+
+    def poll(self):
+        """Lees de events na de cursor en geef ze aan de abonnees; return het aantal gelezen events."""
+        with self._lock:
+            if not self._subscribers:
+                return 0
+            cursor = self._cursor
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT * FROM email_events WHERE id > ? ORDER BY id', (cursor,)).fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for row in rows:
+                event = {column: row[column] for column in STATUS_COLUMNS}
+                for subscription in self._subscribers.get(row['user_id'], ()):
+                    subscription.put(event)
+                    self.delivered += 1
+            if rows:
+                self._cursor = max(self._cursor, rows[-1]['id'])
+        return len(rows)
+
+    def _run(self):
+        while True:
+            self._changed.wait(self.poll_seconds)
+            self._changed.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"E-mailevents: {e}")
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='email-events', daemon=True)
+            self._thread.start()
+
+    # --- Stream ---
+
+    def snapshot(self, user_id, email_ids):
+        """Actuele status van de berichten van user_id, in de volgorde van email_ids."""
+        placeholders = ', '.join('?' * len(email_ids))
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'''SELECT {', '.join(STATUS_COLUMNS)} FROM email_tracking
+                                   WHERE email_id IN ({placeholders}) AND user_id = ?''',
+                                (*email_ids, user_id)).fetchall()
+        finally:
+            conn.close()
+        by_id = {row['email_id']: dict(row) for row in rows}
+        return {email_id: by_id[email_id] for email_id in email_ids if email_id in by_id}
+
+    def stream(self, user_id, email_ids, seconds=EMAIL_EVENTS_STREAM_SECONDS,
+               heartbeat_seconds=EMAIL_EVENTS_HEARTBEAT_SECONDS, long_poll=False):
+        """
+        SSE-tekst voor de berichten email_ids (aanvraag eerst): eerst de actuele stand, daarna elke wijziging.
+        Per wijziging een 'email'-event met de status van dat bericht en een 'verzending'-event met de
+        gezamenlijke uitkomst (combined_status). long_poll: stoppen na de eerste wijziging (en wat er
+        tegelijk binnenkwam); de browser verbindt dan na 1 s opnieuw en krijgt weer de actuele stand.
+        """
+        subscription = self.subscribe(user_id)  # vóór de snapshot, zodat er niets tussendoor valt
+        try:
+            states = self.snapshot(user_id, email_ids)
+            # Na het sluiten van de stream opnieuw verbinden: bij long-poll na 1 s, anders na 3 s
+            yield "retry: 1000\n\n" if long_poll else "retry: 3000\n\n"
+            for state in states.values():
+                yield format_sse('email', state)
+            yield format_sse('verzending', {'status': combined_status([states.get(email_id, {}).get('status')
+                                                                       for email_id in email_ids])})
+            deadline = time.monotonic() + seconds
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = subscription.get(timeout=min(heartbeat_seconds, remaining))
+                except queue.Empty:
+                    yield ': ping\n\n'  # houdt proxies open en merkt een gesloten verbinding op
+                    continue
+                events = [event]
+                if long_poll:
+                    while not subscription.empty():
+                        events.append(subscription.get_nowait())
+                events = [event for event in events if event['email_id'] in email_ids]
+                if not events:
+                    continue
+                for event in events:
+                    states[event['email_id']] = event
+                    yield format_sse('email', event)
+                yield format_sse('verzending', {'status': combined_status([states.get(email_id, {}).get('status')
+                                                                           for email_id in email_ids])})
+                if long_poll:
+                    return
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'connections': sum(len(subscriptions) for subscriptions in self._subscribers.values()),
+                'cursor': self._cursor,
+                'delivered': self.delivered,
+            }
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_email_event_hub():
+    """Gedeelde hub per proces."""
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = EmailEventHub()
+    return _hub
@@ -0,0 +1,152 @@
+"""
+E-mailtemplates (Jinja) voor de aanvraag-, bevestigings- en digestmail.
+
+De templates staan in templates/email: per bericht een .html en een .txt
+variant. De CSS uit email.css wordt bij het laden als style-attributen in de
+HTML gezet (mailclients negeren vaak <style>), zodat dat niet per bericht
+gebeurt. Ook {% extends %} wordt bij het laden opgelost: de blokken van het
+bericht gaan in de tekst van base.html, zodat er per render geen tweede
+template en geen blokkenketen meer bij komt. Templates worden één keer
+gecompileerd en daarna alleen gerenderd; veldwaarden worden in de HTML
+automatisch ge-escaped en de trackingpixel is een gewone templatevariabele.
+
+Een render kost ongeveer 55 µs (python benchmark.py email), tegen 7 µs voor
+de oude f-strings. Dat verschil valt weg tegen de SMTP-verzending en koopt
+escaping van alle veldwaarden en inline CSS.
+"""
+import os
+import re
+import threading
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, select_autoescape
+
+EMAIL_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates', 'email')
+EMAIL_CSS = 'email.css'
+EMAIL_TEMPLATES = ['aanvraag', 'bevestiging', 'digest']
+
+CSS_RULE_RE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+TAG_RE = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(/?)>')
+ATTR_CLASS_RE = re.compile(r'\sclass="([^"]*)"')
+ATTR_STYLE_RE = re.compile(r'\sstyle="([^"]*)"')
+# Net als trim_blocks: de regelovergang direct na een blok-tag hoort niet bij de uitvoer
+EXTENDS_RE = re.compile(r'\A\s*{%-?\s*extends\s+["\']([^"\']+)["\']\s*-?%}')
+BLOCK_RE = re.compile(r'{%\s*block\s+(\w+)\s*%}\n?(.*?){%\s*endblock(?:\s+\w+)?\s*%}\n?', re.S)
+
+
+def parse_css(css):
+    """Eenvoudige CSS (alleen element- en class-selectors) als {selector: declaraties}."""
+    rules = {}
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    for selectors, declarations in CSS_RULE_RE.findall(css):
+        declarations = ' '.join(d.strip() + ';' for d in declarations.split(';') if d.strip())
+        for selector in selectors.split(','):
+            selector = selector.strip()
+            if not re.fullmatch(r'\.?[\w-]+', selector):
+                raise ValueError(f"CSS-selector {selector!r} wordt niet ondersteund in e-mailtemplates")
+            rules[selector] = f"{rules.get(selector, '')} {declarations}".strip()
+    return rules
+
+
+def resolve_extends(source, load_parent):
+    """
+    Vul de blokken van een {% extends %}-template in de tekst van het parent template in. Geeft None
+    als dat niet statisch kan (geen extends, super(), geneste blokken); dan doet Jinja het zelf.
+    """
+    match = EXTENDS_RE.match(source)
+    if not match or 'super()' in source:
+        return None
+    blocks = dict(BLOCK_RE.findall(source))
+    if any('{% block' in body for body in blocks.values()):
+        return None
+    parent = load_parent(match.group(1))
+    if any('{% block' in body for _, body in BLOCK_RE.findall(parent)):
+        return None
+    return BLOCK_RE.sub(lambda m: blocks.get(m.group(1), m.group(2)), parent)
+
+
+def inline_css(html, rules):
+    """Zet de CSS-regels als style-attribuut op de elementen; een bestaand style-attribuut wint."""
+    def apply(match):
+        tag, attrs, closing = match.group(1), match.group(2) or '', match.group(3)
+        styles = []
+        if tag.lower() in rules:
+            styles.append(rules[tag.lower()])
+        class_attr = ATTR_CLASS_RE.search(attrs)
+        if class_attr:
+            styles.extend(rules[f".{name}"] for name in class_attr.group(1).split() if f".{name}" in rules)
+            attrs = ATTR_CLASS_RE.sub('', attrs)
+        if not styles:
+            return match.group(0) if not class_attr else f"<{tag}{attrs}{closing}>"
+        existing = ATTR_STYLE_RE.search(attrs)
+        if existing:
+            styles.append(existing.group(1))
+            attrs = ATTR_STYLE_RE.sub('', attrs)
+        return f'<{tag}{attrs} style="{" ".join(styles)}"{closing}>'
+
+    return TAG_RE.sub(apply, html)
+
+
+class InlineCSSLoader(FileSystemLoader):
+    """FileSystemLoader die bij het laden van een .html template extends oplost en de CSS inline zet."""
+
+    def __init__(self, searchpath, css_file=EMAIL_CSS):
+        super().__init__(searchpath)
+        with open(os.path.join(searchpath, css_file), encoding='utf-8') as f:
+            self.rules = parse_css(f.read())
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        if template.endswith('.html'):
+            parents = []
+
+            def load_parent(name):
+                parent, _, parent_uptodate = super(InlineCSSLoader, self).get_source(environment, name)
+                parents.append(parent_uptodate)
+                return parent
+
+            flattened = resolve_extends(source, load_parent)
+            if flattened is not None:
+                source = flattened
+                child_uptodate = uptodate
+
+                def uptodate():
+                    return child_uptodate() and all(check() for check in parents)
+            source = inline_css(source, self.rules)
+        return source, filename, uptodate
+
+
+def create_environment(directory=EMAIL_TEMPLATE_DIR):
+    return Environment(
+        loader=InlineCSSLoader(directory),
+        autoescape=select_autoescape(['html']),
+        undefined=StrictUndefined,
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=False,
+    )
+
+
+_environment = None
+_templates = {}  # (naam, 'txt' of 'html') -> Template
+_environment_lock = threading.Lock()
+
+
+def get_email_environment():
+    """Gedeelde Jinja-omgeving per proces; alle e-mailtemplates worden direct gecompileerd."""
+    global _environment
+    if _environment is None:
+        with _environment_lock:
+            if _environment is None:
+                environment = create_environment()
+                for name in EMAIL_TEMPLATES:
+                    for ext in ('txt', 'html'):
+                        _templates[name, ext] = environment.get_template(f"{name}.{ext}")
+                _environment = environment
+    return _environment
+
+
+def render_email(name, **context):
+    """Render de tekst- en HTML-variant van een e-mail. Return (text, html)."""
+    get_email_environment()
+    context.setdefault('tracking_pixel_url', None)
+    return _templates[name, 'txt'].render(context), _templates[name, 'html'].render(context)
@@ -0,0 +1,158 @@
+"""
+Toegang tot de betaalde tool (entitlement) en de cache van ingelogde gebruikers.
+
+De toegang van een gebruiker volgt uit zijn users-rij: is_paid_user en
+subscription_expires, plus ENTITLEMENT_GRACE_DAYS respijt na het verlopen.
+Entitlement wordt één keer berekend als de rij geladen wordt en hangt aan
+het User-object; of de toegang nu geldt, hangt alleen van de klok af.
+
+UserCache bewaart de User-objecten per proces USER_CACHE_SECONDS lang,
+zodat Flask-Login niet bij elk request de users-rij hoeft te lezen. Een
+verwerkt Stripe-event (on_stripe_event als listener van de inbox) en elke
+wijziging van de rij in dit proces maken de gebruiker ongeldig; andere
+processen zien een wijziging uiterlijk na USER_CACHE_SECONDS. Verlopen
+gebruikers worden bij elke put() opgeruimd en er staan nooit meer dan
+USER_CACHE_MAX_USERS gebruikers (met hun persoonsgegevens) in het geheugen. Een geweigerde
+toegang wordt door paid_required altijd nog tegen de database gecontroleerd,
+zodat een net betaalde gebruiker niet op een verouderd antwoord stuit.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+ENTITLEMENT_GRACE_DAYS = int(os.getenv('ENTITLEMENT_GRACE_DAYS', 3))
+USER_CACHE_SECONDS = float(os.getenv('USER_CACHE_SECONDS', 60))
+USER_CACHE_MAX_USERS = int(os.getenv('USER_CACHE_MAX_USERS', 1000))
+
+ACTIVE = 'active'
+GRACE = 'grace'
+EXPIRED = 'expired'
+UNPAID = 'unpaid'
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        logging.warning(f"Ongeldige subscription_expires: {value!r}")
+        return None
+
+
+class Entitlement:
+    def __init__(self, paid, expires=None, grace_days=ENTITLEMENT_GRACE_DAYS):
+        self.paid = bool(paid)
+        self.expires = _parse_timestamp(expires)  # None: betaald zonder einddatum
+        self.grace_until = self.expires + timedelta(days=grace_days) if self.expires else None
+
+    @classmethod
+    def from_row(cls, row, grace_days=ENTITLEMENT_GRACE_DAYS):
+        """Toegang uit een users-rij (sqlite3.Row of dict)."""
+        return cls(row['is_paid_user'], row['subscription_expires'], grace_days)
+
+    def status(self, now=None):
+        """'active', 'grace' (verlopen, binnen de respijttermijn), 'expired' of 'unpaid'."""
+        if not self.paid:
+            return UNPAID
+        if self.expires is None:
+            return ACTIVE
+        now = now or datetime.now()
+        if now <= self.expires:
+            return ACTIVE
+        return GRACE if now <= self.grace_until else EXPIRED
+
+    def allows(self, now=None):
+        return self.status(now) in (ACTIVE, GRACE)
+
+    def __repr__(self):
+        return f"Entitlement(paid={self.paid}, expires={self.expires}, status={self.status()})"
+
+
+class UserCache:
+    def __init__(self, ttl=USER_CACHE_SECONDS, max_users=USER_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # str(user_id) -> (User, geladen op), in volgorde van put()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id, load):
+        """User uit de cache, anders load(user_id) (None als de gebruiker niet bestaat; wordt niet bewaard)."""
+        key = str(user_id)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._users.get(key)
+            if cached and now - cached[1] < self.ttl:
+                self.hits += 1
+                return cached[0]
+            if cached:
+                del self._users[key]
+            self.misses += 1
+        user = load(user_id)
+        if user is not None:
+            self.put(user, now)
+        return user
+
+    def put(self, user, loaded_at=None):
+        loaded_at = loaded_at or time.monotonic()
+        with self._lock:
+            key = str(user.id)
+            self._users.pop(key, None)
+            self._users[key] = (user, loaded_at)
+            self._prune(time.monotonic())
+
+    def _prune(self, now):
+        """Verwijder verlopen gebruikers en daarna de eerst geladen boven max_users (put() is alleen bij een miss)."""
+        for key in [key for key, (_, loaded_at) in self._users.items() if now - loaded_at >= self.ttl]:
+            del self._users[key]
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """Vergeet één gebruiker, of zonder user_id iedereen."""
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(str(user_id), None)
+            self.invalidations += 1
+
+    def on_stripe_event(self, event):
+        """Listener van de stripe_events-inbox: de gebruiker van een betaling of customer opnieuw laden."""
+        obj = event['data']['object']
+        user_id = (obj.get('metadata') or {}).get('user_id')
+        if user_id:
+            self.invalidate(user_id)
+        elif event['type'].startswith('payment_intent.'):
+            self.invalidate()  # betaling zonder user_id in de metadata: niet te herleiden, dus alles
+
+    def stats(self):
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    """Gedeelde cache per proces."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UserCache()
+    return _cache
@@ -0,0 +1,169 @@
+"""
+Declaratief schema van het aanvraagformulier.
+
+Elk veld staat hier één keer beschreven: waar de waarde in form_data staat,
+hoe die genormaliseerd wordt (tekst, vinkje, aanwezig, keuze), welke
+placeholder het in het Word template vult en onder welk label en welke sectie
+het in het PDF-dossier komt. compile_schema() maakt daar bij het importeren
+een lijst van converters van; convert() loopt daarna één keer over de velden
+en levert tegelijk de DOCX-invulmap, de e-mailcontext en de PDF-secties.
+"""
+from collections import namedtuple
+
+TEXT = 'text'        # waarde ongewijzigd overnemen
+FLAG = 'flag'        # checkbox: aangevinkt als de waarde in TRUE_VALUES zit
+PRESENT = 'present'  # aangevinkt als er een (niet-lege) waarde is
+CHOICE = 'choice'    # aangevinkt als de waarde één van de choices is
+
+TRUE_VALUES = ('on', True, 'ja')
+CHECKED = '☒'
+
+SECTIONS = [
+    'Aanvraag',
+    'Persoonlijke gegevens',
+    'Contactgegevens',
+    'Werkgever gegevens',
+    'Pas en opleiding',
+]
+
+FormView = namedtuple('FormView', ['docx', 'email', 'pdf_sections'])
+
+
+class Field:
+    """Beschrijving van één formulierveld."""
+
+    def __init__(self, name, label=None, section=None, source=None, kind=TEXT, mark=CHECKED, choices=(), docx=True):
+        self.name = name              # placeholder in het Word template en sleutel in de e-mailcontext
+        self.label = label            # label in het PDF-dossier (None = niet in het dossier)
+        self.section = section
+        self.source = source or name  # sleutel in form_data
+        self.kind = kind
+        self.mark = mark              # tekst in het Word template als een vinkje/keuze waar is
+        self.choices = frozenset(choices)
+        self.docx = docx
+
+
+FIELDS = [
+    Field('bedrijfsnaam', 'Bedrijfsnaam', 'Werkgever gegevens'),
+    Field('straat_bedrijf', 'Adres', 'Werkgever gegevens'),
+    Field('postcode_bedrijf', 'Postcode', 'Werkgever gegevens'),
+    Field('plaats_bedrijf', 'Plaats', 'Werkgever gegevens'),
+    Field('vergunning_type', 'Vergunningtype', 'Werkgever gegevens'),
+    Field('vergunning_nummer', 'Vergunningnummer', 'Werkgever gegevens'),
+    Field('email_bedrijf', 'E-mail', 'Werkgever gegevens'),
+    Field('telefoon_bedrijf', 'Telefoon', 'Werkgever gegevens'),
+    Field('bsn', 'BSN', 'Persoonlijke gegevens'),
+    Field('voorvoegsel', 'Voorvoegsel', 'Persoonlijke gegevens'),
+    Field('achternaam', 'Achternaam', 'Persoonlijke gegevens'),
+    Field('voornamen', 'Voornamen', 'Persoonlijke gegevens'),
+    Field('geboortedatum', 'Geboortedatum', 'Persoonlijke gegevens'),
+    Field('geboorteplaats', 'Geboorteplaats', 'Persoonlijke gegevens'),
+    Field('geboorteland', 'Geboorteland', 'Persoonlijke gegevens'),
+    Field('straat_medewerker', 'Straat', 'Contactgegevens'),
+    Field('huisnummer', 'Huisnummer', 'Contactgegevens'),
+    Field('postcode_medewerker', 'Postcode', 'Contactgegevens'),
+    Field('woonplaats', 'Woonplaats', 'Contactgegevens', source='woonplaats_medewerker'),
+    Field('telefoon_medewerker', 'Telefoon', 'Contactgegevens'),
+    Field('email_medewerker', 'E-mail', 'Contactgegevens'),
+    Field('svpb_nummer', 'SVPB-nummer', 'Pas en opleiding'),
+    Field('in_opleiding', 'In opleiding', 'Pas en opleiding', kind=FLAG, mark='ja'),
+    Field('certificaat_winkelsurveillant', 'Certificaat winkelsurveillant', 'Pas en opleiding', kind=FLAG),
+    Field('persoonsbeveiliger', 'Persoonsbeveiliger', 'Pas en opleiding', kind=FLAG, mark='ja'),
+    Field('naam_contactpersoon', 'Contactpersoon', 'Werkgever gegevens'),
+    Field('plaats_ondertekening', 'Plaats ondertekening', 'Aanvraag'),
+    Field('is_opsporingsambtenaar', 'Opsporingsambtenaar', 'Pas en opleiding', kind=FLAG, mark='ja'),
+    Field('sinds', 'Sinds', 'Pas en opleiding'),
+    Field('organisatie', 'Organisatie', 'Pas en opleiding'),
+    Field('functie', 'Functie', 'Pas en opleiding'),
+    Field('functie_gediplomeerd', 'Gediplomeerd voor functie', 'Pas en opleiding'),
+    Field('certificaat_persoonsbeveiliger', 'Certificaat persoonsbeveiliger', 'Pas en opleiding', kind=FLAG, mark='ja'),
+    Field('latere_begindatum', 'Latere begindatum', 'Aanvraag'),
+    Field('einddatum_svpb', 'Einddatum SVPB', 'Pas en opleiding'),
+    # Type aanvraag (let op exacte waarde)
+    Field('eerste_aanvraag', source='type_aanvraag', kind=CHOICE,
+          choices=['eerste_aanvraag', 'Eerste aanvraag']),
+    Field('verlenging_aanvraag', source='type_aanvraag', kind=CHOICE,
+          choices=['verlenging_aanvraag', 'Verlenging/herscreening']),
+    Field('vervanging_aanvraag', source='type_aanvraag', kind=CHOICE,
+          choices=['vervanging_aanvraag', 'Vervanging legitimatiebewijs (vermissing/diefstal)']),
+    # Bijlagen (checkboxen, direct uit form_data)
+    Field('bijlagen_id', source='id', kind=PRESENT),
+    Field('bijlagen_pasfoto', source='pasfoto', kind=PRESENT),
+    Field('bijlagen_handtekening', source='handtekening', kind=PRESENT),
+    Field('bijlagen_svpb', source='svpb', kind=PRESENT),
+    Field('bijlagen_horeca', source='horeca', kind=PRESENT),
+    Field('bijlagen_voetbal', source='voetbal', kind=PRESENT),
+    Field('bijlagen_logo', source='logo', kind=PRESENT),
+    Field('bijlagen_straf_belgie', source='straf_belgie', kind=PRESENT),
+    Field('bijlagen_fuhrung', source='fuhrung', kind=PRESENT),
+    Field('bijlagen_straf_herkomst', source='straf_herkomst', kind=PRESENT),
+    Field('bijlagen_pv', source='pv', kind=PRESENT),
+    Field('bijlagen_certificaat_winkelsurveillant', source='certificaat_winkelsurveillant', kind=FLAG),
+    Field('datum_aanvraag', 'Datum aanvraag', 'Aanvraag'),
+    # Alleen voor e-mail en dossier
+    Field('type_aanvraag', 'Type aanvraag', 'Aanvraag', docx=False),
+    Field('afdeling', 'Afdeling', 'Aanvraag', source='afdeling_select', docx=False),
+    Field('email_afdeling', source='email_opties_select', docx=False),
+]
+
+
+class CompiledSchema:
+    """Converters voor een lijst velden; convert() doet één doorloop over form_data."""
+
+    def __init__(self, fields, sections=SECTIONS):
+        self.sections = list(sections)
+        section_index = {title: i for i, title in enumerate(self.sections)}
+        self._converters = []
+        for field in fields:
+            if field.section is not None and field.section not in section_index:
+                raise ValueError(f"Onbekende sectie {field.section!r} voor veld {field.name}")
+            self._converters.append((
+                field.name,
+                field.source,
+                field.kind,
+                field.mark,
+                field.choices,
+                field.docx,
+                section_index.get(field.section) if field.label else None,
+                field.label,
+            ))
+        self.placeholders = [field.name for field in fields if field.docx]
+
+    def convert(self, form_data):
+        docx, email = {}, {}
+        sections = [[] for _ in self.sections]
+        for name, source, kind, mark, choices, to_docx, section, label in self._converters:
+            if kind == TEXT:
+                value = form_data.get(source, "")
+                checked = None
+            else:
+                raw = form_data.get(source)
+                if kind == FLAG:
+                    checked = raw in TRUE_VALUES
+                elif kind == PRESENT:
+                    checked = bool(raw)
+                else:
+                    checked = raw in choices
+                value = mark if checked else ""
+            if to_docx:
+                docx[name] = value
+            email[name] = value if checked is None else checked
+            if section is not None and value:
+                sections[section].append((label, 'Ja' if checked else value))
+        # Samengestelde waarden voor de e-mailteksten
+        email['naam'] = f"{email['voornamen']} {email['achternaam']}"
+        email['vergunning'] = f"{email['vergunning_type']} {email['vergunning_nummer']}"
+        pdf_sections = [(title, values) for title, values in zip(self.sections, sections) if values]
+        return FormView(docx, email, pdf_sections)
+
+
+def compile_schema(fields=FIELDS, sections=SECTIONS):
+    return CompiledSchema(fields, sections)
+
+
+FORM_SCHEMA = compile_schema()
+
+
+def convert_form(form_data):
+    """DOCX-invulmap, e-mailcontext en PDF-secties voor form_data."""
+    return FORM_SCHEMA.convert(form_data)
@@ -0,0 +1,148 @@
+"""
+Begrensde on-disk cache voor verwerkte uploadafbeeldingen.
+
+Bij /wijzigen worden de uploads opgeschoond en uploadt de gebruiker vrijwel
+altijd exact dezelfde pasfoto en handtekening opnieuw. Deze cache bewaart de
+al geresizede bytes onder een sleutel van (inhoud-hash, image_type,
+requirements-versie, uitvoerformaat, imaging backend), zodat die afbeeldingen
+niet opnieuw gedecodeerd en geresized hoeven te worden.
+
+De schijf is de bron van waarheid: elk proces (gunicorn worker) houdt een
+eigen LRU-index bij, maar een lookup kijkt altijd naar het bestand zelf.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join('cache', 'images'))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 64MB
+
+
+class ImageCache:
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> grootte in bytes, oudste eerst
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    def _load_index(self):
+        """Bouw de LRU-index op uit de bestanden die al op schijf staan."""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def make_key(contents, image_type, version, fmt, backend):
+        """
+        Cache-sleutel voor de ruwe uploadbytes en de verwerkingsparameters. De backend hoort erbij:
+        Pillow en pyvips geven niet pixel voor pixel dezelfde uitvoer en de cache overleeft een herstart.
+        """
+        digest = hashlib.sha256(contents).hexdigest()
+        return f"{digest}-{image_type}-v{version}-{backend}.{fmt.lower()}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Geef de verwerkte bytes terug, of None bij een cache miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                # Mogelijk door een andere worker verwijderd
+                if key in self._index:
+                    self._total_bytes -= self._index.pop(key)
+            return None
+        try:
+            os.utime(path)  # mtime = laatste gebruik, voor LRU na herstart
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:
+                self._index[key] = len(data)
+                self._total_bytes += len(data)
+            self._evict()
+        return data
+
+    def put(self, key, data):
+        """Sla verwerkte bytes op en verwijder zo nodig de minst recent gebruikte items."""
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.error(f"Image cache: kon {key} niet opslaan: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if key in self._index:
+                self._total_bytes -= self._index.pop(key)
+            self._index[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        # Aanroepen met self._lock vastgehouden
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+                logging.info(f"Image cache: {key} verwijderd (LRU)")
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._index),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Gedeelde cache-instantie per proces (lazy aangemaakt)."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ImageCache()
+    return _cache
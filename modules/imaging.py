@@ -0,0 +1,503 @@
+"""
+Imaging engine voor uploads (pasfoto, handtekening, bedrijfslogo).
+
+Eisen per type, resize-regels en de verwerkingsmodi staan hier op één plek.
+Het decoderen, resizen en coderen loopt via een backend: Pillow standaard,
+libvips (pyvips) als dat geïnstalleerd is. Kies expliciet met
+IMAGING_BACKEND=pillow|vips|auto (standaard auto).
+"""
+import io
+import logging
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+
+try:
+    import pyvips
+except (ImportError, OSError):  # OSError: pyvips zonder libvips op het systeem
+    pyvips = None
+
+# Eisen per type (pixels)
+requirements = {
+    'pasfoto': {'min': (276, 355), 'max': (551, 709)},
+    'handtekening': {'min': (354, 108), 'max': (945, 287)},
+    'bedrijfslogo': {'min': (315, 127), 'max': (945, 382)},
+}
+# Verhoog bij elke wijziging in requirements of resize-logica, zodat oude cache-items vervallen
+REQUIREMENTS_VERSION = 5
+
+# Types waarvan het uitvoerformaat vastligt, ongeacht de geüploade extensie
+FIXED_OUTPUT_FORMATS = {
+    'pasfoto': 'JPEG',
+    'handtekening': 'PNG',
+}
+
+# Pasfoto: verhouding 35x45 mm (gelijk aan min/max in requirements) en doelgrootte van de JPEG
+PASFOTO_ASPECT = 35 / 45
+PASFOTO_TARGET_BYTES = int(os.getenv('PASFOTO_TARGET_BYTES', 100 * 1024))
+
+IMAGING_BACKEND = os.getenv('IMAGING_BACKEND', 'auto').lower()
+
+
+def output_format(filename, image_type=None):
+    """Bepaal het opslagformaat (JPEG/PNG) op basis van het type of de bestandsextensie."""
+    if image_type in FIXED_OUTPUT_FORMATS:
+        return FIXED_OUTPUT_FORMATS[image_type]
+    ext = os.path.splitext(filename or '')[1].lower()
+    return 'JPEG' if ext in ['.jpg', '.jpeg'] else 'PNG'
+
+
+def output_extension(filename, fmt):
+    """Extensie voor het opgeslagen bestand; de originele extensie blijft als die bij het formaat past."""
+    ext = os.path.splitext(filename or '')[1]
+    if output_format(filename) == fmt:
+        return ext
+    return '.jpg' if fmt == 'JPEG' else '.png'
+
+
+def fit_size(size, image_type):
+    """Nieuwe afmetingen binnen min/max van image_type, aspect ratio behouden."""
+    min_w, min_h = requirements[image_type]['min']
+    max_w, max_h = requirements[image_type]['max']
+    width, height = size
+    # Schaal naar min als kleiner, maar niet groter dan max
+    new_w, new_h = width, height
+    if width < min_w or height < min_h:
+        scale = max(min_w/width, min_h/height)
+        new_w, new_h = int(width*scale), int(height*scale)
+    if new_w > max_w or new_h > max_h:
+        scale = min(max_w/new_w, max_h/new_h)
+        new_w, new_h = int(new_w*scale), int(new_h*scale)
+    return max(new_w, 1), max(new_h, 1)
+
+
+# --- Backends ---
+
+def flatten_alpha(array):
+    """HxWx2 (grijs met alpha) of HxWx4 (RGBA) op een witte achtergrond; andere arrays ongewijzigd."""
+    if array.ndim != 3 or array.shape[2] not in (2, 4):
+        return array
+    alpha = array[:, :, -1:].astype(np.float32) / 255
+    return (array[:, :, :-1] * alpha + 255 * (1 - alpha) + 0.5).astype(np.uint8)
+
+
+def gray_array(array):
+    """Luminantie (ITU-R 601-2, zoals Pillow 'L') van een array zonder alpha."""
+    if array.ndim == 2:
+        return array
+    if array.shape[2] == 1:
+        return array[:, :, 0]
+    return (array[:, :, :3].astype(np.float32) @ np.array([0.299, 0.587, 0.114], np.float32) + 0.5).astype(np.uint8)
+
+
+class ImagingBackend:
+    """
+    Interface voor decoderen, resizen en coderen. Afbeeldingen zijn backend-eigen objecten;
+    pixelbewerkingen in de modi lopen via NumPy-arrays (to_array/from_array).
+    """
+    name = None
+
+    def load(self, contents, draft_size=None, autorotate=False, srgb=False):
+        """Valideer en decodeer JPEG/PNG. draft_size: minimaal benodigde afmetingen (shrink-on-load)."""
+        raise NotImplementedError
+
+    def size(self, image):
+        raise NotImplementedError
+
+    def to_array(self, image, gray=False):
+        """
+        uint8-array, HxW (gray) of HxWxC. Voor gray gaat transparantie eerst op een witte achtergrond
+        (volledig transparante pixels zijn (0, 0, 0, 0) en zouden anders zwart worden) en volgt de
+        luminantie in NumPy, zodat elke backend dezelfde waarden geeft.
+        """
+        array = self._pixels(image)
+        return gray_array(flatten_alpha(array)) if gray else array
+
+    def _pixels(self, image):
+        """Pixels als uint8-array: HxW, HxWx2 (grijs met alpha), HxWx3 of HxWx4 (RGBA)."""
+        raise NotImplementedError
+
+    def from_array(self, array):
+        raise NotImplementedError
+
+    def resize(self, image, size, box=None):
+        """Resize (LANCZOS) naar size, optioneel eerst bijgesneden tot box (left, top, right, bottom)."""
+        raise NotImplementedError
+
+    def encode(self, image, fmt, quality=85, progressive=False, bilevel=False):
+        """Codeer naar JPEG/PNG zonder metadata. bilevel: 1-bit PNG."""
+        raise NotImplementedError
+
+
+class PillowBackend(ImagingBackend):
+    name = 'pillow'
+
+    def load(self, contents, draft_size=None, autorotate=False, srgb=False):
+        try:
+            image = Image.open(io.BytesIO(contents))
+            image.verify()  # Check of het echt een afbeelding is
+            image = Image.open(io.BytesIO(contents))  # Open opnieuw voor bewerking
+        except Exception:
+            raise ValueError('Bestand is geen geldige afbeelding.')
+        if image.format not in ('JPEG', 'PNG'):
+            raise ValueError('Alleen JPG of PNG toegestaan.')
+        if draft_size:
+            # JPEG: laat de decoder direct verkleinen (DCT-scaling), rekening houdend met 90° rotatie
+            orientation = image.getexif().get(0x0112, 1) if autorotate else 1
+            if orientation in (5, 6, 7, 8):
+                draft_size = (draft_size[1], draft_size[0])
+            image.draft('RGB', draft_size)
+        if autorotate:
+            image = ImageOps.exif_transpose(image)
+        if srgb:
+            image = self._to_srgb(image)
+        return image
+
+    @staticmethod
+    def _to_srgb(image):
+        """Converteer naar RGB in sRGB; een meegeleverd ICC-profiel wordt toegepast en niet bewaard."""
+        icc = image.info.get('icc_profile')
+        if icc:
+            try:
+                from PIL import ImageCms
+                source = ImageCms.ImageCmsProfile(io.BytesIO(icc))
+                image = ImageCms.profileToProfile(image.convert('RGB'), source, ImageCms.createProfile('sRGB'), outputMode='RGB')
+            except Exception as e:
+                logging.warning(f"ICC-profiel kon niet worden toegepast: {e}")
+        if image.mode in ('RGBA', 'LA', 'P'):
+            return PillowBackend._flatten(image)
+        return image.convert('RGB')
+
+    @staticmethod
+    def _flatten(image):
+        """Transparantie op witte achtergrond (RGB)."""
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+
+    def size(self, image):
+        return image.size
+
+    def _pixels(self, image):
+        if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+            transparent = image.mode in ('PA', 'La') or 'transparency' in image.info
+            image = image.convert('RGBA' if transparent else 'RGB')
+        return np.asarray(image)
+
+    def from_array(self, array):
+        return Image.fromarray(np.ascontiguousarray(array))
+
+    def resize(self, image, size, box=None):
+        if box is None and tuple(size) == image.size:
+            return image
+        return image.resize(tuple(size), Image.LANCZOS, box=box)
+
+    def encode(self, image, fmt, quality=85, progressive=False, bilevel=False):
+        output = io.BytesIO()
+        if bilevel:
+            image = image.convert('L').point(lambda p: 255 if p >= 128 else 0).convert('1', dither=Image.Dither.NONE)
+        if fmt == 'JPEG':
+            if image.mode not in ('RGB', 'L'):
+                image = self._to_srgb(image)
+            image.save(output, format='JPEG', quality=quality, progressive=progressive, optimize=True)
+        else:
+            image.save(output, format='PNG', optimize=True)
+        return output.getvalue()
+
+
+class VipsBackend(ImagingBackend):
+    name = 'vips'
+
+    def __init__(self):
+        if pyvips is None:
+            raise RuntimeError('pyvips/libvips is niet geïnstalleerd.')
+        self._strip = {'keep': 'none'} if pyvips.at_least_libvips(8, 15) else {'strip': True}
+
+    def load(self, contents, draft_size=None, autorotate=False, srgb=False):
+        try:
+            image = pyvips.Image.new_from_buffer(contents, '')
+            loader = image.get('vips-loader')
+        except pyvips.Error:
+            raise ValueError('Bestand is geen geldige afbeelding.')
+        if not loader.startswith(('jpeg', 'png')):
+            raise ValueError('Alleen JPG of PNG toegestaan.')
+        if draft_size and loader.startswith('jpeg'):
+            # Shrink-on-load: grootste factor (1, 2, 4, 8) waarbij beide zijden >= draft_size blijven
+            width, height = image.width, image.height
+            if autorotate and image.get_typeof('orientation') and image.get('orientation') in (5, 6, 7, 8):
+                draft_size = (draft_size[1], draft_size[0])
+            shrink = 1
+            while shrink < 8 and width // (shrink * 2) >= draft_size[0] and height // (shrink * 2) >= draft_size[1]:
+                shrink *= 2
+            if shrink > 1:
+                image = pyvips.Image.new_from_buffer(contents, '', shrink=shrink)
+        try:
+            image = image.copy_memory()  # Volledig decoderen: valideert ook de data
+        except pyvips.Error as e:
+            raise ValueError(f'Bestand is geen geldige afbeelding: {e}')
+        if autorotate:
+            image = image.autorot()
+        if srgb:
+            if image.get_typeof('icc-profile-data'):
+                try:
+                    image = image.icc_transform('srgb')
+                except pyvips.Error as e:
+                    logging.warning(f"ICC-profiel kon niet worden toegepast: {e}")
+            if image.hasalpha():
+                image = image.flatten(background=[255] * (image.bands - 1))
+            image = image.colourspace('srgb') if image.interpretation != 'srgb' else image
+            if image.bands > 3:
+                image = image.extract_band(0, n=3)
+            image = image.cast('uchar')
+        return image
+
+    def size(self, image):
+        return image.width, image.height
+
+    def _pixels(self, image):
+        if image.format != 'uchar':
+            image = image.colourspace('srgb' if image.bands >= 3 else 'b-w')  # bijv. 16-bits PNG
+        array = np.ndarray(buffer=image.cast('uchar').write_to_memory(), dtype=np.uint8,
+                           shape=[image.height, image.width, image.bands])
+        return array[:, :, 0] if image.bands == 1 else array
+
+    def from_array(self, array):
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        height, width = array.shape[:2]
+        bands = 1 if array.ndim == 2 else array.shape[2]
+        return pyvips.Image.new_from_memory(array.tobytes(), width, height, bands, 'uchar')
+
+    def resize(self, image, size, box=None):
+        if box is not None:
+            left, top, right, bottom = box
+            image = image.crop(left, top, right - left, bottom - top)
+        if (image.width, image.height) == tuple(size):
+            return image
+        return image.resize(size[0] / image.width, vscale=size[1] / image.height, kernel='lanczos3')
+
+    def encode(self, image, fmt, quality=85, progressive=False, bilevel=False):
+        if bilevel:
+            gray = image.colourspace('b-w').extract_band(0) if image.bands > 1 else image
+            return (gray >= 128).ifthenelse(255, 0).cast('uchar').pngsave_buffer(bitdepth=1, compression=9, **self._strip)
+        if fmt == 'JPEG':
+            if image.hasalpha():
+                image = image.flatten(background=[255] * (image.bands - 1))
+            return image.jpegsave_buffer(Q=quality, interlace=progressive, optimize_coding=True, **self._strip)
+        return image.pngsave_buffer(compression=9, **self._strip)
+
+
+BACKENDS = {
+    'pillow': PillowBackend,
+    'vips': VipsBackend,
+}
+
+_backends = {}
+
+
+def available_backends():
+    return [name for name in BACKENDS if name != 'vips' or pyvips is not None]
+
+
+def get_backend(name=None):
+    """Backend-instantie op naam; 'auto' kiest vips als die beschikbaar is, anders Pillow."""
+    name = (name or IMAGING_BACKEND).lower()
+    if name == 'auto':
+        name = 'vips' if pyvips is not None else 'pillow'
+    if name not in BACKENDS:
+        raise ValueError(f'Onbekende imaging backend: {name}')
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+# --- Verwerkingsmodi ---
+
+def _otsu_threshold(levels):
+    """Otsu-drempel (0-255) voor een uint8-array, volledig gevectoriseerd via een histogram."""
+    hist = np.bincount(levels.ravel(), minlength=256).astype(np.float64)
+    centers = np.arange(256, dtype=np.float64)
+    w0 = np.cumsum(hist)
+    w1 = w0[-1] - w0
+    m0 = np.cumsum(hist * centers)
+    mean0 = m0 / np.maximum(w0, 1)
+    mean1 = (m0[-1] - m0) / np.maximum(w1, 1)
+    between = w0 * w1 * (mean0 - mean1) ** 2
+    return int(np.argmax(between)) + 1
+
+
+def _bilinear_upsample(small, shape):
+    """Bilineair opschalen van een 2D-array naar shape (h, w)."""
+    sh, sw = small.shape
+    h, w = shape
+    ys = np.clip((np.arange(h) + 0.5) * sh / h - 0.5, 0, sh - 1)
+    xs = np.clip((np.arange(w) + 0.5) * sw / w - 0.5, 0, sw - 1)
+    y0, x0 = ys.astype(np.intp), xs.astype(np.intp)
+    y1, x1 = np.minimum(y0 + 1, sh - 1), np.minimum(x0 + 1, sw - 1)
+    wy, wx = (ys - y0)[:, None], (xs - x0)[None, :]
+    top = small[y0][:, x0] * (1 - wx) + small[y0][:, x1] * wx
+    bottom = small[y1][:, x0] * (1 - wx) + small[y1][:, x1] * wx
+    return top * (1 - wy) + bottom * wy
+
+
+def signature_mask(gray):
+    """
+    Inktmasker van een foto van een handtekening op papier: schat de papierachtergrond per blok,
+    normaliseer en bepaal een Otsu-drempel. Return (masker, box) of (None, None) zonder inkt.
+    """
+    gray = gray.astype(np.float32)
+    h, w = gray.shape
+    # Achtergrond: 90e percentiel per blok (papier is lichter dan inkt), bepaald op een verkleinde
+    # kopie (blokgemiddelden) en daarna bilineair opgeschaald; de achtergrond varieert alleen langzaam
+    factor = max(1, max(h, w) // 512)
+    small = gray[:h // factor * factor, :w // factor * factor]
+    small = small.reshape(h // factor, factor, w // factor, factor).mean(axis=(1, 3))
+    sh, sw = small.shape
+    block = max(4, min(sh, sw) // 16)
+    padded = np.pad(small, ((0, -sh % block), (0, -sw % block)), mode='edge')
+    blocks = padded.reshape(padded.shape[0] // block, block, padded.shape[1] // block, block)
+    background = np.percentile(blocks, 90, axis=(1, 3)).astype(np.float32)
+    background = _bilinear_upsample(background, (h, w))
+    normalized = (np.minimum(gray / np.maximum(background, 1.0), 1.0) * 255).astype(np.uint8)
+    # Inkt moet duidelijk donkerder zijn dan het lokale papier, ook als Otsu in de ruis kiest
+    threshold = min(_otsu_threshold(normalized), 204)
+    ink = normalized < threshold
+    # Bounding box op basis van projecties; losse ruispixels tellen niet mee
+    rows = np.flatnonzero(ink.sum(axis=1) >= 2)
+    cols = np.flatnonzero(ink.sum(axis=0) >= 2)
+    if rows.size == 0 or cols.size == 0:
+        return None, None
+    margin = max(2, int(0.02 * max(h, w)))
+    box = (max(cols[0] - margin, 0), max(rows[0] - margin, 0),
+           min(cols[-1] + margin + 1, w), min(rows[-1] + margin + 1, h))
+    return ink, box
+
+
+def _border_width(fractions, max_width):
+    """
+    Breedte van een effen rand vanaf index 0: de lijnen ervoor zijn (vrijwel) leeg en de rand eindigt in
+    een rechte overgang over het grootste deel van de lijn (fotorand), niet in een los object.
+    """
+    first = int(np.argmax(fractions > 0.005)) if np.any(fractions > 0.005) else len(fractions)
+    if first == 0 or first > max_width:
+        return 0
+    if fractions[first:first + 3].max() < 0.5:
+        return 0  # Bijv. een effen fotoachtergrond die overgaat in het hoofd: niet wegsnijden
+    return first
+
+
+def trim_uniform_borders(rgb, tolerance=12, max_fraction=0.25):
+    """
+    Bepaal de box binnen effen randen (scanmarges, zwarte balken). Een rij of kolom is rand als vrijwel
+    alle pixels binnen tolerance van de randkleur liggen en er geen randovergang (gradiënt) in zit, en de
+    rand moet eindigen in een rechte overgang. Per zijde wordt hooguit max_fraction weggesneden.
+    """
+    arr = rgb.astype(np.int16)
+    if arr.ndim == 2:
+        arr = arr[:, :, None]
+    h, w, _ = arr.shape
+    frame = np.concatenate([arr[0], arr[-1], arr[:, 0], arr[:, -1]])
+    reference = np.median(frame, axis=0)
+    off_colour = np.abs(arr - reference).max(axis=2) > tolerance
+    # Gradiënt (randdetectie) in beide richtingen, maximaal over de kanalen
+    edges = np.zeros((h, w), dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(arr, axis=1)).max(axis=2) > tolerance
+    edges[1:, :] |= np.abs(np.diff(arr, axis=0)).max(axis=2) > tolerance
+    content = off_colour | edges
+    rows = content.mean(axis=1)
+    cols = content.mean(axis=0)
+    max_h, max_w = int(h * max_fraction), int(w * max_fraction)
+    top = _border_width(rows, max_h)
+    bottom = h - _border_width(rows[::-1], max_h)
+    left = _border_width(cols, max_w)
+    right = w - _border_width(cols[::-1], max_w)
+    return left, top, right, bottom
+
+
+def center_crop_box(size, aspect):
+    """Grootste gecentreerde box met breedte/hoogte = aspect."""
+    width, height = size
+    if width / height > aspect:
+        new_w = int(round(height * aspect))
+        left = (width - new_w) // 2
+        return left, 0, left + new_w, height
+    new_h = int(round(width / aspect))
+    top = (height - new_h) // 2
+    return 0, top, width, top + new_h
+
+
+def encode_progressive_jpeg(backend, image, target_bytes=PASFOTO_TARGET_BYTES, min_quality=60, max_quality=92):
+    """Progressieve JPEG met de hoogste kwaliteit die binnen target_bytes past (binair zoeken)."""
+    best = backend.encode(image, 'JPEG', quality=min_quality, progressive=True)
+    low, high = min_quality + 1, max_quality
+    while low <= high:
+        quality = (low + high) // 2
+        data = backend.encode(image, 'JPEG', quality=quality, progressive=True)
+        if len(data) <= target_bytes:
+            best, low = data, quality + 1
+        else:
+            high = quality - 1
+    return best
+
+
+def _process_pasfoto(backend, contents):
+    """
+    Pasfoto in één decode: EXIF-oriëntatie herstellen, effen randen wegsnijden, centreren op de
+    pasfotoverhouding, schalen binnen requirements['pasfoto'] en als progressieve JPEG zonder metadata coderen.
+    """
+    image = backend.load(contents, draft_size=requirements['pasfoto']['max'], autorotate=True, srgb=True)
+    left, top, right, bottom = trim_uniform_borders(backend.to_array(image))
+    crop_left, crop_top, crop_right, crop_bottom = center_crop_box((right - left, bottom - top), PASFOTO_ASPECT)
+    box = (left + crop_left, top + crop_top, left + crop_right, top + crop_bottom)
+    new_size = fit_size((box[2] - box[0], box[3] - box[1]), 'pasfoto')
+    image = backend.resize(image, new_size, box=box)
+    return encode_progressive_jpeg(backend, image), new_size
+
+
+def _process_handtekening(backend, contents, filename):
+    """Handtekening opschonen tot een bijgesneden 1-bit PNG binnen requirements['handtekening']."""
+    image = backend.load(contents, autorotate=True)
+    ink, box = signature_mask(backend.to_array(image, gray=True))
+    if ink is None:
+        logging.warning(f"Geen inkt gevonden in handtekening {filename}, alleen geresized")
+        new_size = fit_size(backend.size(image), 'handtekening')
+        return backend.encode(backend.resize(image, new_size), 'PNG'), new_size
+    left, top, right, bottom = box
+    cropped = np.where(ink[top:bottom, left:right], 0, 255).astype(np.uint8)
+    new_size = fit_size((right - left, bottom - top), 'handtekening')
+    # LANCZOS op de binaire uitsnede en daarna opnieuw drempelen: scherpe randen zonder dithering-ruis
+    signature = backend.resize(backend.from_array(cropped), new_size)
+    return backend.encode(signature, 'PNG', bilevel=True), new_size
+
+
+def _process_resize(backend, contents, image_type, fmt):
+    """Standaard: schalen binnen min/max, aspect ratio behouden."""
+    image = backend.load(contents)
+    new_size = fit_size(backend.size(image), image_type)
+    return backend.encode(backend.resize(image, new_size), fmt), new_size
+
+
+def process_image(contents, image_type, filename, backend=None):
+    """
+    Valideer en verwerk een geüploade afbeelding volgens de eisen van image_type.
+    Return dict met 'data' (bytes), 'format', 'ext', 'size' (na verwerking) en 'backend'.
+    """
+    if image_type not in requirements:
+        raise ValueError('Ongeldig afbeeldingstype.')
+    backend = backend if isinstance(backend, ImagingBackend) else get_backend(backend)
+    fmt = output_format(filename, image_type)
+    if image_type == 'pasfoto':
+        data, size = _process_pasfoto(backend, contents)
+    elif image_type == 'handtekening':
+        data, size = _process_handtekening(backend, contents, filename)
+    else:
+        data, size = _process_resize(backend, contents, image_type, fmt)
+    logging.info(f"Afbeelding {filename} ({image_type}) verwerkt met {backend.name}: {size[0]}x{size[1]}, {len(data)} bytes")
+    return {
+        'data': data,
+        'format': fmt,
+        'ext': output_extension(filename, fmt),
+        'size': size,
+        'backend': backend.name,
+    }
@@ -0,0 +1,316 @@
+"""
+Bundelen van aanvragen per afdelingsadres (digest).
+
+Zonder bundeling krijgt de afdeling Korpscheftaken per aanvraag een eigen
+bericht; een bedrijf dat 50 beveiligers aanmeldt levert 50 berichten op. Voor
+adressen in MAIL_DIGEST_ADDRESSES ('*' = alle) gaat een aanvraag daarom niet
+direct de wachtrij in, maar wordt ze met een kopie van de bijlagen bewaard in
+mail_digest_items. Is de oudste aanvraag voor een adres
+MAIL_DIGEST_WINDOW_MINUTES oud, dan gaan alle wachtende aanvragen voor dat
+adres als één bericht de mailqueue in: een index (tekst + HTML) en per
+aanvraag genummerde bijlagen. Past dat niet binnen MAX_EMAIL_BYTES, dan wordt
+de bundel over meerdere berichten verdeeld.
+
+Elke aanvraag houdt haar eigen rij in email_tracking (status 'digest' zolang
+ze wacht); via tracking_ids van de mailqueue volgt die rij daarna de status
+van het bundelbericht.
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from modules.attachment_budget import MAX_EMAIL_BYTES, PART_OVERHEAD_BYTES, encoded_size, estimate_message_size
+from modules.email_config import get_smtp_config
+from modules.email_templates import render_email
+from modules.mail_queue import (DIGEST, MAIL_QUEUE_DB, MAIL_QUEUE_LOCK_SECONDS, MAIL_QUEUE_POLL_SECONDS, PRIORITY_HIGH,
+                                get_mail_queue)
+from modules.mime_stream import StreamedMessage
+
+MAIL_DIGEST_ADDRESSES = os.getenv('MAIL_DIGEST_ADDRESSES', '')  # leeg: uit; '*': alle afdelingen
+MAIL_DIGEST_WINDOW_MINUTES = float(os.getenv('MAIL_DIGEST_WINDOW_MINUTES', 24 * 60))
+MAIL_DIGEST_DIR = os.getenv('MAIL_DIGEST_DIR', 'mail_digest')
+
+# Ruimte voor de index (tekst + HTML) bovenop de bijlagen
+INDEX_BYTES_PER_ITEM = 4096
+
+
+def parse_addresses(value):
+    """'*' of een komma-gescheiden lijst; adressen zonder hoofdlettergevoeligheid."""
+    return {address.strip().lower() for address in value.split(',') if address.strip()}
+
+
+class MailDigest:
+    def __init__(self, queue=None, db_path=MAIL_QUEUE_DB, directory=MAIL_DIGEST_DIR,
+                 window_minutes=MAIL_DIGEST_WINDOW_MINUTES, addresses=MAIL_DIGEST_ADDRESSES,
+                 max_bytes=MAX_EMAIL_BYTES, poll_seconds=MAIL_QUEUE_POLL_SECONDS):
+        self.queue = queue or get_mail_queue()
+        self.db_path = db_path
+        self.directory = directory
+        self.window_seconds = window_minutes * 60
+        self.addresses = parse_addresses(addresses)
+        self.max_bytes = max_bytes
+        self.poll_seconds = poll_seconds
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        os.makedirs(self.directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS mail_digest_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_id TEXT UNIQUE NOT NULL,
+                to_email TEXT NOT NULL,
+                context TEXT NOT NULL,
+                attachments TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                digest_id TEXT,
+                claimed_at REAL,
+                created_at REAL NOT NULL
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_mail_digest_open ON mail_digest_items (digest_id, to_email)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enabled_for(self, address):
+        return '*' in self.addresses or (address or '').lower() in self.addresses
+
+    # --- Verzamelen ---
+
+    def add(self, to_email, subject, form, attachments, reply_to=None, tracking_pixel_url=None, user_id=None,
+            form_data_id=None, email_id=None):
+        """
+        Bewaar een aanvraag voor de volgende bundel naar to_email en return het email_id.
+        form: de e-mailcontext van de aanvraag (convert_form(...).email). De bijlagen worden gekopieerd,
+        zodat de uploads en tijdelijke bestanden direct opgeruimd kunnen worden.
+        """
+        email_id = email_id or uuid.uuid4().hex
+        item_dir = os.path.join(self.directory, email_id)
+        os.makedirs(item_dir)
+        try:
+            copies = []
+            for path in attachments:
+                copy = os.path.join(item_dir, os.path.basename(path))
+                shutil.copyfile(path, copy)
+                copies.append(copy)
+            context = {'form': form, 'reply_to': reply_to, 'tracking_pixel_url': tracking_pixel_url}
+            size = sum(encoded_size(os.path.getsize(path)) + PART_OVERHEAD_BYTES for path in copies)
+            conn = self._connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('''INSERT INTO mail_digest_items (email_id, to_email, context, attachments, size, created_at)
+                               VALUES (?, ?, ?, ?, ?, ?)''',
+                             (email_id, to_email, json.dumps(context), json.dumps(copies), size, time.time()))
+                conn.execute('''INSERT INTO email_tracking
+                               (email_id, to_email, subject, user_id, form_data_id, sent_at, status)
+                               VALUES (?, ?, ?, ?, ?, NULL, ?)''',
+                             (email_id, to_email, subject, user_id, form_data_id, DIGEST))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            finally:
+                conn.close()
+        except Exception:
+            shutil.rmtree(item_dir, ignore_errors=True)
+            raise
+        logging.info(f"Digest: {email_id} bewaard voor de bundel naar {to_email}")
+        self._wakeup.set()
+        return email_id
+
+    # --- Bundelen ---
+
+    def _claim(self, force=False):
+        """Wijs de wachtende aanvragen van elk adres waarvan het venster verstreken is toe aan bundels."""
+        cutoff = time.time() - (0 if force else self.window_seconds)
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            addresses = [row[0] for row in conn.execute(
+                '''SELECT to_email FROM mail_digest_items WHERE digest_id IS NULL
+                   GROUP BY to_email HAVING MIN(created_at) <= ?''', (cutoff,))]
+            batches = []
+            for address in addresses:
+                rows = conn.execute('''SELECT * FROM mail_digest_items WHERE digest_id IS NULL AND to_email = ?
+                                      ORDER BY created_at, id''', (address,)).fetchall()
+                batch, size = [], estimate_message_size([])
+                for row in rows:
+                    # Te groot voor één bericht: de rest gaat in een volgende bundel naar hetzelfde adres
+                    if batch and size + row['size'] + INDEX_BYTES_PER_ITEM > self.max_bytes:
+                        batches.append(batch)
+                        batch, size = [], estimate_message_size([])
+                    batch.append(row)
+                    size += row['size'] + INDEX_BYTES_PER_ITEM
+                batches.append(batch)
+            claimed = []
+            now = time.time()
+            for batch in batches:
+                digest_id = uuid.uuid4().hex
+                conn.executemany('UPDATE mail_digest_items SET digest_id = ?, claimed_at = ? WHERE id = ?',
+                                 [(digest_id, now, row['id']) for row in batch])
+                claimed.append((digest_id, batch))
+            conn.execute('COMMIT')
+            return claimed
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _release(self, digest_id):
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE mail_digest_items SET digest_id = NULL, claimed_at = NULL WHERE digest_id = ?',
+                         (digest_id,))
+        finally:
+            conn.close()
+
+    def _remove_items(self, digest_id):
+        conn = self._connect()
+        try:
+            email_ids = [row[0] for row in conn.execute('SELECT email_id FROM mail_digest_items WHERE digest_id = ?',
+                                                        (digest_id,))]
+            conn.execute('DELETE FROM mail_digest_items WHERE digest_id = ?', (digest_id,))
+        finally:
+            conn.close()
+        for email_id in email_ids:
+            shutil.rmtree(os.path.join(self.directory, email_id), ignore_errors=True)
+
+    def _recover(self):
+        """Bundels van een gecrashte worker: al in de mailqueue -> opruimen, anders opnieuw laten wachten."""
+        conn = self._connect()
+        try:
+            stale = conn.execute('''SELECT DISTINCT digest_id, digest_id IN (SELECT email_id FROM mail_queue)
+                                   FROM mail_digest_items WHERE digest_id IS NOT NULL AND claimed_at < ?''',
+                                 (time.time() - MAIL_QUEUE_LOCK_SECONDS,)).fetchall()
+        finally:
+            conn.close()
+        for digest_id, queued in stale:
+            if queued:
+                self._remove_items(digest_id)
+            else:
+                logging.warning(f"Digest: bundel {digest_id} is niet in de wachtrij gekomen, opnieuw vrijgegeven")
+                self._release(digest_id)
+
+    def build_message(self, rows):
+        """Bundelbericht voor de aanvragen in rows (zelfde adres, oudste eerst): index, dan de bijlagen."""
+        items, files = [], []
+        for nummer, row in enumerate(rows, start=1):
+            bijlagen = []
+            for path in json.loads(row['attachments']):
+                filename = f"{nummer:02d} - {os.path.basename(path)}"
+                files.append((path, filename))
+                bijlagen.append(filename)
+            items.append(dict(json.loads(row['context']), nummer=nummer, bijlagen=bijlagen))
+
+        body, html_body = render_email(
+            'digest',
+            items=items,
+            afdeling=items[0]['form'].get('afdeling', ''),
+            van=datetime.fromtimestamp(rows[0]['created_at']).strftime('%d-%m-%Y %H:%M'),
+            tot=datetime.fromtimestamp(rows[-1]['created_at']).strftime('%d-%m-%Y %H:%M'),
+        )
+        msg = StreamedMessage('mixed')
+        msg['From'] = f"ATK-WPBR Tool <{get_smtp_config()['from']}>"
+        msg['To'] = rows[0]['to_email']
+        msg['Subject'] = f"Aanvragen Beveiligingspas - {len(rows)} aanvra{'ag' if len(rows) == 1 else 'gen'}"
+        msg['X-Mailer'] = 'ATK-WPBR Tool v2.0'
+        alt = MIMEMultipart('alternative')
+        alt.attach(MIMEText(body, 'plain', 'utf-8'))
+        alt.attach(MIMEText(html_body, 'html', 'utf-8'))
+        msg.attach(alt)
+        for path, filename in files:
+            msg.attach_file(path, filename=filename)
+        return msg
+
+    def flush(self, force=False):
+        """Zet de bundels waarvan het venster verstreken is (force: alle) in de mailqueue; return het aantal."""
+        self._recover()
+        queued = 0
+        for digest_id, rows in self._claim(force):
+            try:
+                msg = self.build_message(rows)
+                # enqueue() schrijft het bericht met de bijlagen naar de spool; daarna zijn de kopieën niet meer nodig
+                self.queue.enqueue(msg, email_id=digest_id, tracking_ids=[row['email_id'] for row in rows],
+                                   priority=PRIORITY_HIGH)
+            except Exception as e:
+                logging.error(f"Digest: bundel {digest_id} naar {rows[0]['to_email']} niet in de wachtrij gezet: {e}")
+                self._release(digest_id)
+                continue
+            self._remove_items(digest_id)
+            logging.info(f"Digest: {len(rows)} aanvraag/aanvragen gebundeld naar {rows[0]['to_email']} ({digest_id})")
+            queued += 1
+        return queued
+
+    def _next_due_in(self):
+        conn = self._connect()
+        try:
+            oldest = conn.execute('SELECT MIN(created_at) FROM mail_digest_items WHERE digest_id IS NULL').fetchone()[0]
+        finally:
+            conn.close()
+        if oldest is None:
+            return self.poll_seconds * 6
+        return min(max(oldest + self.window_seconds - time.time(), 0.05), self.poll_seconds * 6)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                self.flush()
+                wait = self._next_due_in()
+            except Exception as e:
+                logging.error(f"Digest worker: {e}")
+                wait = self.poll_seconds
+            self._wakeup.wait(wait)
+
+    def start(self):
+        """Start de bundel-thread in dit proces (opnieuw na een fork)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='mail-digest', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def pending(self):
+        """{adres: aantal wachtende aanvragen}"""
+        conn = self._connect()
+        try:
+            return dict(conn.execute('''SELECT to_email, COUNT(*) FROM mail_digest_items WHERE digest_id IS NULL
+                                       GROUP BY to_email''').fetchall())
+        finally:
+            conn.close()
+
+
+_digest = None
+_digest_lock = threading.Lock()
+
+
+def get_mail_digest():
+    """Gedeelde bundelaar per proces, op de gedeelde mailqueue."""
+    global _digest
+    if _digest is None:
+        with _digest_lock:
+            if _digest is None:
+                _digest = MailDigest()
+    return _digest
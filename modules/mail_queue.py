@@ -0,0 +1,505 @@
+"""
+Duurzame wachtrij voor uitgaande e-mail.
+
+Routes verzenden niet meer zelf: ze zetten het volledig opgebouwde bericht in
+de wachtrij (spoolbestand met CRLF-regels + rij in mail_queue in dezelfde
+SQLite database) en gaan direct verder. Een achtergrondthread per proces levert de berichten af
+via de SMTP-pool. Een tijdelijke fout geeft een nieuwe poging met
+exponentiële backoff; een permanente fout (of te veel pogingen) zet het
+bericht op 'dead' en het spoolbestand blijft staan voor onderzoek.
+De status wordt bijgewerkt in mail_queue en, als het bericht daar staat, in
+email_tracking, zodat de bevestigingspagina die kan tonen. Een bericht dat
+meerdere aanvragen bundelt (digest) werkt via tracking_ids de rij van elke
+aanvraag bij.
+
+Meerdere processen (gunicorn workers) kunnen tegelijk een worker draaien:
+een bericht wordt met BEGIN IMMEDIATE geclaimd en een claim van een
+gecrashte worker verloopt na MAIL_QUEUE_LOCK_SECONDS. Binnen een proces
+levert de worker tot MAIL_QUEUE_CONCURRENCY berichten tegelijk af, zodat de
+aanvraag en de bevestiging niet op elkaars SMTP-sessie wachten.
+
+Met een SendRateLimiter (zie send_rate.py) claimt de worker alleen een
+bericht als het account binnen de verzendlimiet van de provider een token
+heeft; anders wacht hij tot er weer een is. Berichten met een hogere
+prioriteit (de aanvraag naar de afdeling vóór bevestigingen en feedback)
+gaan binnen die ruimte voor.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+
+from modules.mime_stream import message_envelope, write_message
+from modules.send_rate import SendRateLimiter
+
+MAIL_QUEUE_DB = os.getenv('DATABASE_PATH', 'users.db')
+MAIL_SPOOL_DIR = os.getenv('MAIL_SPOOL_DIR', 'mail_spool')
+MAIL_QUEUE_WORKER = os.getenv('MAIL_QUEUE_WORKER', '1').lower() in ('1', 'true', 'yes')
+MAIL_QUEUE_POLL_SECONDS = float(os.getenv('MAIL_QUEUE_POLL_SECONDS', 10))
+MAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv('MAIL_QUEUE_MAX_ATTEMPTS', 8))
+MAIL_QUEUE_BACKOFF = float(os.getenv('MAIL_QUEUE_BACKOFF', 30))  # seconden vóór de tweede poging, daarna x2
+MAIL_QUEUE_MAX_BACKOFF = float(os.getenv('MAIL_QUEUE_MAX_BACKOFF', 3600))
+MAIL_QUEUE_LOCK_SECONDS = float(os.getenv('MAIL_QUEUE_LOCK_SECONDS', 300))
+# Berichten die tegelijk worden afgeleverd; gelijk aan SMTP_POOL_SIZE, zodat elke sessie hergebruikt wordt
+MAIL_QUEUE_CONCURRENCY = int(os.getenv('MAIL_QUEUE_CONCURRENCY', 2))
+
+QUEUED = 'queued'
+SENDING = 'sending'
+RETRY = 'retry'
+SENT = 'sent'
+DEAD = 'dead'
+DIGEST = 'digest'  # email_tracking: de aanvraag wacht op de bundel (mail_digest)
+
+# Volgorde binnen de verzendlimiet: lager gaat eerst
+PRIORITY_HIGH = 0    # aanvragen naar de afdeling (ook als bundel)
+PRIORITY_NORMAL = 1  # bevestigingen en verificatiemails
+PRIORITY_LOW = 2     # feedback
+PRIORITY_NAMES = {PRIORITY_HIGH: 'high', PRIORITY_NORMAL: 'normal', PRIORITY_LOW: 'low'}
+
+
+def is_permanent_error(error):
+    """Geweigerde afzender/ontvangers en 5xx-antwoorden (behalve authenticatie) hebben geen zin om te herhalen."""
+    if getattr(error, 'permanent', None) is not None:
+        return bool(error.permanent)  # MailTransportError en andere backends geven het zelf aan
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False  # configuratiefout: na correctie moet het bericht alsnog weg
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+
+def backoff_seconds(attempts, base=MAIL_QUEUE_BACKOFF, maximum=MAIL_QUEUE_MAX_BACKOFF):
+    """Wachttijd na de zoveelste mislukte poging, met 10% spreiding zodat workers niet synchroon lopen."""
+    delay = min(base * 2 ** max(attempts - 1, 0), maximum)
+    return delay * random.uniform(1.0, 1.1)
+
+
+def combined_status(statuses):
+    """
+    Eén uitkomst voor berichten die bij elkaar horen, het leidende bericht eerst (aanvraag, dan bevestiging):
+    'sent' als alles verzonden is, 'dead' als het leidende bericht definitief mislukt is, 'partial' als
+    alleen een volgend bericht mislukt is, 'digest' als het leidende bericht op de bundel wacht en de rest
+    verzonden is, en anders 'pending'. None (geen bericht) telt niet mee.
+    """
+    statuses = [status for status in statuses if status is not None]
+    if not statuses:
+        return None
+    if statuses[0] == DEAD:
+        return DEAD
+    if all(status == SENT for status in statuses):
+        return SENT
+    if statuses[0] == SENT and all(status in (SENT, DEAD) for status in statuses):
+        return 'partial'
+    if statuses[0] == DIGEST and all(status == SENT for status in statuses[1:]):
+        return DIGEST
+    return 'pending'
+
+
+def _tracking_ids(row):
+    """email_tracking-rijen die de status van een wachtrijbericht volgen."""
+    return json.loads(row['tracking_ids']) if row['tracking_ids'] else [row['email_id']]
+
+
+def _update_tracking(conn, email_ids, assignments, params):
+    placeholders = ', '.join('?' * len(email_ids))
+    conn.execute(f'UPDATE email_tracking SET {assignments} WHERE email_id IN ({placeholders})',
+                 (*params, *email_ids))
+
+
+class MailQueue:
+    def __init__(self, db_path=MAIL_QUEUE_DB, spool_dir=MAIL_SPOOL_DIR, max_attempts=MAIL_QUEUE_MAX_ATTEMPTS,
+                 poll_seconds=MAIL_QUEUE_POLL_SECONDS, concurrency=MAIL_QUEUE_CONCURRENCY, rate_limiter=None):
+        self.db_path = db_path
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = rate_limiter
+        self._rate_wait = None  # seconden tot de verzendlimiet weer een bericht toelaat
+        self._executor = None
+        self._executor_pid = None
+        self._in_flight = 0  # afleveringen die nu in de executor lopen
+        self._in_flight_lock = threading.Lock()
+        self._accounts = {}  # naam -> functie die een SMTP-pool teruggeeft
+        self._listeners = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        os.makedirs(self.spool_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS mail_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email_id TEXT UNIQUE NOT NULL,
+                account TEXT NOT NULL,
+                from_addr TEXT NOT NULL,
+                recipients TEXT NOT NULL,
+                spool_path TEXT NOT NULL,
+                size INTEGER,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                locked_until REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                tracking_ids TEXT,
+                priority INTEGER NOT NULL DEFAULT 1
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_mail_queue_due ON mail_queue (status, next_attempt_at)')
+            for column in ('tracking_ids TEXT', f'priority INTEGER NOT NULL DEFAULT {PRIORITY_NORMAL}'):
+                try:
+                    conn.execute(f'ALTER TABLE mail_queue ADD COLUMN {column}')
+                except sqlite3.OperationalError:
+                    pass  # kolom bestaat al
+            if self.rate_limiter is not None:
+                self.rate_limiter.ensure_table(conn)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def register_account(self, name, pool_factory):
+        """Koppel een accountnaam aan een functie die de SMTP-pool voor dat account geeft."""
+        self._accounts[name] = pool_factory
+
+    def add_listener(self, callback):
+        """callback() wordt aangeroepen nadat een aflevering is vastgelegd (verzonden, retry of dead)."""
+        self._listeners.append(callback)
+
+    # --- In de wachtrij zetten ---
+
+    def _write_spool(self, email_id, msg):
+        path = os.path.join(self.spool_dir, f"{email_id}.eml")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            # CRLF zonder Bcc; een StreamedMessage schrijft de bijlagen in blokken vanaf schijf
+            write_message(f, msg)
+        os.replace(tmp_path, path)
+        return path
+
+    def enqueue(self, msg, from_addr=None, recipients=None, email_id=None, account='default', tracking=None,
+                tracking_ids=None, priority=PRIORITY_NORMAL):
+        """
+        Zet een bericht (email.message, StreamedMessage of bytes) in de wachtrij en return het email_id.
+        Zonder from_addr/recipients worden die, net als bij send_message, uit From/To/Cc/Bcc gehaald;
+        de Bcc-header gaat niet mee in het bericht. tracking: dict met to_email, subject, user_id en
+        form_data_id voor een rij in email_tracking. tracking_ids: bestaande email_tracking-rijen die de
+        status van dit bericht volgen (in plaats van de rij met het eigen email_id). priority: PRIORITY_HIGH,
+        PRIORITY_NORMAL of PRIORITY_LOW.
+        """
+        email_id = email_id or os.urandom(16).hex()
+        if not isinstance(msg, bytes) and (from_addr is None or recipients is None):
+            envelope_from, envelope_to = message_envelope(msg)
+            from_addr = from_addr or envelope_from
+            recipients = recipients if recipients is not None else envelope_to
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        if not from_addr or not recipients:
+            raise ValueError('Afzender en ontvangers zijn verplicht')
+
+        spool_path = self._write_spool(email_id, msg)
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''INSERT INTO mail_queue
+                           (email_id, account, from_addr, recipients, spool_path, size, status, next_attempt_at,
+                            priority)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (email_id, account, from_addr, json.dumps(list(recipients)), spool_path,
+                          os.path.getsize(spool_path), QUEUED, time.time(), priority))
+            if tracking_ids:
+                conn.execute('UPDATE mail_queue SET tracking_ids = ? WHERE email_id = ?',
+                             (json.dumps(list(tracking_ids)), email_id))
+                _update_tracking(conn, tracking_ids, 'status = ?', (QUEUED,))
+            if tracking:
+                conn.execute('''INSERT INTO email_tracking
+                               (email_id, to_email, subject, user_id, form_data_id, sent_at, status)
+                               VALUES (?, ?, ?, ?, ?, NULL, ?)''',
+                             (email_id, tracking['to_email'], tracking['subject'], tracking.get('user_id'),
+                              tracking.get('form_data_id'), QUEUED))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            os.remove(spool_path)
+            raise
+        finally:
+            conn.close()
+        logging.info(f"Mailqueue: {email_id} in de wachtrij ({account}, {len(recipients)} ontvanger(s))")
+        self._wakeup.set()
+        return email_id
+
+    # --- Afleveren ---
+
+    def _claim(self):
+        """
+        Claim het eerstvolgende bericht dat aan de beurt is (of waarvan de claim verlopen is), hoogste
+        prioriteit eerst, waarvoor het account binnen de verzendlimiet zit.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.execute('''SELECT * FROM mail_queue
+                                    WHERE (status IN (?, ?) AND next_attempt_at <= ?)
+                                       OR (status = ? AND locked_until < ?)
+                                    ORDER BY priority, next_attempt_at''',
+                                  (QUEUED, RETRY, now, SENDING, now))
+            row, waits = None, {}
+            for candidate in cursor:
+                if candidate['account'] in waits:
+                    continue  # dit account zit al aan zijn limiet
+                wait = self.rate_limiter.take(conn, candidate['account'], now) if self.rate_limiter else 0.0
+                if not wait:
+                    row = candidate
+                    break
+                waits[candidate['account']] = wait
+            cursor.close()
+            self._rate_wait = min(waits.values()) if waits and row is None else None
+            if row:
+                conn.execute('''UPDATE mail_queue SET status = ?, locked_until = ?, attempts = attempts + 1
+                               WHERE id = ?''', (SENDING, now + MAIL_QUEUE_LOCK_SECONDS, row['id']))
+                _update_tracking(conn, _tracking_ids(row), 'status = ?, attempts = ?', (SENDING, row['attempts'] + 1))
+            conn.execute('COMMIT')
+            return row
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, row, status, error=None, next_attempt_at=None):
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            if status == SENT:
+                conn.execute('''UPDATE mail_queue SET status = ?, locked_until = NULL, last_error = NULL,
+                               sent_at = CURRENT_TIMESTAMP WHERE id = ?''', (status, row['id']))
+                _update_tracking(conn, _tracking_ids(row), 'status = ?, last_error = NULL, sent_at = CURRENT_TIMESTAMP',
+                                 (status,))
+            else:
+                conn.execute('''UPDATE mail_queue SET status = ?, locked_until = NULL, last_error = ?,
+                               next_attempt_at = COALESCE(?, next_attempt_at) WHERE id = ?''',
+                             (status, error, next_attempt_at, row['id']))
+                _update_tracking(conn, _tracking_ids(row), 'status = ?, last_error = ?', (status, error))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Mailqueue: listener na {row['email_id']} mislukt: {e}")
+
+    def _deliver(self, row):
+        factory = self._accounts.get(row['account'])
+        if factory is None:
+            raise LookupError(f"Onbekend mailaccount {row['account']!r}")
+        # Het spoolbestand gaat regel voor regel naar het SMTP-datakanaal, niet eerst in het geheugen
+        refused = factory().send_file(row['from_addr'], json.loads(row['recipients']), row['spool_path'])
+        if refused:
+            logging.warning(f"Mailqueue: {row['email_id']} geweigerd voor {', '.join(refused)}")
+
+    def process_one(self):
+        """Lever één bericht af. Return False als er niets aan de beurt is."""
+        row = self._claim()
+        if row is None:
+            return False
+        self._process(row)
+        return True
+
+    def _process(self, row):
+        """Lever een geclaimd bericht af en leg de uitkomst vast."""
+        attempts = row['attempts'] + 1
+        try:
+            self._deliver(row)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            # Zonder spoolbestand of account heeft opnieuw proberen geen zin
+            permanent = isinstance(e, (LookupError, FileNotFoundError)) or is_permanent_error(e)
+            if permanent or attempts >= self.max_attempts:
+                logging.error(f"Mailqueue: {row['email_id']} definitief mislukt na {attempts} poging(en): {error}")
+                self._finish(row, DEAD, error)
+            else:
+                delay = backoff_seconds(attempts)
+                logging.warning(f"Mailqueue: {row['email_id']} poging {attempts} mislukt ({error}), "
+                                f"nieuwe poging over {delay:.0f}s")
+                self._finish(row, RETRY, error, time.time() + delay)
+            return
+        self._finish(row, SENT)
+        try:
+            os.remove(row['spool_path'])
+        except OSError:
+            pass
+        logging.info(f"Mailqueue: {row['email_id']} verzonden (poging {attempts})")
+
+    def process_due(self, limit=None):
+        """Lever af wat aan de beurt is, één voor één in deze thread; return het aantal verwerkte berichten."""
+        processed = 0
+        while (limit is None or processed < limit) and not self._stop.is_set():
+            if not self.process_one():
+                break
+            processed += 1
+        return processed
+
+    def _get_executor(self):
+        if self._executor is None or self._executor_pid != os.getpid():
+            # Na een fork bestaan de threads van de oude executor niet meer
+            self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='mail-queue-send')
+            self._executor_pid = os.getpid()
+            self._in_flight = 0
+        return self._executor
+
+    def _process_claimed(self, row):
+        try:
+            self._process(row)
+        except Exception as e:
+            logging.error(f"Mailqueue: verwerken van {row['email_id']} mislukt: {e}")
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            self._wakeup.set()  # vrije plek: de dispatcher kan het volgende bericht claimen
+
+    def dispatch(self):
+        """
+        Claim berichten zolang er een vrije plek is en lever ze parallel af (max. self.concurrency).
+        Return het aantal gestarte afleveringen; wacht er niet op.
+        """
+        executor = self._get_executor()
+        started = 0
+        while not self._stop.is_set() and self._in_flight < self.concurrency:
+            row = self._claim()
+            if row is None:
+                break
+            with self._in_flight_lock:
+                self._in_flight += 1
+            executor.submit(self._process_claimed, row)
+            started += 1
+        return started
+
+    def _next_due_in(self):
+        conn = self._connect()
+        try:
+            row = conn.execute('''SELECT MIN(CASE WHEN status = ? THEN locked_until ELSE next_attempt_at END)
+                                 FROM mail_queue WHERE status IN (?, ?, ?)''',
+                               (SENDING, QUEUED, RETRY, SENDING)).fetchone()
+        finally:
+            conn.close()
+        due_in = self.poll_seconds if row[0] is None else row[0] - time.time()
+        if self._rate_wait is not None and due_in <= 0:
+            due_in = self._rate_wait  # aan de beurt, maar de verzendlimiet is bereikt
+        return min(max(due_in, 0.05), self.poll_seconds)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()  # vóór het claimen, zodat een signaal tijdens dispatch() niet verloren gaat
+            try:
+                self.dispatch()
+                # Alle plekken bezet: een afgeronde aflevering maakt de dispatcher wakker
+                wait = self._next_due_in() if self._in_flight < self.concurrency else self.poll_seconds
+            except Exception as e:
+                logging.error(f"Mailqueue worker: {e}")
+                wait = self.poll_seconds
+            self._wakeup.wait(wait)
+
+    def start(self):
+        """Start de worker-thread in dit proces (opnieuw na een fork)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=True)  # lopende afleveringen afmaken
+        self._executor = None
+
+    # --- Status ---
+
+    def requeue(self, email_id):
+        """Zet een dead-letter bericht terug in de wachtrij."""
+        conn = self._connect()
+        try:
+            updated = conn.execute('''UPDATE mail_queue SET status = ?, attempts = 0, next_attempt_at = ?
+                                     WHERE email_id = ? AND status = ?''',
+                                   (QUEUED, time.time(), email_id, DEAD)).rowcount
+            if updated:
+                row = conn.execute('SELECT email_id, tracking_ids FROM mail_queue WHERE email_id = ?',
+                                   (email_id,)).fetchone()
+                _update_tracking(conn, _tracking_ids(row), 'status = ?', (QUEUED,))
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return bool(updated)
+
+    def status(self, email_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT status, attempts, last_error, created_at, sent_at FROM mail_queue '
+                               'WHERE email_id = ?', (email_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row else None
+
+    def stats(self):
+        """
+        Aantallen per status, plus de wachtrijdiepte per prioriteit, hoe lang het oudste wachtende bericht al
+        wacht, de gemiddelde wachttijd van wat het afgelopen uur verzonden is en de verzendlimieten per account.
+        """
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM mail_queue GROUP BY status').fetchall())
+            depth = dict(conn.execute('SELECT priority, COUNT(*) FROM mail_queue WHERE status IN (?, ?, ?) '
+                                      'GROUP BY priority', (QUEUED, RETRY, SENDING)).fetchall())
+            oldest, average = conn.execute('''SELECT
+                    (SELECT (julianday('now') - julianday(MIN(created_at))) * 86400 FROM mail_queue
+                     WHERE status IN (?, ?, ?)),
+                    (SELECT AVG(julianday(sent_at) - julianday(created_at)) * 86400 FROM mail_queue
+                     WHERE status = ? AND sent_at >= datetime('now', '-1 hour'))''',
+                                           (QUEUED, RETRY, SENDING, SENT)).fetchone()
+            rate = self.rate_limiter.stats(conn) if self.rate_limiter is not None else {}
+        finally:
+            conn.close()
+        stats = {status: counts.get(status, 0) for status in (QUEUED, SENDING, RETRY, SENT, DEAD)}
+        stats.update({
+            'depth': {name: depth.get(priority, 0) for priority, name in PRIORITY_NAMES.items()},
+            'oldest_wait_seconds': round(oldest or 0, 1),
+            'avg_wait_seconds': round(average or 0, 1),
+            'rate': rate,
+        })
+        return stats
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_mail_queue():
+    """Gedeelde wachtrij per proces."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = MailQueue(rate_limiter=SendRateLimiter())
+    return _queue
@@ -0,0 +1,262 @@
+"""
+Eén verzendinterface voor alle uitgaande e-mail.
+
+Een transport levert een bericht af aan een envelop (afzender + ontvangers):
+- send_file(from_addr, to_addrs, path): een gespoold bericht (CRLF), gestreamd;
+- send_message(msg, from_addr=None, to_addrs=None): een email.message,
+  StreamedMessage of bytes; zonder envelop wordt die uit de headers gehaald.
+Beide geven, net als smtplib.sendmail, een dict met geweigerde ontvangers.
+
+Backends (MAIL_TRANSPORT in de omgeving/.env):
+- smtp:   via de SMTP-pool van het account (standaard);
+- file:   schrijft elk bericht als .eml naar MAIL_CAPTURE_DIR (ontwikkeling);
+- memory: bewaart berichten in het geheugen van het proces (tests);
+- http:   POST van het ruwe MIME-bericht naar MAIL_HTTP_URL (message/rfc822,
+          envelop in X-Mail-From/X-Rcpt-To, API-sleutel als Bearer-token).
+SMTP en HTTP hebben aparte connect- en leestimeouts en een circuit breaker per server.
+"""
+import http.client
+import io
+import os
+import shutil
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from modules.email_config import get_smtp_config
+from modules.mime_stream import message_envelope, write_message
+from modules.resilience import get_breaker
+from modules.smtp_pool import get_smtp_pool
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv('MAIL_HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('MAIL_HTTP_TIMEOUT', 30))
+
+
+class MailTransportError(Exception):
+    """Afleverfout van een niet-SMTP backend; permanent=True betekent: opnieuw proberen heeft geen zin."""
+
+    def __init__(self, message, status=None, permanent=False):
+        super().__init__(message)
+        self.status = status
+        self.permanent = permanent
+
+
+def is_http_outage(error):
+    """Timeouts, verbroken verbindingen en 5xx/408/429 zeggen iets over de beschikbaarheid van de API."""
+    if isinstance(error, MailTransportError):
+        return error.status is not None and (error.status >= 500 or error.status in (408, 429))
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+class MailTransport:
+    name = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.sent_bytes = 0
+
+    def _count(self, size):
+        with self._lock:
+            self.sent += 1
+            self.sent_bytes += size
+
+    def send_stream(self, from_addr, to_addrs, stream, size):
+        """Lever size bytes uit een binaire stream af; implementatie per backend."""
+        raise NotImplementedError
+
+    def send_file(self, from_addr, to_addrs, path):
+        with open(path, 'rb') as f:
+            return self.send_stream(from_addr, list(to_addrs), f, os.path.getsize(path))
+
+    def send_message(self, msg, from_addr=None, to_addrs=None):
+        if from_addr is None or to_addrs is None:
+            envelope_from, envelope_to = message_envelope(msg)
+            from_addr = from_addr or envelope_from
+            to_addrs = to_addrs if to_addrs is not None else envelope_to
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        buffer = io.BytesIO()
+        write_message(buffer, msg)
+        size = buffer.tell()
+        buffer.seek(0)
+        return self.send_stream(from_addr, list(to_addrs), buffer, size)
+
+    def stats(self):
+        with self._lock:
+            return {'transport': self.name, 'sent': self.sent, 'sent_bytes': self.sent_bytes}
+
+
+class SMTPTransport(MailTransport):
+    name = 'smtp'
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def send_file(self, from_addr, to_addrs, path):
+        refused = self.pool.send_file(from_addr, to_addrs, path)
+        self._count(os.path.getsize(path))
+        return refused
+
+    def send_stream(self, from_addr, to_addrs, stream, size):
+        refused = self.pool.sendmail(from_addr, to_addrs, stream.read())
+        self._count(size)
+        return refused
+
+    def stats(self):
+        return dict(super().stats(), **self.pool.stats())
+
+
+class FileTransport(MailTransport):
+    """Schrijft berichten naar een map in plaats van ze te verzenden; de envelop staat in X-Envelope-headers."""
+    name = 'file'
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._sequence = 0
+
+    def send_stream(self, from_addr, to_addrs, stream, size):
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        path = os.path.join(self.directory, f"{time.time_ns()}-{os.getpid()}-{sequence}.eml")
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(f"X-Envelope-From: {from_addr}\r\nX-Envelope-To: {', '.join(to_addrs)}\r\n".encode('utf-8'))
+            shutil.copyfileobj(stream, f, 64 * 1024)
+        os.replace(f"{path}.tmp", path)
+        self._count(size)
+        return {}
+
+
+class MemoryTransport(MailTransport):
+    """Bewaart berichten in self.outbox als dicts met 'from', 'to' en 'data'."""
+    name = 'memory'
+
+    def __init__(self):
+        super().__init__()
+        self.outbox = []
+
+    def send_stream(self, from_addr, to_addrs, stream, size):
+        data = stream.read()
+        with self._lock:
+            self.outbox.append({'from': from_addr, 'to': list(to_addrs), 'data': data})
+        self._count(size)
+        return {}
+
+
+class HTTPTransport(MailTransport):
+    """POST van het ruwe bericht naar een HTTP-API; één keep-alive verbinding per thread."""
+    name = 'http'
+
+    def __init__(self, url, api_key=None, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT):
+        super().__init__()
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"Ongeldige MAIL_HTTP_URL: {url!r}")
+        self.url = url
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = parts.path or '/'
+        if parts.query:
+            self._path += f"?{parts.query}"
+        self._local = threading.local()
+        self.breaker = get_breaker(f"http:{parts.netloc}", is_failure=is_http_outage)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+            conn = cls(self._host, self._port, timeout=self.connect_timeout)
+            self._local.conn = conn
+        if conn.sock is None:  # nieuw, of gesloten na 'Connection: close'
+            conn.connect()
+            # Headers en body gaan in aparte writes; zonder NODELAY wacht de tweede op de delayed ACK (~40 ms)
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def _post(self, from_addr, to_addrs, stream, size):
+        headers = {
+            'Content-Type': 'message/rfc822',
+            'Content-Length': str(size),
+            'X-Mail-From': from_addr,
+            'X-Rcpt-To': ', '.join(to_addrs),
+        }
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        conn = self._connection()
+        try:
+            conn.request('POST', self._path, body=stream, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except Exception:
+            conn.close()
+            self._local.conn = None
+            raise
+        return response.status, body
+
+    def send_stream(self, from_addr, to_addrs, stream, size):
+        return self.breaker.call(self._send_stream, from_addr, to_addrs, stream, size)
+
+    def _send_stream(self, from_addr, to_addrs, stream, size):
+        start = stream.tell()
+        try:
+            status, body = self._post(from_addr, to_addrs, stream, size)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # Keep-alive verbinding door de server gesloten: één keer opnieuw met een verse verbinding
+            stream.seek(start)
+            status, body = self._post(from_addr, to_addrs, stream, size)
+        if status >= 300:
+            message = body[:200].decode('utf-8', 'replace')
+            # 4xx (behalve timeout/rate limit) herhaalt zich bij een nieuwe poging
+            permanent = 400 <= status < 500 and status not in (408, 429)
+            raise MailTransportError(f"HTTP {status}: {message}", status=status, permanent=permanent)
+        self._count(size)
+        return {}
+
+
+_memory_transport = MemoryTransport()
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def create_transport(config):
+    """Transport voor een accountconfiguratie (zie email_config.resolve_config)."""
+    kind = config.get('transport', 'smtp')
+    if kind == 'smtp':
+        return SMTPTransport(get_smtp_pool(config['server'], config['port'], config['user'],
+                                           config['password'], config['starttls']))
+    if kind == 'file':
+        return FileTransport(config['capture_dir'])
+    if kind == 'memory':
+        return _memory_transport
+    if kind == 'http':
+        return HTTPTransport(config['http_url'], config.get('http_api_key'))
+    raise ValueError(f"Onbekende MAIL_TRANSPORT: {kind!r}")
+
+
+def get_transport(account='default'):
+    """Gedeeld transport per account; na het herladen van de configuratie komt er vanzelf een nieuw."""
+    config = get_smtp_config(account)
+    key = (account, tuple(sorted((k, str(v)) for k, v in config.items())))
+    transport = _transports.get(key)
+    if transport is None:
+        with _transports_lock:
+            transport = _transports.get(key)
+            if transport is None:
+                transport = create_transport(config)
+                _transports[key] = transport
+    return transport
+
+
+def get_memory_transport():
+    """Het in-memory transport van dit proces (voor tests met MAIL_TRANSPORT=memory)."""
+    return _memory_transport
@@ -0,0 +1,128 @@
+"""
+MIME-berichten met bijlagen die vanaf schijf gestreamd worden.
+
+email.mime houdt elke bijlage in het geheugen, en as_string() maakt daar nog
+een base64-kopie van (33% groter). StreamedMessage bewaart voor bijlagen
+alleen het pad: write_to() schrijft headers, de (kleine) tekst- en
+HTML-parts en daarna elke bijlage in blokken van BASE64_CHUNK_BYTES als
+base64 naar een bestand (de spool van de mailqueue). Het geheugengebruik per
+bericht hangt zo niet af van de grootte van de bijlagen. De uitvoer gebruikt
+CRLF, zodat de spool zonder omzetting naar het SMTP-datakanaal kan.
+"""
+import base64
+import copy
+import os
+import secrets
+from email import policy as email_policy
+from email.generator import BytesGenerator
+from email.message import Message
+from email.mime.base import MIMEBase
+from email.utils import getaddresses
+
+# Veelvoud van 57 bytes: elk blok wordt een geheel aantal base64-regels van 76 tekens
+BASE64_CHUNK_BYTES = 57 * 1024
+
+SMTP_POLICY = email_policy.compat32.clone(linesep='\r\n')
+
+
+def write_base64(fileobj, source, chunk_bytes=BASE64_CHUNK_BYTES):
+    """Schrijf source (binair bestand) als base64 met CRLF-regels naar fileobj, blok voor blok."""
+    first = True
+    while True:
+        chunk = source.read(chunk_bytes)
+        if not chunk:
+            break
+        if not first:
+            fileobj.write(b'\r\n')
+        fileobj.write(base64.encodebytes(chunk).rstrip(b'\n').replace(b'\n', b'\r\n'))
+        first = False
+
+
+class StreamedMessage:
+    """
+    Multipart-bericht waarvan de bijlagen pas bij write_to() van schijf gelezen worden.
+    Headers werken als bij email.message (msg['Subject'] = ...); kleine parts gaan via attach().
+    """
+
+    def __init__(self, subtype='related'):
+        self.subtype = subtype
+        self._headers = Message()
+        self._parts = []  # email.message-part, of (headers-part, pad) voor een bijlage
+
+    def __setitem__(self, name, value):
+        self._headers[name] = value
+
+    def __getitem__(self, name):
+        return self._headers[name]
+
+    def __delitem__(self, name):
+        del self._headers[name]
+
+    def get_all(self, name, failobj=None):
+        return self._headers.get_all(name, failobj)
+
+    def attach(self, part):
+        """Voeg een klein part in het geheugen toe (tekst, HTML, multipart/alternative)."""
+        self._parts.append(part)
+
+    def attach_file(self, path, content_type='application/octet-stream', filename=None,
+                    disposition='attachment', content_id=None):
+        """Voeg een bijlage toe; het bestand wordt pas bij het schrijven gelezen."""
+        filename = filename or os.path.basename(path)
+        maintype, subtype = content_type.split('/', 1)
+        part = MIMEBase(maintype, subtype, name=filename)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', disposition, filename=filename)
+        if content_id:
+            part['Content-ID'] = f"<{content_id}>"
+        self._parts.append((part, path))
+
+    def attachment_paths(self):
+        return [part[1] for part in self._parts if isinstance(part, tuple)]
+
+    def _write_headers(self, fileobj, message):
+        for name, value in message.raw_items():
+            fileobj.write(SMTP_POLICY.fold_binary(name, value))
+        fileobj.write(b'\r\n')
+
+    def write_to(self, fileobj):
+        """Schrijf het volledige bericht (CRLF) naar een binair bestand."""
+        boundary = f"==============={secrets.token_hex(16)}=="
+        headers = Message()
+        for name, value in self._headers.raw_items():
+            if name.lower() not in ('mime-version', 'content-type', 'content-transfer-encoding', 'bcc'):
+                headers[name] = value
+        headers['MIME-Version'] = '1.0'
+        headers['Content-Type'] = f'multipart/{self.subtype}; boundary="{boundary}"'
+        self._write_headers(fileobj, headers)
+
+        for i, part in enumerate(self._parts):
+            fileobj.write(f"--{boundary}\r\n".encode('ascii') if i == 0 else f"\r\n--{boundary}\r\n".encode('ascii'))
+            if isinstance(part, tuple):
+                part, path = part
+                self._write_headers(fileobj, part)
+                with open(path, 'rb') as source:
+                    write_base64(fileobj, source)
+            else:
+                BytesGenerator(fileobj, mangle_from_=False, policy=SMTP_POLICY).flatten(part)
+        fileobj.write(f"\r\n--{boundary}--\r\n".encode('ascii'))
+
+
+def message_envelope(msg):
+    """Afzender en ontvangers (To, Cc, Bcc) uit de headers, zoals smtplib.send_message die bepaalt."""
+    from_addr = getaddresses(msg.get_all('Sender') or msg.get_all('From', []))[0][1]
+    recipients = [addr for _, addr in getaddresses(msg.get_all('To', []) + msg.get_all('Cc', [])
+                                                     + msg.get_all('Bcc', [])) if addr]
+    return from_addr, recipients
+
+
+def write_message(fileobj, msg):
+    """Schrijf een bericht (bytes, StreamedMessage of email.message) met CRLF en zonder Bcc-header."""
+    if isinstance(msg, bytes):
+        fileobj.write(msg)
+    elif hasattr(msg, 'write_to'):
+        msg.write_to(fileobj)
+    else:
+        msg = copy.copy(msg)  # del vervangt de headerlijst, het origineel blijft ongewijzigd
+        del msg['Bcc']
+        BytesGenerator(fileobj, mangle_from_=False, policy=msg.policy.clone(linesep='\r\n')).flatten(msg)
@@ -0,0 +1,234 @@
+"""
+Lokaal grootboek van Stripe-betalingen (tabel payments).
+
+Elke POST naar /create-payment-intent maakte een nieuwe PaymentIntent, en
+eventueel eerst een Customer: twee netwerkaanroepen per bezoek aan de
+betaalpagina en een stapel verlaten intents. PaymentLedger hergebruikt de
+openstaande intent van een gebruiker zolang bedrag en valuta gelijk zijn; de
+client_secret staat in payments, dus daarvoor is geen aanroep naar Stripe
+nodig. Een intent waarvan de betaling mislukte is ook weer bruikbaar, zoals
+Stripe aanbeveelt.
+
+De status van intents en de customer-id van gebruikers komen uit de
+webhooks (de handlers hieronder draaien in de transactie van de
+stripe_events-inbox), zodat /payment-success in de regel uit de database kan
+antwoorden. Alleen als de webhook er nog niet is, wordt de intent bij Stripe
+opgehaald. Een Customer wordt pas na een geslaagde betaling aangemaakt, op de
+achtergrond (create_missing_customer als listener van de inbox).
+"""
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from modules.mail_queue import MAIL_QUEUE_DB
+from modules.stripe_config import (PRICE_AMOUNT, PRICE_CURRENCY, create_customer, create_payment_intent,
+                                   get_payment_intent)
+
+SUBSCRIPTION_DAYS = 365
+
+# Statussen waarmee de gebruiker (opnieuw) kan betalen; 'failed' is onze eigen status na payment_failed
+OPEN_STATUSES = ('requires_payment_method', 'requires_confirmation', 'requires_action', 'failed')
+FINAL_STATUSES = ('succeeded', 'canceled')
+
+
+# --- Binnen een transactie (ook gebruikt door de stripe_events-handlers) ---
+
+def activate_subscription(conn, user_id):
+    """Geef een gebruiker SUBSCRIPTION_DAYS toegang vanaf nu."""
+    conn.execute('UPDATE users SET is_paid_user = 1, subscription_status = ?, subscription_expires = ? WHERE id = ?',
+                 ('active', (datetime.now() + timedelta(days=SUBSCRIPTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S'),
+                  user_id))
+
+
+def apply_intent(conn, intent, status=None):
+    """
+    Leg de stand van een PaymentIntent vast (status: eigen status, standaard die van Stripe).
+    Een afgeronde betaling (succeeded, canceled) verandert niet meer. Return de user_id van de betaling.
+    """
+    status = status or intent['status']
+    metadata = intent.get('metadata') or {}
+    row = conn.execute('SELECT user_id FROM payments WHERE stripe_payment_intent_id = ?', (intent['id'],)).fetchone()
+    if row is None:
+        if not metadata.get('user_id'):
+            return None  # intent die niet via deze tool is aangemaakt
+        conn.execute('''INSERT INTO payments (user_id, stripe_payment_intent_id, stripe_customer_id, amount, currency,
+                                              status, metadata, client_secret)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (metadata['user_id'], intent['id'], intent.get('customer'), intent['amount'], intent['currency'],
+                      status, json.dumps(dict(metadata)), intent.get('client_secret')))
+        return int(metadata['user_id'])
+    placeholders = ', '.join('?' * len(FINAL_STATUSES))
+    conn.execute(f'''UPDATE payments SET status = ?, stripe_customer_id = COALESCE(?, stripe_customer_id),
+                    updated_at = CURRENT_TIMESTAMP
+                    WHERE stripe_payment_intent_id = ? AND status NOT IN ({placeholders})''',
+                 (status, intent.get('customer'), intent['id'], *FINAL_STATUSES))
+    return row[0]
+
+
+def handle_intent_updated(conn, intent, event):
+    apply_intent(conn, intent)
+
+
+def handle_payment_succeeded(conn, intent, event):
+    user_id = apply_intent(conn, intent, 'succeeded')
+    if user_id:
+        activate_subscription(conn, user_id)
+    logging.info(f"PaymentIntent {intent['id']} succeeded, user {user_id} geactiveerd.")
+
+
+def handle_payment_failed(conn, intent, event):
+    # Een mislukte poging die na het geslaagde event binnenkomt, maakt de betaling niet ongedaan
+    apply_intent(conn, intent, 'failed')
+    logging.info(f"PaymentIntent {intent['id']} failed.")
+
+
+def handle_customer(conn, customer, event):
+    """Customer-id bij de gebruiker (via metadata.user_id, anders via het e-mailadres) in de cache."""
+    user_id = (customer.get('metadata') or {}).get('user_id')
+    if user_id:
+        conn.execute('UPDATE users SET stripe_customer_id = ? WHERE id = ?', (customer['id'], user_id))
+    elif customer.get('email'):
+        conn.execute('UPDATE users SET stripe_customer_id = ? WHERE email = ? AND stripe_customer_id IS NULL',
+                     (customer['id'], customer['email']))
+
+
+LEDGER_HANDLERS = {
+    'payment_intent.created': [handle_intent_updated],
+    'payment_intent.processing': [handle_intent_updated],
+    'payment_intent.requires_action': [handle_intent_updated],
+    'payment_intent.canceled': [handle_intent_updated],
+    'payment_intent.succeeded': [handle_payment_succeeded],
+    'payment_intent.payment_failed': [handle_payment_failed],
+    'customer.created': [handle_customer],
+    'customer.updated': [handle_customer],
+}
+
+
+class PaymentLedger:
+    def __init__(self, db_path=MAIL_QUEUE_DB):
+        self.db_path = db_path
+        self.stripe_calls = 0  # aanroepen naar Stripe vanuit het grootboek (voor stats en tests)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def open_intent(self, user_id, email, amount=PRICE_AMOUNT, currency=PRICE_CURRENCY):
+        """
+        Return (client_secret, None) voor een te betalen intent van user_id: de openstaande als bedrag en
+        valuta nog kloppen, anders een nieuwe bij Stripe. Bij een fout (None, foutmelding).
+        """
+        placeholders = ', '.join('?' * len(OPEN_STATUSES))
+        conn = self._connect()
+        try:
+            payment = conn.execute(f'''SELECT stripe_payment_intent_id, client_secret FROM payments
+                                      WHERE user_id = ? AND amount = ? AND currency = ? AND client_secret IS NOT NULL
+                                        AND status IN ({placeholders})
+                                      ORDER BY created_at DESC, id DESC LIMIT 1''',
+                                   (user_id, amount, currency, *OPEN_STATUSES)).fetchone()
+            customer_id = conn.execute('SELECT stripe_customer_id FROM users WHERE id = ?',
+                                       (user_id,)).fetchone()[0]
+        finally:
+            conn.close()
+        if payment:
+            logging.info(f"PaymentIntent {payment['stripe_payment_intent_id']} hergebruikt voor user {user_id}")
+            return payment['client_secret'], None
+
+        metadata = {'user_id': user_id, 'email': email}
+        self.stripe_calls += 1
+        intent, err = create_payment_intent(amount, currency, metadata=metadata, customer=customer_id,
+                                            receipt_email=email)
+        if not intent:
+            return None, err
+        conn = self._connect()
+        try:
+            conn.execute('''INSERT OR IGNORE INTO payments (user_id, stripe_payment_intent_id, stripe_customer_id,
+                                                           amount, currency, status, metadata, client_secret)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (user_id, intent['id'], customer_id, intent['amount'], intent['currency'], intent['status'],
+                          json.dumps(metadata), intent['client_secret']))
+        finally:
+            conn.close()
+        return intent['client_secret'], None
+
+    def confirm(self, user_id, payment_intent_id):
+        """
+        Is de betaling van user_id geslaagd? Uit het grootboek; staat de webhook er nog niet in, dan één keer
+        bij Stripe nagevraagd en vastgelegd (inclusief de toegang). Return (True, None) of (False, foutmelding).
+        """
+        conn = self._connect()
+        try:
+            payment = conn.execute('SELECT status FROM payments WHERE stripe_payment_intent_id = ? AND user_id = ?',
+                                   (payment_intent_id, user_id)).fetchone()
+        finally:
+            conn.close()
+        if payment is None:
+            return False, 'Betaling niet gevonden.'
+        if payment['status'] == 'succeeded':
+            return True, None
+
+        self.stripe_calls += 1
+        intent = get_payment_intent(payment_intent_id)
+        if not intent or intent['status'] != 'succeeded':
+            return False, 'Betaling niet succesvol of niet gevonden.'
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Alleen activeren als de webhook het intussen niet al gedaan heeft
+            status = conn.execute('SELECT status FROM payments WHERE stripe_payment_intent_id = ?',
+                                  (payment_intent_id,)).fetchone()['status']
+            if status != 'succeeded':
+                apply_intent(conn, intent, 'succeeded')
+                activate_subscription(conn, user_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return True, None
+
+    def create_missing_customer(self, event):
+        """Listener van de stripe_events-inbox: na een geslaagde betaling een Customer aanmaken als die er nog niet is."""
+        if event['type'] != 'payment_intent.succeeded':
+            return
+        user_id = (event['data']['object'].get('metadata') or {}).get('user_id')
+        if not user_id:
+            return
+        conn = self._connect()
+        try:
+            user = conn.execute('SELECT email, name, stripe_customer_id FROM users WHERE id = ?', (user_id,)).fetchone()
+        finally:
+            conn.close()
+        if user is None or user['stripe_customer_id']:
+            return
+        self.stripe_calls += 1
+        customer, err = create_customer(email=user['email'], name=user['name'], metadata={'user_id': user_id})
+        if not customer:
+            logging.warning(f"Stripe customer voor user {user_id} niet aangemaakt: {err}")
+            return
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE users SET stripe_customer_id = ? WHERE id = ? AND stripe_customer_id IS NULL',
+                         (customer['id'], user_id))
+            conn.execute('UPDATE payments SET stripe_customer_id = ? WHERE user_id = ? AND stripe_customer_id IS NULL',
+                         (customer['id'], user_id))
+        finally:
+            conn.close()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_payment_ledger():
+    """Gedeeld grootboek per proces."""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = PaymentLedger()
+    return _ledger
@@ -0,0 +1,223 @@
+"""
+Samengevoegd PDF-dossier voor een aanvraag.
+
+In plaats van losse JPEG-, PNG- en PDF-bijlagen krijgt de afdeling
+Korpscheftaken één PDF: een voorblad met de formuliergegevens en de lijst
+met documenten (reportlab), gevolgd door een pagina per verwerkte afbeelding
+en de pagina's van de geüploade PDF's. Elk document krijgt een bladwijzer.
+
+Afbeeldingen worden niet opnieuw gecodeerd (JPEG gaat ongewijzigd de PDF in)
+en de content streams worden gecomprimeerd. Is pikepdf geïnstalleerd, dan wordt
+het resultaat ook gelineariseerd en in object streams opgeslagen.
+
+Het dossier is ongeveer zo groot als de bijlagen samen plus het voorblad: de
+bijlagen zijn al gecomprimeerd en worden hier bewust niet verliesgevend
+opnieuw gecodeerd. Past het bericht niet, dan verkleint attachment_budget ook
+het dossier.
+"""
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from reportlab import rl_config
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+
+try:
+    import pikepdf
+except ImportError:  # Optioneel: alleen nodig voor linearisatie
+    pikepdf = None
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+PDF_EXTENSIONS = {'.pdf'}
+
+MARGIN = 50
+LINE_HEIGHT = 16
+
+_rl_config_lock = threading.Lock()
+
+
+@contextmanager
+def _binary_streams():
+    """
+    Zet ASCII85 (elke afbeelding 25% groter) alleen voor het dossier uit. reportlab leest
+    rl_config.useA85 tijdens het tekenen en opslaan en kent geen instelling per canvas.
+    """
+    with _rl_config_lock:
+        previous = rl_config.useA85
+        rl_config.useA85 = 0
+        try:
+            yield
+        finally:
+            rl_config.useA85 = previous
+
+class _CoverWriter:
+    """Tekstregels onder elkaar op het voorblad, met automatische paginawissel."""
+
+    def __init__(self, c):
+        self.c = c
+        self.width, self.height = A4
+        self.y = self.height - MARGIN
+
+    def _need(self, space):
+        if self.y - space < MARGIN:
+            self.c.showPage()
+            self.y = self.height - MARGIN
+
+    def title(self, text):
+        self._need(30)
+        self.c.setFont('Helvetica-Bold', 16)
+        self.c.drawString(MARGIN, self.y, text)
+        self.y -= 30
+
+    def heading(self, text):
+        self._need(LINE_HEIGHT * 3)
+        self.y -= 8
+        self.c.setFont('Helvetica-Bold', 13)
+        self.c.drawString(MARGIN, self.y, text)
+        self.y -= LINE_HEIGHT + 4
+
+    def field(self, label, value):
+        lines = simpleSplit(str(value), 'Helvetica', 11, self.width - 2 * MARGIN - 160) or ['']
+        self._need(LINE_HEIGHT * len(lines))
+        self.c.setFont('Helvetica-Bold', 11)
+        self.c.drawString(MARGIN, self.y, f"{label}:")
+        self.c.setFont('Helvetica', 11)
+        for line in lines:
+            self.c.drawString(MARGIN + 160, self.y, line)
+            self.y -= LINE_HEIGHT
+
+
+def _draw_image_page(c, path, caption):
+    """Eén pagina met de afbeelding zo groot mogelijk binnen de marges."""
+    width, height = A4
+    source = path
+    with Image.open(path) as im:
+        img_w, img_h = im.size
+        if im.mode == '1':
+            # 1-bit handtekening als grijswaarden i.p.v. de RGB-conversie van reportlab
+            source = ImageReader(im.convert('L'))
+    box_w, box_h = width - 2 * MARGIN, height - 2 * MARGIN - 30
+    scale = min(box_w / img_w, box_h / img_h)
+    draw_w, draw_h = img_w * scale, img_h * scale
+    c.setFont('Helvetica-Bold', 12)
+    c.drawString(MARGIN, height - MARGIN, caption)
+    # Bij een pad geeft reportlab JPEG-data ongewijzigd door (geen hercompressie)
+    c.drawImage(source, MARGIN + (box_w - draw_w) / 2, height - MARGIN - 30 - draw_h,
+                width=draw_w, height=draw_h, mask='auto')
+    c.showPage()
+
+
+def _open_pdf(path):
+    reader = PdfReader(path)
+    if reader.is_encrypted and not reader.decrypt(''):
+        raise ValueError('PDF is beveiligd met een wachtwoord')
+    return reader
+
+
+def _linearize(path):
+    """Herschrijf de PDF gelineariseerd (fast web view) met object streams, als pikepdf beschikbaar is."""
+    if pikepdf is None:
+        return False
+    tmp_path = f"{path}.lin"
+    with pikepdf.open(path) as pdf:
+        pdf.save(tmp_path, linearize=True, compress_streams=True,
+                 object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    os.replace(tmp_path, path)
+    return True
+
+
+def build_dossier(sections, attachments, output_path, title='Aanvraag Beveiligingspas'):
+    """
+    Bouw het dossier uit de formuliersecties [(titel, [(label, waarde)])] (zie form_schema) en de
+    bijlagen (paden). Afbeeldingen en PDF's worden opgenomen,
+    overige bestanden (en PDF's die niet te openen zijn) komen in 'skipped' en moeten los mee.
+    Return dict met 'success', 'path', 'pages', 'size', 'original_size', 'included', 'skipped' en 'error'.
+    """
+    included, skipped, readers = [], [], {}
+    for path in attachments:
+        ext = os.path.splitext(path)[1].lower()
+        if ext in IMAGE_EXTENSIONS:
+            included.append(path)
+        elif ext in PDF_EXTENSIONS:
+            try:
+                readers[path] = _open_pdf(path)
+                included.append(path)
+            except Exception as e:
+                logging.warning(f"Dossier: {os.path.basename(path)} wordt los bijgevoegd: {e}")
+                skipped.append(path)
+        else:
+            skipped.append(path)
+    original_size = sum(os.path.getsize(p) for p in included)
+
+    result = {'success': False, 'path': output_path, 'pages': 0, 'size': 0,
+              'original_size': original_size, 'included': included, 'skipped': skipped, 'error': None}
+    cover_fd, cover_path = tempfile.mkstemp(suffix='.pdf', prefix='dossier_')
+    os.close(cover_fd)
+    try:
+        # Voorblad en afbeeldingspagina's in één reportlab-document
+        with _binary_streams():
+            c = canvas.Canvas(cover_path, pagesize=A4, pageCompression=1)
+            c.setTitle(title)
+            cover = _CoverWriter(c)
+            cover.title(title)
+            for heading, values in sections:
+                cover.heading(heading)
+                for label, value in values:
+                    cover.field(label, value)
+            cover.heading('Documenten in dit dossier')
+            for path in included:
+                cover.field('Bijlage', os.path.basename(path))
+            for path in skipped:
+                cover.field('Los bijgevoegd', os.path.basename(path))
+            c.showPage()
+            cover_pages = c.getPageNumber() - 1
+            image_pages = {}
+            for path in included:
+                if path not in readers:
+                    image_pages[path] = cover_pages + len(image_pages)
+                    _draw_image_page(c, path, os.path.basename(path))
+            c.save()
+
+        # Voorblad + afbeeldingen, daarna de PDF-bijlagen; bladwijzer per document
+        writer = PdfWriter()
+        writer.append(cover_path)
+        writer.add_outline_item('Aanvraaggegevens', 0)
+        for path in included:
+            if path in image_pages:
+                writer.add_outline_item(os.path.basename(path), image_pages[path])
+        for path in included:
+            if path in readers:
+                start = len(writer.pages)
+                writer.append(readers[path])
+                writer.add_outline_item(os.path.basename(path), start)
+        for page in writer.pages:
+            page.compress_content_streams()
+        writer.add_metadata({'/Title': title, '/Producer': 'ATK-WPBR Tool'})
+        with open(output_path, 'wb') as f:
+            writer.write(f)
+        result['pages'] = len(writer.pages)
+        writer.close()
+
+        try:
+            _linearize(output_path)
+        except Exception as e:
+            logging.warning(f"Dossier niet gelineariseerd: {e}")
+        result['size'] = os.path.getsize(output_path)
+        result['success'] = True
+        logging.info(f"Dossier {os.path.basename(output_path)}: {result['pages']} pagina's, "
+                     f"{result['size']} bytes (bijlagen los: {original_size} bytes)")
+    except Exception as e:
+        result['error'] = f"Dossier kon niet worden samengesteld: {e}"
+        logging.error(result['error'])
+    finally:
+        try:
+            os.remove(cover_path)
+        except OSError:
+            pass
+    return result
@@ -0,0 +1,87 @@
+"""
+Speculatief renderen op de achtergrond.
+
+Direct na een geslaagde form-POST weten we al wat /download_word en /verzenden
+nodig hebben: het ingevulde Word document. Die taak wordt per inzending (job)
+in een kleine threadpool gestart; de routes halen het resultaat op met een
+timeout en vallen bij een timeout, fout of onbekende job (andere worker) terug
+op het synchrone pad. Goedkoop werk zoals het lezen van afbeeldingsheaders
+hoort hier niet: dat zou in de rij achter Word-renders van andere gebruikers
+wachten.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+PRERENDER_WORKERS = int(os.getenv('PRERENDER_WORKERS', 2))
+PRERENDER_TIMEOUT = float(os.getenv('PRERENDER_TIMEOUT', 5))  # seconden wachten in een request
+PRERENDER_TTL = int(os.getenv('PRERENDER_TTL', 30 * 60))  # afgeronde jobs na 30 min opruimen
+
+
+class Prerenderer:
+    def __init__(self, workers=PRERENDER_WORKERS, ttl=PRERENDER_TTL):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prerender')
+        self._lock = threading.Lock()
+        self._jobs = {}  # job_id -> (starttijd, {taaknaam: Future})
+        self.ttl = ttl
+
+    def submit(self, job_id, tasks):
+        """Start de taken van een job. tasks: {naam: (functie, *args)}; een bestaande job met dit id vervalt."""
+        self._prune()
+        futures = {}
+        for name, (func, *args) in tasks.items():
+            futures[name] = self._executor.submit(func, *args)
+        with self._lock:
+            previous = self._jobs.pop(job_id, None)
+            self._jobs[job_id] = (time.monotonic(), futures)
+        if previous:
+            for future in previous[1].values():
+                future.cancel()
+        return futures
+
+    def result(self, job_id, name, timeout=PRERENDER_TIMEOUT):
+        """Resultaat van een taak, of None als het (nog) niet beschikbaar is."""
+        with self._lock:
+            job = self._jobs.get(job_id) if job_id else None
+        future = job[1].get(name) if job else None
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeout:
+            logging.warning(f"Prerender {name} voor job {job_id} niet klaar binnen {timeout}s")
+        except Exception as e:
+            logging.error(f"Prerender {name} voor job {job_id} mislukt: {e}")
+        return None
+
+    def discard(self, job_id):
+        """Vergeet een job (na verzenden of wijzigen); taken die nog niet liepen worden geannuleerd."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job:
+            for future in job[1].values():
+                future.cancel()
+
+    def _prune(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [job_id for job_id, (started, futures) in self._jobs.items()
+                       if now - started > self.ttl and all(f.done() for f in futures.values())]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+_prerenderer = None
+_prerenderer_lock = threading.Lock()
+
+
+def get_prerenderer():
+    """Gedeelde prerenderer per proces (lazy aangemaakt)."""
+    global _prerenderer
+    if _prerenderer is None:
+        with _prerenderer_lock:
+            if _prerenderer is None:
+                _prerenderer = Prerenderer()
+    return _prerenderer
@@ -0,0 +1,143 @@
+"""
+Circuit breakers voor externe diensten (SMTP, Stripe, HTTP-mail-API).
+
+Een dienst die niet antwoordt houdt elke aanroep vast tot de timeout; bij veel
+verzoeken tegelijk raken zo alle gunicorn workers bezet. Een breaker telt
+opeenvolgende storingen (timeouts, verbroken verbindingen, 5xx) van één
+dienst. Na failure_threshold storingen gaat hij open: aanroepen falen dan
+direct met CircuitOpenError, zonder netwerkverkeer. Na reset_seconds mag er
+één proefaanroep door (half open); slaagt die, dan gaat de breaker weer dicht.
+Fouten die niets over de beschikbaarheid zeggen (geweigerde kaart, onbekende
+ontvanger) tellen niet mee.
+
+De timeouts zelf horen bij de client van de dienst (smtp_pool, mail_transport,
+stripe_config); breaker_stats() geeft de toestand voor /health en /health/details.
+"""
+import logging
+import os
+import threading
+import time
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.getenv('BREAKER_RESET_SECONDS', 30))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """De dienst is recent herhaaldelijk uitgevallen; de aanroep is niet geprobeerd."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} tijdelijk niet beschikbaar (nieuwe poging over {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS,
+                 is_failure=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.is_failure = is_failure or (lambda error: True)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self.last_error = None
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    def before_call(self):
+        """Raise CircuitOpenError als de aanroep niet door mag."""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            remaining = self._opened_at + self.reset_seconds - time.monotonic()
+            if self.state == OPEN and remaining <= 0:
+                self.state = HALF_OPEN
+                self._trial_running = False
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True  # precies één proefaanroep
+                return
+            self.rejected += 1
+        raise CircuitOpenError(self.name, max(remaining, 0))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info(f"Circuit {self.name}: weer beschikbaar")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._trial_running = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = type(error).__name__
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                    logging.warning(f"Circuit {self.name}: open na {self.consecutive_failures} storing(en) "
+                                    f"({self.last_error}), {self.reset_seconds:.0f}s geen aanroepen")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial_running = False
+
+    def call(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure(e):
+                self.record_failure(e)
+            else:
+                self.record_success()  # de dienst antwoordde, alleen niet met wat we wilden
+            raise
+        self.record_success()
+        return result
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._trial_running = False
+
+    def stats(self):
+        with self._lock:
+            retry_after = self._opened_at + self.reset_seconds - time.monotonic() if self.state == OPEN else 0
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'opened': self.opened,
+                'last_error': self.last_error,
+                'retry_after': max(retry_after, 0),
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, **kwargs):
+    """Gedeelde breaker per dienst in dit proces; kwargs gelden alleen bij het aanmaken."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, **kwargs)
+                _breakers[name] = breaker
+    return breaker
+
+
+def breaker_stats():
+    """{naam: stats} van alle breakers in dit proces."""
+    return {name: breaker.stats() for name, breaker in list(_breakers.items())}
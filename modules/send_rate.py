@@ -0,0 +1,114 @@
+"""
+Verzendlimieten per mailaccount, gedeeld door alle processen.
+
+De mailprovider (standaard smtp.strato.com, voor verificatie en feedback
+Gmail) staat per minuut en per dag maar een beperkt aantal berichten toe;
+daarboven wordt er vertraagd of tijdelijk geweigerd. Elke gunicorn worker
+draait een eigen mailqueue-worker, dus de limiet moet over de processen heen
+gelden: de toestand van de token bucket staat in de tabel send_rate van
+dezelfde SQLite database als mail_queue.
+
+Per account vult de bucket zich met rate_per_minute / 60 tokens per seconde
+tot rate_burst; één bericht kost één token. Daarnaast telt rate_per_day het
+aantal berichten per kalenderdag. take() wordt aangeroepen binnen de
+BEGIN IMMEDIATE-transactie waarin de mailqueue een bericht claimt, zodat
+claimen en het token nemen samen slagen of samen niet gebeuren.
+"""
+import time
+from datetime import date
+
+from modules.email_config import get_smtp_config
+
+
+def config_limits(account):
+    """Limieten van een account uit de e-mailconfiguratie (0 = geen limiet)."""
+    try:
+        config = get_smtp_config(account)
+    except KeyError:
+        return {'per_minute': 0, 'per_day': 0, 'burst': 1}  # account zonder configuratie (tests)
+    return {'per_minute': config['rate_per_minute'], 'per_day': config['rate_per_day'],
+            'burst': max(config['rate_burst'], 1)}
+
+
+class SendRateLimiter:
+    def __init__(self, limits=None):
+        # limits(account) -> {'per_minute', 'per_day', 'burst'}; standaard uit de e-mailconfiguratie
+        self.limits = limits or config_limits
+
+    def ensure_table(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS send_rate (
+            account TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            day TEXT NOT NULL,
+            day_count INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            throttled INTEGER NOT NULL DEFAULT 0
+        )''')
+
+    def _state(self, conn, account, limits, now):
+        """Bucket van account bijgevuld tot now (nog niet opgeslagen)."""
+        today = date.fromtimestamp(now).isoformat()
+        row = conn.execute('SELECT * FROM send_rate WHERE account = ?', (account,)).fetchone()
+        if row is None:
+            return {'tokens': float(limits['burst']), 'day': today, 'day_count': 0, 'new': True}
+        refill = (now - row['updated_at']) * limits['per_minute'] / 60
+        return {
+            'tokens': min(row['tokens'] + max(refill, 0), limits['burst']),
+            'day': today,
+            'day_count': row['day_count'] if row['day'] == today else 0,
+            'new': False,
+        }
+
+    def _wait(self, state, limits, now):
+        """Seconden tot er weer verzonden mag worden (0: nu)."""
+        if limits['per_day'] and state['day_count'] >= limits['per_day']:
+            tomorrow = date.fromordinal(date.fromtimestamp(now).toordinal() + 1)
+            return time.mktime(tomorrow.timetuple()) - now
+        if limits['per_minute'] and state['tokens'] < 1:
+            return (1 - state['tokens']) * 60 / limits['per_minute']
+        return 0.0
+
+    def take(self, conn, account, now=None):
+        """
+        Neem één token voor account binnen de lopende transactie van conn.
+        Return 0.0 als het bericht nu weg mag, anders het aantal seconden tot er weer een token is.
+        """
+        now = now or time.time()
+        limits = self.limits(account)
+        if not limits['per_minute'] and not limits['per_day']:
+            return 0.0
+        state = self._state(conn, account, limits, now)
+        wait = self._wait(state, limits, now)
+        if state['new']:
+            conn.execute('''INSERT INTO send_rate (account, tokens, updated_at, day, day_count)
+                           VALUES (?, ?, ?, ?, ?)''',
+                         (account, state['tokens'], now, state['day'], state['day_count']))
+        if wait:
+            conn.execute('''UPDATE send_rate SET tokens = ?, updated_at = ?, day = ?, day_count = ?,
+                           throttled = throttled + 1 WHERE account = ?''',
+                         (state['tokens'], now, state['day'], state['day_count'], account))
+            return wait
+        tokens = state['tokens'] - 1 if limits['per_minute'] else state['tokens']
+        conn.execute('''UPDATE send_rate SET tokens = ?, updated_at = ?, day = ?, day_count = ?,
+                       sent = sent + 1 WHERE account = ?''',
+                     (tokens, now, state['day'], state['day_count'] + 1, account))
+        return 0.0
+
+    def stats(self, conn, now=None):
+        """{account: {tokens, sent_today, per_minute, per_day, sent, throttled, wait_seconds}}"""
+        now = now or time.time()
+        result = {}
+        for row in conn.execute('SELECT * FROM send_rate ORDER BY account').fetchall():
+            limits = self.limits(row['account'])
+            state = self._state(conn, row['account'], limits, now)
+            result[row['account']] = {
+                'tokens': round(state['tokens'], 2),
+                'sent_today': state['day_count'],
+                'per_minute': limits['per_minute'],
+                'per_day': limits['per_day'],
+                'sent': row['sent'],
+                'throttled': row['throttled'],
+                'wait_seconds': round(self._wait(state, limits, now), 1),
+            }
+        return result
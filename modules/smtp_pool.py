@@ -0,0 +1,283 @@
+"""
+Pool van geauthenticeerde SMTP-verbindingen per proces.
+
+Elke verzending opende een nieuwe TCP-verbinding met STARTTLS en AUTH; bij
+/verzenden gebeurde dat twee keer direct na elkaar. De pool houdt per
+(server, poort, gebruiker) een paar ingelogde sessies vast. Een verbinding die
+een tijdje ongebruikt was wordt eerst met NOOP gecontroleerd; een dode
+verbinding wordt weggegooid en er wordt automatisch opnieuw verbonden.
+stats() telt handshakes en hergebruik en schat de bespaarde handshake-tijd.
+
+Verbinden en lezen hebben elk een eigen timeout; storingen per server lopen
+via een circuit breaker (modules/resilience.py), zodat een hangende
+mailserver na een paar pogingen direct een CircuitOpenError geeft.
+"""
+import atexit
+import logging
+import os
+import smtplib
+import threading
+import time
+
+from modules.resilience import get_breaker
+
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', 2))  # max. vastgehouden verbindingen per server
+SMTP_POOL_MAX_IDLE = float(os.getenv('SMTP_POOL_MAX_IDLE', 120))  # seconden; servers sluiten inactieve sessies zelf
+SMTP_POOL_NOOP_AFTER = float(os.getenv('SMTP_POOL_NOOP_AFTER', 5))  # NOOP-controle na zoveel seconden inactiviteit
+SMTP_CONNECT_TIMEOUT = float(os.getenv('SMTP_CONNECT_TIMEOUT', 10))  # TCP-verbinding en begroeting
+SMTP_READ_TIMEOUT = float(os.getenv('SMTP_READ_TIMEOUT', os.getenv('SMTP_TIMEOUT', 30)))  # per antwoord daarna
+SEND_BUFFER_BYTES = 64 * 1024  # blokgrootte bij het streamen van een bericht uit een bestand
+
+# Fouten waarna een (hergebruikte) verbinding als dood wordt beschouwd
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, OSError)
+
+
+def is_smtp_outage(error):
+    """Zegt de fout iets over de beschikbaarheid van de server? (timeouts, verbroken verbinding, 421)"""
+    if isinstance(error, CONNECTION_ERRORS + (smtplib.SMTPConnectError,)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421
+
+
+class SMTPPool:
+    def __init__(self, host, port, user=None, password=None, starttls=True, size=SMTP_POOL_SIZE,
+                 max_idle=SMTP_POOL_MAX_IDLE, noop_after=SMTP_POOL_NOOP_AFTER, connect_timeout=SMTP_CONNECT_TIMEOUT,
+                 read_timeout=SMTP_READ_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.size = size
+        self.max_idle = max_idle
+        self.noop_after = noop_after
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.breaker = get_breaker(f"smtp:{host}:{port}", is_failure=is_smtp_outage)
+        self._lock = threading.Lock()
+        self._idle = []  # [(verbinding, laatst gebruikt)]
+        self._pid = os.getpid()
+        self.handshakes = 0
+        self.reuses = 0
+        self.reconnects = 0
+        self.handshake_seconds = 0.0
+
+    def _connect(self):
+        start = time.perf_counter()
+        server = smtplib.SMTP(self.host, self.port, timeout=self.connect_timeout)
+        try:
+            server.sock.settimeout(self.read_timeout)  # STARTTLS neemt de timeout over van de socket
+            server.ehlo()
+            if self.starttls:
+                server.starttls()
+                server.ehlo()
+            if self.user and self.password:
+                server.login(self.user, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.handshakes += 1
+            self.handshake_seconds += elapsed
+        logging.info(f"SMTP: nieuwe verbinding met {self.host}:{self.port} ({elapsed * 1000:.0f} ms)")
+        return server
+
+    @staticmethod
+    def _close(server, quit=True):
+        try:
+            if quit:
+                server.quit()
+            else:
+                server.close()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _checkout(self):
+        """Geef een bruikbare verbinding terug: (verbinding, hergebruikt)."""
+        while True:
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Na een fork horen de sockets bij het ouderproces: niet gebruiken, niet afsluiten
+                    self._idle = []
+                    self._pid = os.getpid()
+                if not self._idle:
+                    break
+                server, last_used = self._idle.pop()
+            idle = time.monotonic() - last_used
+            if idle > self.max_idle:
+                self._close(server)
+                continue
+            if idle > self.noop_after:
+                try:
+                    if server.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected('NOOP geweigerd')
+                except Exception as e:
+                    logging.info(f"SMTP: verbinding met {self.host} niet meer bruikbaar ({e})")
+                    self._close(server, quit=False)
+                    continue
+            return server, True
+        return self._connect(), False
+
+    def _checkin(self, server):
+        with self._lock:
+            if len(self._idle) < self.size and self._pid == os.getpid():
+                self._idle.append((server, time.monotonic()))
+                return
+        self._close(server)
+
+    def _send(self, send):
+        return self.breaker.call(self._send_pooled, send)
+
+    def _send_pooled(self, send):
+        server, reused = self._checkout()
+        try:
+            result = send(server)
+        except CONNECTION_ERRORS:
+            self._close(server, quit=False)
+            if not reused:
+                raise
+            # Hergebruikte verbinding bleek toch dood: één keer opnieuw met een verse verbinding
+            with self._lock:
+                self.reconnects += 1
+            server = self._connect()
+            try:
+                result = send(server)
+            except Exception:
+                self._close(server, quit=False)
+                raise
+        except smtplib.SMTPException:
+            # Bericht geweigerd, maar de sessie is nog in orde: reset en teruggeven
+            try:
+                server.rset()
+                self._checkin(server)
+            except Exception:
+                self._close(server, quit=False)
+            raise
+        else:
+            if reused:
+                with self._lock:
+                    self.reuses += 1
+        self._checkin(server)
+        return result
+
+    def send_message(self, msg, from_addr=None, to_addrs=None):
+        """Als smtplib.SMTP.send_message, maar via een gedeelde verbinding."""
+        return self._send(lambda server: server.send_message(msg, from_addr, to_addrs))
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        """Als smtplib.SMTP.sendmail, maar via een gedeelde verbinding."""
+        return self._send(lambda server: server.sendmail(from_addr, to_addrs, msg))
+
+    def send_file(self, from_addr, to_addrs, path):
+        """Als sendmail, maar het bericht (CRLF) wordt regel voor regel uit een bestand gestreamd."""
+        with open(path, 'rb') as f:
+            def send(server):
+                f.seek(0)  # opnieuw vanaf het begin bij een nieuwe poging
+                return _sendfile(server, from_addr, to_addrs, f)
+            return self._send(send)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            same_process = self._pid == os.getpid()
+        for server, _ in idle:
+            self._close(server, quit=same_process)
+
+    def stats(self):
+        with self._lock:
+            average = self.handshake_seconds / self.handshakes if self.handshakes else 0.0
+            return {
+                'server': f"{self.host}:{self.port}",
+                'handshakes': self.handshakes,
+                'reuses': self.reuses,
+                'reconnects': self.reconnects,
+                'idle': len(self._idle),
+                'avg_handshake_ms': average * 1000,
+                'saved_ms': self.reuses * average * 1000,
+                'circuit': self.breaker.state,
+            }
+
+
+def _sendfile(server, from_addr, to_addrs, f, buffer_bytes=SEND_BUFFER_BYTES):
+    """
+    sendmail() met het bericht uit een binair bestand: zelfde envelop- en foutafhandeling, maar de data
+    gaat met dot-stuffing in blokken van buffer_bytes over de lijn in plaats van als één bytes-object.
+    """
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for addr in to_addrs:
+        code, resp = server.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+        if code == 421:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    server.putcmd('data')
+    code, resp = server.getreply()
+    if code != 354:
+        raise smtplib.SMTPDataError(code, resp)
+    buffer, size = [], 0
+    line = b'\r\n'
+    for line in f:
+        if line.startswith(b'.'):
+            line = b'.' + line
+        buffer.append(line)
+        size += len(line)
+        if size >= buffer_bytes:
+            server.send(b''.join(buffer))
+            buffer, size = [], 0
+    if not line.endswith(b'\r\n'):
+        buffer.append(b'\r\n')
+    buffer.append(b'.\r\n')
+    server.send(b''.join(buffer))
+    code, resp = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_smtp_pool(host, port, user=None, password=None, starttls=True):
+    """Gedeelde pool per (server, poort, gebruiker); een gewijzigd wachtwoord geeft een nieuwe pool."""
+    key = (host, int(port), user, password, starttls)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = SMTPPool(host, int(port), user, password, starttls)
+                _pools[key] = pool
+    return pool
+
+
+def pool_stats():
+    """Statistieken van alle pools in dit proces."""
+    return [pool.stats() for pool in list(_pools.values())]
+
+
+@atexit.register
+def close_all_pools():
+    """Sluit alle pools en vergeet ze; na een configuratiewijziging maakt get_smtp_pool nieuwe aan."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
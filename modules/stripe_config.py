@@ -1,16 +1,27 @@
+import importlib
 import os
 import stripe
-from dotenv import load_dotenv
 import logging
+import modules.email_config  # noqa: F401  laadt .env vóór de os.getenv-constanten hieronder
+from modules.resilience import get_breaker
 
-# Laad environment variables
-load_dotenv()
+# stripe 7.8.0: de module-__getattr__ van het pakket maakt stripe.apps, stripe.checkout enz. None, waardoor
+# het omzetten van elk API-antwoord faalt. De subpakketten expliciet laden zet de attributen goed.
+if getattr(stripe, 'apps', None) is None:
+    for _namespace in ('apps', 'billing_portal', 'checkout', 'climate', 'financial_connections', 'identity',
+                       'issuing', 'radar', 'reporting', 'sigma', 'tax', 'terminal', 'test_helpers', 'treasury'):
+        importlib.import_module(f"stripe.{_namespace}")
 
 # Stripe configuratie
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 
+# Timeouts per API-aanroep (de library wacht standaard 80 seconden)
+STRIPE_CONNECT_TIMEOUT = float(os.getenv('STRIPE_CONNECT_TIMEOUT', 5))
+STRIPE_READ_TIMEOUT = float(os.getenv('STRIPE_READ_TIMEOUT', 20))
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE')  # bijv. stripe-mock of een lokale stand-in
+
 # Product en prijs configuratie
 PRODUCT_NAME = "ATK-WPBR Tool Toegang"
 PRODUCT_DESCRIPTION = "Toegang tot de ATK-WPBR Tool voor het aanvragen van beveiligingspassen"
@@ -22,23 +33,36 @@ if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 else:
     logging.warning("STRIPE_SECRET_KEY niet ingesteld - betaalfunctionaliteit uitgeschakeld")
+stripe.default_http_client = stripe.new_default_http_client(timeout=(STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT))
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
+
+def is_stripe_outage(error):
+    """Netwerkfouten, timeouts en 5xx van Stripe; een geweigerde kaart of ongeldig verzoek telt niet mee."""
+    return isinstance(error, (stripe.error.APIConnectionError, stripe.error.APIError))
 
-def create_payment_intent(amount=None, currency=None, metadata=None):
-    """Maak een nieuwe payment intent aan"""
+# Na herhaalde storingen falen aanroepen direct, in plaats van workers op timeouts te laten wachten
+stripe_breaker = get_breaker('stripe', is_failure=is_stripe_outage)
+
+def create_payment_intent(amount=None, currency=None, metadata=None, customer=None, receipt_email=None):
+    """Maak een nieuwe payment intent aan (customer en receipt_email alleen als ze bekend zijn)"""
     if not STRIPE_SECRET_KEY:
         return None, "Stripe niet geconfigureerd"
     
     try:
         amount = amount or PRICE_AMOUNT
         currency = currency or PRICE_CURRENCY
+        optional = {key: value for key, value in (('customer', customer), ('receipt_email', receipt_email)) if value}
         
-        intent = stripe.PaymentIntent.create(
+        intent = stripe_breaker.call(
+            stripe.PaymentIntent.create,
             amount=amount,
             currency=currency,
             metadata=metadata or {},
             automatic_payment_methods={
                 'enabled': True,
             },
+            **optional,
         )
         return intent, None
     except Exception as e:
@@ -51,20 +75,22 @@ def get_payment_intent(payment_intent_id):
         return None
     
     try:
-        return stripe.PaymentIntent.retrieve(payment_intent_id)
+        return stripe_breaker.call(stripe.PaymentIntent.retrieve, payment_intent_id)
     except Exception as e:
         logging.error(f"Error retrieving payment intent: {e}")
         return None
 
-def create_customer(email, name=None):
+def create_customer(email, name=None, metadata=None):
     """Maak een nieuwe Stripe customer aan"""
     if not STRIPE_SECRET_KEY:
         return None, "Stripe niet geconfigureerd"
     
     try:
-        customer = stripe.Customer.create(
+        customer = stripe_breaker.call(
+            stripe.Customer.create,
             email=email,
             name=name,
+            metadata=metadata or {},
         )
         return customer, None
     except Exception as e:
@@ -77,7 +103,7 @@ def get_customer(customer_id):
         return None
     
     try:
-        return stripe.Customer.retrieve(customer_id)
+        return stripe_breaker.call(stripe.Customer.retrieve, customer_id)
     except Exception as e:
         logging.error(f"Error retrieving customer: {e}")
         return None
@@ -0,0 +1,239 @@
+"""
+Inbox voor Stripe-webhooks.
+
+/stripe-webhook controleert alleen de handtekening, legt het event vast in
+stripe_events (sleutel: het event-id van Stripe) en antwoordt direct met 200.
+Stripe stuurt een event opnieuw als het antwoord uitblijft of te laat komt;
+dankzij de sleutel wordt zo'n herhaling niet nog eens verwerkt.
+
+Een achtergrondthread verwerkt de events op volgorde van aanmaken bij Stripe,
+één tegelijk over alle processen heen (een claim van een gecrashte worker
+verloopt na STRIPE_EVENTS_LOCK_SECONDS). De handlers per eventtype draaien in
+dezelfde transactie die het event op 'done' zet: de wijzigingen in payments
+en users gebeuren precies één keer. Een handler die faalt geeft een nieuwe
+poging met backoff; na STRIPE_EVENTS_MAX_ATTEMPTS blijft het event op
+'failed' staan voor onderzoek.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from modules.mail_queue import MAIL_QUEUE_DB, backoff_seconds
+from modules.payment_ledger import LEDGER_HANDLERS
+
+STRIPE_EVENTS_POLL_SECONDS = float(os.getenv('STRIPE_EVENTS_POLL_SECONDS', 10))
+STRIPE_EVENTS_MAX_ATTEMPTS = int(os.getenv('STRIPE_EVENTS_MAX_ATTEMPTS', 8))
+STRIPE_EVENTS_LOCK_SECONDS = float(os.getenv('STRIPE_EVENTS_LOCK_SECONDS', 300))
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# Handlers per eventtype: (conn, object uit het event, het hele event), binnen de transactie van de inbox
+DEFAULT_HANDLERS = LEDGER_HANDLERS
+
+
+class StripeEventInbox:
+    def __init__(self, db_path=MAIL_QUEUE_DB, handlers=None, max_attempts=STRIPE_EVENTS_MAX_ATTEMPTS,
+                 poll_seconds=STRIPE_EVENTS_POLL_SECONDS):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self._handlers = {event_type: list(functions)
+                          for event_type, functions in (handlers or DEFAULT_HANDLERS).items()}
+        self._listeners = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        conn = self._connect()
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS stripe_events (
+                event_id TEXT PRIMARY KEY,
+                type TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                locked_until REAL,
+                last_error TEXT,
+                received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                processed_at TIMESTAMP
+            )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_stripe_events_due ON stripe_events (status, created)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add_handler(self, event_type, handler):
+        """handler(conn, obj, event) draait bij elk event van event_type, na de al geregistreerde handlers."""
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def add_listener(self, callback):
+        """callback(event) wordt aangeroepen nadat een event verwerkt en vastgelegd is."""
+        self._listeners.append(callback)
+
+    # --- Ontvangen ---
+
+    def receive(self, payload):
+        """
+        Leg een geverifieerd event (de ruwe JSON-body) vast. Return False als het event-id al bekend is
+        (herhaling door Stripe); de webhook antwoordt in beide gevallen met 200.
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        event = json.loads(payload)
+        conn = self._connect()
+        try:
+            inserted = conn.execute('''INSERT OR IGNORE INTO stripe_events
+                                      (event_id, type, payload, created, next_attempt_at) VALUES (?, ?, ?, ?, ?)''',
+                                    (event['id'], event['type'], payload, int(event.get('created') or time.time()),
+                                     time.time())).rowcount
+        finally:
+            conn.close()
+        if inserted:
+            self._wakeup.set()
+        else:
+            logging.info(f"Stripe event {event['id']} ({event['type']}) al ontvangen, genegeerd")
+        return bool(inserted)
+
+    # --- Verwerken ---
+
+    def _claim(self):
+        """Claim het oudste event dat aan de beurt is, zolang geen ander proces een event verwerkt."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            busy = conn.execute('SELECT 1 FROM stripe_events WHERE status = ? AND locked_until >= ? LIMIT 1',
+                                (PROCESSING, now)).fetchone()
+            row = None if busy else conn.execute(
+                '''SELECT * FROM stripe_events
+                   WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND locked_until < ?)
+                   ORDER BY created, received_at LIMIT 1''', (PENDING, now, PROCESSING, now)).fetchone()
+            if row:
+                conn.execute('''UPDATE stripe_events SET status = ?, locked_until = ?, attempts = attempts + 1
+                               WHERE event_id = ?''', (PROCESSING, now + STRIPE_EVENTS_LOCK_SECONDS, row['event_id']))
+            conn.execute('COMMIT')
+            return row
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _apply(self, row, event):
+        """Draai de handlers en zet het event op 'done', in één transactie."""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for handler in self._handlers.get(row['type'], ()):
+                handler(conn, event['data']['object'], event)
+            conn.execute('''UPDATE stripe_events SET status = ?, locked_until = NULL, last_error = NULL,
+                           processed_at = CURRENT_TIMESTAMP WHERE event_id = ?''', (DONE, row['event_id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _fail(self, row, error):
+        attempts = row['attempts'] + 1
+        permanent = attempts >= self.max_attempts
+        conn = self._connect()
+        try:
+            conn.execute('''UPDATE stripe_events SET status = ?, locked_until = NULL, last_error = ?,
+                           next_attempt_at = ? WHERE event_id = ?''',
+                         (FAILED if permanent else PENDING, error, time.time() + backoff_seconds(attempts),
+                          row['event_id']))
+        finally:
+            conn.close()
+        if permanent:
+            logging.error(f"Stripe event {row['event_id']} ({row['type']}) definitief mislukt: {error}")
+        else:
+            logging.warning(f"Stripe event {row['event_id']} ({row['type']}) poging {attempts} mislukt: {error}")
+
+    def process_one(self):
+        """Verwerk één event. Return False als er niets aan de beurt is."""
+        row = self._claim()
+        if row is None:
+            return False
+        event = json.loads(row['payload'])
+        try:
+            self._apply(row, event)
+        except Exception as e:
+            self._fail(row, f"{type(e).__name__}: {e}")
+            return True
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logging.error(f"Stripe event {row['event_id']}: listener mislukt: {e}")
+        return True
+
+    def process_due(self, limit=None):
+        """Verwerk wat aan de beurt is, op volgorde; return het aantal verwerkte events."""
+        processed = 0
+        while (limit is None or processed < limit) and not self._stop.is_set():
+            if not self.process_one():
+                break
+            processed += 1
+        return processed
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                self.process_due()
+            except Exception as e:
+                logging.error(f"Stripe events worker: {e}")
+            self._wakeup.wait(self.poll_seconds)
+
+    def start(self):
+        """Start de verwerkingsthread in dit proces (opnieuw na een fork)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._stop.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='stripe-events', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM stripe_events GROUP BY status').fetchall())
+        finally:
+            conn.close()
+        return {status: counts.get(status, 0) for status in (PENDING, PROCESSING, DONE, FAILED)}
+
+
+_inbox = None
+_inbox_lock = threading.Lock()
+
+
+def get_stripe_event_inbox():
+    """Gedeelde inbox per proces."""
+    global _inbox
+    if _inbox is None:
+        with _inbox_lock:
+            if _inbox is None:
+                _inbox = StripeEventInbox()
+    return _inbox
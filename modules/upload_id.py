@@ -1,7 +1,7 @@
 from fastapi import APIRouter, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 import os
-from .upload_tool import validate_and_resize_image
+from .image_processing import validate_and_resize_image
 
 router = APIRouter()
 
@@ -6,61 +6,51 @@ import os
 from PIL import Image
 import io
 from datetime import datetime
-import smtplib
 from email.message import EmailMessage
-from modules.email_config import get_smtp_config
-
-# Zet requirements op module-niveau zodat deze overal beschikbaar is
-requirements = {
-    'pasfoto': {'min': (276, 355), 'max': (551, 709)},
-    'handtekening': {'min': (354, 108), 'max': (945, 287)},
-    'bedrijfslogo': {'min': (315, 127), 'max': (945, 382)},
-}
+import logging
+from modules.mail_transport import get_transport, create_transport
+from modules.image_cache import get_image_cache
+from modules.imaging import requirements, REQUIREMENTS_VERSION, output_format, output_extension, process_image, get_backend
 
 def validate_and_resize_image(contents, image_type, filename):
-    if image_type not in requirements:
-        raise ValueError('Ongeldig afbeeldingstype.')
-    try:
-        image = Image.open(io.BytesIO(contents))
-        image.verify()
-        image = Image.open(io.BytesIO(contents))
-    except Exception:
-        raise ValueError('Bestand is geen geldige afbeelding.')
-    min_w, min_h = requirements[image_type]['min']
-    max_w, max_h = requirements[image_type]['max']
-    width, height = image.size
-    # Schaal naar min als kleiner, maar niet groter dan max
-    new_w, new_h = width, height
-    if width < min_w or height < min_h:
-        scale = max(min_w/width, min_h/height)
-        new_w, new_h = int(width*scale), int(height*scale)
-    if new_w > max_w or new_h > max_h:
-        scale = min(max_w/new_w, max_h/new_h)
-        new_w, new_h = int(new_w*scale), int(new_h*scale)
-    if (new_w, new_h) != (width, height):
-        image = image.resize((new_w, new_h), Image.LANCZOS)
-    return image
+    """Valideer en verwerk een afbeelding; return het resultaat als PIL Image."""
+    return Image.open(io.BytesIO(process_image(contents, image_type, filename)['data']))
 
 def process_upload(file, image_type):
     """
-    Valideer en resize een uploadbestand. Return dict met 'success', 'image' (PIL), 'error' (str), 'orig_size' (tuple), 'resized_size' (tuple), 'min_size', 'max_size'.
+    Valideer en resize een uploadbestand. Return dict met 'success', 'image' (PIL), 'data' (bytes in 'format'), 'error' (str), 'orig_size' (tuple), 'resized_size' (tuple), 'min_size', 'max_size'.
+    Verwerkte bytes worden gecached op inhoud, zodat een herhaalde upload (bijv. na /wijzigen) niet opnieuw wordt geresized.
     """
     try:
         contents = file.read()
         if len(contents) == 0:
             return {'success': False, 'error': 'Bestand is leeg.'}
-        # Originele afmetingen uitlezen
+        filename = getattr(file, 'filename', None) or file.name
+        fmt = output_format(filename, image_type)
+        # Originele afmetingen uitlezen (alleen header, geen decode)
         orig_image = Image.open(io.BytesIO(contents))
         orig_size = orig_image.size
-        image = validate_and_resize_image(contents, image_type, file.name)
+        backend = get_backend()
+        cache = get_image_cache()
+        cache_key = cache.make_key(contents, image_type, REQUIREMENTS_VERSION, fmt, backend.name)
+        data = cache.get(cache_key)
+        if data is None:
+            data = process_image(contents, image_type, filename, backend=backend)['data']
+            cache.put(cache_key, data)
+        else:
+            logging.info(f"Image cache hit voor {filename} ({image_type}), stats: {cache.stats()}")
+        image = Image.open(io.BytesIO(data))
         resized_size = image.size
         min_size = requirements[image_type]['min']
         max_size = requirements[image_type]['max']
         return {
             'success': True,
             'image': image,
+            'data': data,
+            'format': fmt,
+            'ext': output_extension(filename, fmt),
             'error': None,
-            'filename': file.name,
+            'filename': filename,
             'orig_size': orig_size,
             'resized_size': resized_size,
             'min_size': min_size,
@@ -84,14 +74,10 @@ def send_image_email(to_email, image, filename, smtp_config=None):
     maintype = 'image'
     subtype = 'jpeg' if fmt == 'JPEG' else 'png'
     msg.add_attachment(img_bytes.read(), maintype=maintype, subtype=subtype, filename=filename)
-    # Dummy SMTP-config als niet opgegeven
-    if smtp_config is None:
-        smtp_config = get_smtp_config()
     try:
-        with smtplib.SMTP(smtp_config['server'], smtp_config['port']) as server:
-            server.starttls()
-            server.login(smtp_config['user'], smtp_config['password'])
-            server.send_message(msg)
+        # Zonder opgegeven config: het transport van het standaardaccount
+        transport = get_transport() if smtp_config is None else create_transport(smtp_config)
+        transport.send_message(msg)
         return True, None
     except Exception as e:
         return False, str(e) 
\ No newline at end of file
@@ -1,8 +1,122 @@
 from docx import Document
+from io import BytesIO
+import hashlib
+import json
 import os
 import logging
+import threading
+import time
+from collections import OrderedDict
+from .docx_template import compile_template
 
-def generate_word_from_template(data: dict, template_path: str, output_path: str):
+# Gerenderde documenten bevatten persoonsgegevens (BSN, adres, geboortedatum): alleen in het geheugen,
+# kort en begrensd, en weg zodra de sessie wordt opgeschoond (zie discard_word_document)
+WORD_CACHE_MAX_BYTES = int(os.getenv('WORD_CACHE_MAX_BYTES', 32 * 1024 * 1024))  # 32MB
+WORD_CACHE_SECONDS = float(os.getenv('WORD_CACHE_SECONDS', 15 * 60))
+
+class DocumentCache:
+    """Begrensde LRU-cache in het geheugen voor gerenderde documenten; items verlopen na ttl seconden."""
+
+    def __init__(self, max_bytes=WORD_CACHE_MAX_BYTES, ttl=WORD_CACHE_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (bytes, opgeslagen op), minst recent gebruikt eerst
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Geef de bytes terug, of None bij een cache miss of een verlopen item."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (data, time.monotonic())
+            self._total_bytes += len(data)
+            now = time.monotonic()
+            for expired in [k for k, (_, stored_at) in self._entries.items() if now - stored_at >= self.ttl]:
+                self._remove(expired)
+            while self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def discard(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        # Aanroepen met self._lock vastgehouden
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._total_bytes -= len(entry[0])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+_word_cache = None
+_word_cache_lock = threading.Lock()
+
+def get_word_cache():
+    """Gedeelde documentcache per proces."""
+    global _word_cache
+    if _word_cache is None:
+        with _word_cache_lock:
+            if _word_cache is None:
+                _word_cache = DocumentCache()
+    return _word_cache
+
+def word_cache_key(data: dict, template_version: str) -> str:
+    """Cache-sleutel op basis van de ingevulde waarden en de templateversie."""
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha256(f"{template_version}\n{payload}".encode('utf-8')).hexdigest()
+    return f"{digest}.docx"
+
+def render_word_document(data: dict, template_path: str, cache=None) -> bytes:
+    """
+    Ingevuld Word document als bytes. Pas bij de eerste aanvraag wordt het document gerenderd;
+    herhaalde aanvragen met dezelfde gegevens en hetzelfde template komen uit de cache.
+    """
+    template = compile_template(template_path)
+    cache = cache or get_word_cache()
+    key = word_cache_key(data, template.version)
+    document = cache.get(key)
+    if document is None:
+        output = BytesIO()
+        template.render(data, output)
+        document = output.getvalue()
+        cache.put(key, document)
+        logging.info(f"Word document gerenderd en gecached: {key}, {len(document)} bytes "
+                     f"({template.report['saved_bytes']} bytes bespaard door optimalisatie)")
+    return document
+
+def discard_word_document(data: dict, template_path: str, cache=None):
+    """Verwijder het gerenderde document voor deze gegevens uit de cache (na verzenden, opschonen of uitloggen)."""
+    template = compile_template(template_path)
+    (cache or get_word_cache()).discard(word_cache_key(data, template.version))
+
+def generate_word_python_docx(data: dict, template_path: str, output_path: str):
+    """Oorspronkelijke python-docx implementatie; alleen nog als referentie voor benchmark.py."""
     doc = Document(template_path)
     
     # Functie om placeholders in tekst te vervangen
@@ -0,0 +1,294 @@
+"""
+Lokale stand-ins voor externe diensten, voor tests en benchmark.py.
+
+LocalSMTPServer spreekt genoeg SMTP voor smtplib (EHLO, AUTH, MAIL/RCPT/DATA,
+NOOP, RSET, QUIT); LocalHTTPMailServer neemt berichten aan zoals de
+HTTP-transport die verstuurt (POST met het ruwe MIME-bericht);
+LocalStripeServer beantwoordt de PaymentIntent- en Customer-aanroepen van de
+stripe-library; stripe_event() en sign_stripe_payload() maken webhook-events
+met een geldige Stripe-Signature header. Ze draaien in een achtergrondthread op een vrije poort op
+127.0.0.1. Met server.fault wordt een storing nagebootst: 'hang' neemt de
+verbinding aan maar antwoordt niet (tot stop()), 'unavailable' antwoordt met
+421 (SMTP) of 503 (HTTP).
+"""
+import hashlib
+import hmac
+import http.server
+import json
+import secrets
+import socketserver
+import threading
+import time
+from urllib.parse import parse_qs
+
+# Kunstmatige vertraging per nieuwe verbinding, als benadering van TCP+TLS+AUTH
+HANDSHAKE_DELAY = 0.05
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Minimale SMTP-server: EHLO, AUTH, MAIL/RCPT/DATA, NOOP, RSET en QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.open_sockets.append(self.connection)
+        if server.fault == 'hang':
+            server.released.wait()
+            return
+        time.sleep(server.handshake_delay)
+        if server.fault == 'unavailable':
+            self.reply('421 4.3.2 Service not available')
+            return
+        self.reply('220 localhost ESMTP test')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.wfile.write(b'250-localhost\r\n250 AUTH PLAIN LOGIN\r\n')
+            elif verb == 'AUTH':
+                self.reply('235 2.7.0 Authentication successful')
+            elif verb == 'RCPT' and any(address in command for address in server.rejected):
+                self.reply('550 5.1.1 No such user')
+            elif verb in ('MAIL', 'RCPT', 'RSET'):
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                with server.lock:
+                    server.noops += 1
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data, size = [], 0
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b'.\r\n', b''):
+                        break
+                    size += len(line)
+                    if server.store:
+                        data.append(line)
+                time.sleep(server.data_delay)
+                with server.lock:
+                    server.sizes.append(size)
+                    if server.store:
+                        server.messages.append(b''.join(data))
+                self.reply('250 OK queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake_delay=HANDSHAKE_DELAY):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.handshake_delay = handshake_delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.noops = 0
+        self.messages = []
+        self.sizes = []
+        self.store = True  # False: alleen de grootte bijhouden (grote berichten)
+        self.data_delay = 0.0  # verwerkingstijd van de server na DATA (scannen, doorsturen)
+        self.rejected = set()  # ontvangers die met 550 geweigerd worden
+        self.fault = None  # None, 'hang' of 'unavailable' voor nieuwe verbindingen
+        self.released = threading.Event()
+        self.open_sockets = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def drop_connections(self):
+        """Verbreek alle open verbindingen, zoals een server na een idle-timeout doet."""
+        with self.lock:
+            sockets, self.open_sockets = self.open_sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(2)
+            except OSError:
+                pass
+
+    def stop(self):
+        self.released.set()
+        self.shutdown()
+        self.server_close()
+
+
+class _HTTPMailHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, zoals een echte API
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        size, data = 0, []
+        while size < length:
+            chunk = self.rfile.read(min(64 * 1024, length - size))
+            if not chunk:
+                break
+            size += len(chunk)
+            if server.store:
+                data.append(chunk)
+        if server.api_key and self.headers.get('Authorization') != f"Bearer {server.api_key}":
+            return self.respond(401, {'error': 'invalid api key'})
+        if self.path != '/messages':
+            return self.respond(404, {'error': 'not found'})
+        with server.lock:
+            server.sizes.append(size)
+            server.envelopes.append((self.headers.get('X-Mail-From'), self.headers.get('X-Rcpt-To')))
+            if server.store:
+                server.messages.append(b''.join(data))
+            message_id = len(server.sizes)
+        self.respond(202, {'id': message_id})
+
+
+class LocalHTTPMailServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api_key='test-key'):
+        super().__init__(('127.0.0.1', 0), _HTTPMailHandler)
+        self.api_key = api_key
+        self.lock = threading.Lock()
+        self.messages = []
+        self.sizes = []
+        self.envelopes = []
+        self.store = True
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/messages"
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _StripeHandler(http.server.BaseHTTPRequestHandler):
+    """PaymentIntents en Customers aanmaken en ophalen (v1 API, form-encoded zoals de library stuurt)."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Request-Id', f"req_{secrets.token_hex(8)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fault(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.fault == 'hang':
+            server.released.wait()
+            self.close_connection = True
+            return True
+        if server.fault == 'unavailable':
+            self.respond(503, {'error': {'type': 'api_error', 'message': 'Service unavailable'}})
+            return True
+        if self.headers.get('Authorization') != f"Bearer {server.api_key}":
+            self.respond(401, {'error': {'type': 'invalid_request_error', 'message': 'Invalid API Key'}})
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        if self._fault():
+            return
+        server = self.server
+        if self.path == '/v1/payment_intents':
+            intent_id = f"pi_{secrets.token_hex(12)}"
+            obj = {'id': intent_id, 'object': 'payment_intent', 'amount': int(params.get('amount', 0)),
+                   'currency': params.get('currency'), 'status': 'requires_payment_method',
+                   'client_secret': f"{intent_id}_secret_{secrets.token_hex(8)}", 'customer': params.get('customer'),
+                   'metadata': {key[9:-1]: value for key, value in params.items() if key.startswith('metadata[')}}
+        elif self.path == '/v1/customers':
+            obj = {'id': f"cus_{secrets.token_hex(7)}", 'object': 'customer', 'email': params.get('email'),
+                   'name': params.get('name'),
+                   'metadata': {key[9:-1]: value for key, value in params.items() if key.startswith('metadata[')}}
+        else:
+            return self.respond(404, {'error': {'type': 'invalid_request_error', 'message': 'Unrecognized request URL'}})
+        with server.lock:
+            server.objects[obj['id']] = obj
+        self.respond(200, obj)
+
+    def do_GET(self):
+        if self._fault():
+            return
+        obj = self.server.objects.get(self.path.rsplit('/', 1)[-1])
+        if obj is None:
+            return self.respond(404, {'error': {'type': 'invalid_request_error', 'message': 'No such object'}})
+        self.respond(200, obj)
+
+
+class LocalStripeServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api_key='sk_test_standin'):
+        super().__init__(('127.0.0.1', 0), _StripeHandler)
+        self.api_key = api_key
+        self.lock = threading.Lock()
+        self.objects = {}
+        self.requests = 0
+        self.fault = None
+        self.released = threading.Event()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def stop(self):
+        self.released.set()
+        self.shutdown()
+        self.server_close()
+
+
+def stripe_event(event_type, obj, event_id=None, created=None):
+    """Webhook-event zoals Stripe het stuurt, als JSON-tekst."""
+    return json.dumps({
+        'id': event_id or f"evt_{secrets.token_hex(12)}",
+        'object': 'event',
+        'api_version': '2023-10-16',
+        'created': created or int(time.time()),
+        'type': event_type,
+        'livemode': False,
+        'pending_webhooks': 1,
+        'data': {'object': obj},
+    })
+
+
+def sign_stripe_payload(payload, secret, timestamp=None):
+    """Stripe-Signature header voor payload, ondertekend met het webhook secret (schema v1)."""
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
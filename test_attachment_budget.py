@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+from pypdf import PdfReader
+
+from modules.attachment_budget import estimate_message_size, fit_attachments
+
+
+def _noise(width, height, seed, mode='RGB'):
+    """Ruis comprimeert slecht: zo is een kleine testafbeelding toch groot genoeg voor het budget."""
+    rng = np.random.default_rng(seed)
+    channels = {'RGB': 3, 'RGBA': 4}[mode]
+    return Image.fromarray(rng.integers(0, 256, (height, width, channels), dtype=np.uint8), mode)
+
+
+def _bilevel(width, height, seed):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(((rng.random((height, width)) > 0.5) * 255).astype(np.uint8), 'L').convert('1')
+
+
+def test_budget_is_respected():
+    """Grootste bestanden eerst, steeds agressiever, totdat het bericht binnen de limiet past; originelen blijven."""
+    directory = tempfile.mkdtemp(prefix='attachmentbudget_test_')
+    try:
+        photo = os.path.join(directory, 'pasfoto.jpg')
+        _noise(1200, 900, 1).save(photo, format='JPEG', quality=95)
+        scan = os.path.join(directory, 'id.pdf')
+        _noise(1000, 1400, 2).save(scan, format='PDF', quality=95)
+        originals = [photo, scan]
+        original_bytes = [os.path.getsize(path) for path in originals]
+        limit = estimate_message_size(originals) // 2
+
+        result = fit_attachments(originals, os.path.join(directory, 'budget'), limit=limit)
+        assert result['success'] and result['error'] is None
+        assert result['size'] <= limit < result['original_size']
+        assert estimate_message_size(result['attachments']) <= limit
+        assert [os.path.basename(path) for path in result['attachments']] == ['pasfoto.jpg', 'id.pdf']
+        assert result['steps'] and result['steps'][0]['file'] == 'id.pdf'  # grootste eerst
+        assert [os.path.getsize(path) for path in originals] == original_bytes
+        assert len(PdfReader(result['attachments'][1]).pages) == 1
+
+        unreachable = fit_attachments(originals, os.path.join(directory, 'te-klein'), limit=10_000)
+        assert not unreachable['success'] and 'te groot' in unreachable['error']
+
+        untouched = fit_attachments(originals, os.path.join(directory, 'ruim'))
+        assert untouched['attachments'] == originals and not untouched['steps']
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_transparent_png_keeps_white_background():
+    """Een transparant logo wordt een JPEG op wit, niet op zwart."""
+    directory = tempfile.mkdtemp(prefix='attachmentbudget_test_')
+    try:
+        logo = _noise(900, 600, 3, 'RGBA')
+        alpha = np.zeros((600, 900), np.uint8)
+        alpha[150:450, 225:675] = 255
+        logo.putalpha(Image.fromarray(alpha, 'L'))
+        path = os.path.join(directory, 'logo.png')
+        logo.save(path, format='PNG')
+
+        result = fit_attachments([path], os.path.join(directory, 'budget'), limit=estimate_message_size([path]) // 2)
+        assert result['success'] and result['attachments'][0].endswith('logo.jpg')
+        with Image.open(result['attachments'][0]) as image:
+            pixels = np.asarray(image.convert('RGB')).astype(int)
+        height, width = pixels.shape[:2]
+        assert pixels[:height // 5].min() > 230 and pixels[:, :width // 5].min() > 230  # transparante rand
+        assert pixels[height // 3:2 * height // 3, width // 3:2 * width // 3].std() > 30  # het logo zelf
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_bilevel_images_are_left_alone():
+    """1-bit handtekeningen blijven ongewijzigd, als PNG-bijlage en als afbeelding in een PDF."""
+    directory = tempfile.mkdtemp(prefix='attachmentbudget_test_')
+    try:
+        signature = os.path.join(directory, 'handtekening.png')
+        _bilevel(1400, 600, 4).save(signature, format='PNG')
+        dossier = os.path.join(directory, 'dossier.pdf')
+        _noise(1000, 1400, 5).save(dossier, format='PDF', save_all=True, append_images=[_bilevel(700, 300, 6)])
+        limit = estimate_message_size([signature, dossier]) * 3 // 4
+
+        result = fit_attachments([signature, dossier], os.path.join(directory, 'budget'), limit=limit)
+        assert result['success']
+        assert result['attachments'][0] == signature
+        assert all(step['file'] == 'dossier.pdf' for step in result['steps'])
+        images = [image.image for page in PdfReader(result['attachments'][1]).pages for image in page.images]
+        assert [image.mode for image in images] == ['RGB', '1']
+        assert images[1].size == (700, 300)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_budget_is_respected()
+    test_transparent_png_keeps_white_background()
+    test_bilevel_images_are_left_alone()
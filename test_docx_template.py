@@ -0,0 +1,160 @@
+import io
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+
+from docx import Document
+
+from modules.docx_template import CompiledTemplate
+from modules.word_generator import DocumentCache, discard_word_document, render_word_document
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'atk_template.docx')
+
+
+def _document_text(data):
+    """Alle tekst uit de <w:t>-elementen van de XML-parts van een document (ook kop- en voetteksten)."""
+    with zipfile.ZipFile(io.BytesIO(data)) as package:
+        return ''.join(''.join(re.findall(r'<w:t(?:\s[^>]*)?>([^<]*)</w:t>', package.read(name).decode('utf-8')))
+                       for name in package.namelist() if name.startswith('word/') and name.endswith('.xml'))
+
+
+def test_every_placeholder_is_filled():
+    """Alle placeholders van het echte template worden ingevuld en het document opent in python-docx."""
+    template = CompiledTemplate(TEMPLATE_PATH)
+    assert len(template.placeholders) > 40
+    values = {key: f"waarde-{key}" for key in template.placeholders}
+    output = io.BytesIO()
+    template.render(values, output)
+    text = _document_text(output.getvalue())
+    for key, value in values.items():
+        assert value in text, key
+    assert '{{' not in text and '}}' not in text
+    document = Document(io.BytesIO(output.getvalue()))
+    assert document.tables or document.paragraphs
+
+
+def test_split_runs_escaping_and_line_breaks():
+    """Een placeholder over meerdere runs wordt één waarde; XML-tekens worden ge-escaped, regeleinden <w:br/>."""
+    directory = tempfile.mkdtemp(prefix='docxtemplate_test_')
+    try:
+        path = os.path.join(directory, 'template.docx')
+        source = Document()
+        paragraph = source.add_paragraph('Naam: ')
+        paragraph.add_run('{{voor')
+        paragraph.add_run('naam}}').bold = True
+        source.add_paragraph('Adres: {{adres}} / {{onbekend}}')
+        source.save(path)
+
+        for optimize in (False, True):
+            template = CompiledTemplate(path, optimize=optimize)
+            assert template.placeholders == {'voornaam', 'adres', 'onbekend'}
+            output = io.BytesIO()
+            template.render({'voornaam': 'Jan & <Piet>', 'adres': 'Straat 1\n1234 AB Plaats'}, output)
+
+            document = Document(io.BytesIO(output.getvalue()))
+            texts = [p.text for p in document.paragraphs]
+            assert texts[0] == 'Naam: Jan & <Piet>', optimize
+            assert texts[1] == 'Adres: Straat 1\n1234 AB Plaats / {{onbekend}}'  # zonder waarde blijft de placeholder
+            with zipfile.ZipFile(output) as package:
+                xml = package.read('word/document.xml').decode('utf-8')
+            assert 'Jan &amp; &lt;Piet&gt;' in xml and '<w:br/>' in xml
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_rendered_documents_are_cached_by_content():
+    """Dezelfde gegevens komen uit de cache; andere gegevens of een gewijzigd template geven een nieuw document."""
+    directory = tempfile.mkdtemp(prefix='docxtemplate_test_')
+    try:
+        path = os.path.join(directory, 'template.docx')
+        shutil.copy(TEMPLATE_PATH, path)
+        cache = DocumentCache()
+        data = {'voornamen': 'Jan', 'achternaam': 'Jansen'}
+        first = render_word_document(data, path, cache=cache)
+        assert render_word_document(dict(data), path, cache=cache) == first
+        assert (cache.stats()['misses'], cache.stats()['hits']) == (1, 1)
+        other = render_word_document({**data, 'achternaam': 'Pietersen'}, path, cache=cache)
+        assert 'Pietersen' in _document_text(other) and 'Jansen' in _document_text(first)
+        assert cache.stats()['misses'] == 2
+
+        # Nieuw template (andere inhoud en mtime): de oude documenten gelden niet meer
+        source = Document(path)
+        source.add_paragraph('Extra alinea {{voornamen}}')
+        source.save(path)
+        os.utime(path, (os.path.getatime(path), os.path.getmtime(path) + 10))
+        updated = render_word_document(data, path, cache=cache)
+        assert cache.stats()['misses'] == 3 and _document_text(updated).count('Jan') > _document_text(first).count('Jan')
+
+        # Opschonen van de sessie haalt het document (persoonsgegevens) uit de cache
+        discard_word_document(data, path, cache=cache)
+        render_word_document(data, path, cache=cache)
+        assert cache.stats()['misses'] == 4
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_document_cache_expires_and_evicts():
+    """Alleen in het geheugen: items verlopen na ttl en boven max_bytes gaat het minst recent gebruikte eruit."""
+    cache = DocumentCache(max_bytes=250, ttl=60)
+    cache.put('a', b'a' * 100)
+    cache.put('b', b'b' * 100)
+    assert cache.get('a') == b'a' * 100
+    cache.put('c', b'c' * 100)
+    assert cache.get('b') is None and cache.get('a') and cache.get('c')
+    cache.put('te-groot', b'x' * 300)
+    assert cache.get('te-groot') is None
+    cache.discard('a')
+    assert cache.get('a') is None and cache.stats()['bytes'] == 100
+
+    expired = DocumentCache(ttl=0)
+    expired.put('a', b'a')
+    assert expired.get('a') is None and expired.stats()['entries'] == 0
+
+
+def test_optimized_package_stays_valid():
+    """Het verkleinde document is kleiner, bevat dezelfde tekst en heeft geen verwijzingen naar verwijderde parts."""
+    values = {key: f"waarde-{key}" for key in CompiledTemplate(TEMPLATE_PATH, optimize=False).placeholders}
+    documents = {}
+    for optimize in (False, True):
+        output = io.BytesIO()
+        CompiledTemplate(TEMPLATE_PATH, optimize=optimize).render(values, output)
+        documents[optimize] = output.getvalue()
+    assert len(documents[True]) < len(documents[False])
+    assert _document_text(documents[True]) == _document_text(documents[False])
+    Document(io.BytesIO(documents[True]))
+
+    with zipfile.ZipFile(io.BytesIO(documents[True])) as package:
+        names = set(package.namelist())
+        parts = {name: package.read(name) for name in names}
+    for name, data in parts.items():
+        if name.endswith(('.xml', '.rels')):
+            ElementTree.fromstring(data)  # goed gevormde XML
+    for name, data in parts.items():
+        if not name.endswith('.rels'):
+            continue
+        base = posixpath.dirname(posixpath.dirname(name))
+        for relationship in ElementTree.fromstring(data):
+            if relationship.get('TargetMode') == 'External':
+                continue
+            target = posixpath.normpath(posixpath.join(base, relationship.get('Target'))).lstrip('/')
+            assert target in names, (name, target)
+    content_types = ElementTree.fromstring(parts['[Content_Types].xml'])
+    for override in content_types:
+        if override.get('PartName'):
+            assert override.get('PartName').lstrip('/') in names, override.get('PartName')
+    # Elke gebruikte stijl staat nog in styles.xml
+    styles = set(re.findall(r'w:styleId="([^"]+)"', parts['word/styles.xml'].decode('utf-8')))
+    used = set(re.findall(r'<w:(?:p|r|tbl)Style w:val="([^"]+)"', parts['word/document.xml'].decode('utf-8')))
+    assert used <= styles, used - styles
+
+
+if __name__ == "__main__":
+    test_every_placeholder_is_filled()
+    test_split_runs_escaping_and_line_breaks()
+    test_rendered_documents_are_cached_by_content()
+    test_document_cache_expires_and_evicts()
+    test_optimized_package_stays_valid()
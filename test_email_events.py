@@ -0,0 +1,159 @@
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from modules.database import init_db
+from modules.email_events import EmailEventHub
+
+
+def _hub(poll_seconds=0.1, **options):
+    """Hub op een eigen database met het schema van de app en drie e-mails in de wachtrij."""
+    directory = tempfile.mkdtemp(prefix='emailevents_test_')
+    db_path = os.path.join(directory, 'test.db')
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    for email_id, user_id in (('aanvraag', 1), ('bevestiging', 1), ('ander', 2)):
+        conn.execute('''INSERT INTO email_tracking (email_id, to_email, subject, user_id, sent_at, status)
+                       VALUES (?, 'x@example.org', 'Aanvraag', ?, NULL, 'queued')''', (email_id, user_id))
+    conn.commit()
+    conn.close()
+    return EmailEventHub(db_path, poll_seconds=poll_seconds, **options), directory
+
+
+def _update(hub, sql, *params):
+    """Wijziging via een eigen verbinding, zoals een andere worker of de trackingpixel die doet."""
+    conn = sqlite3.connect(hub.db_path)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_events_reach_only_subscribed_user():
+    """Een wijziging uit een ander proces komt via de cursor binnen; notify() maakt het direct."""
+    hub, directory = _hub(poll_seconds=0.2)
+    try:
+        subscription = hub.subscribe(1)
+        _update(hub, "UPDATE email_tracking SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE email_id = 'ander'")
+        _update(hub, "UPDATE email_tracking SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE email_id = 'aanvraag'")
+        event = subscription.get(timeout=1)
+        assert event['email_id'] == 'aanvraag' and event['status'] == 'sent' and event['sent_at']
+
+        _update(hub, "UPDATE email_tracking SET read_at = CURRENT_TIMESTAMP, read_count = read_count + 1 "
+                     "WHERE email_id = 'aanvraag'")
+        start = time.perf_counter()
+        hub.notify()
+        event = subscription.get(timeout=1)
+        elapsed = time.perf_counter() - start
+        print(f"leesbevestiging na notify(): {elapsed * 1000:.1f} ms (poll-interval {hub.poll_seconds * 1000:.0f} ms)")
+        assert event['read_count'] == 1 and elapsed < 0.15
+        _update(hub, "UPDATE email_tracking SET subject = 'Anders' WHERE email_id = 'aanvraag'")  # geen statuswijziging
+        hub.notify()
+        try:
+            subscription.get(timeout=0.3)
+            assert False, 'geen event verwacht'
+        except queue.Empty:
+            pass
+        hub.unsubscribe(subscription)
+        assert hub.stats()['connections'] == 0
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_stream_snapshot_then_updates():
+    """De stream begint met de actuele stand en stuurt daarna per wijziging het bericht en de gezamenlijke uitkomst."""
+    hub, directory = _hub()
+    try:
+        received = []
+        stream = hub.stream(1, ['aanvraag', 'bevestiging'], seconds=2, heartbeat_seconds=0.5)
+
+        def read():
+            for chunk in stream:
+                received.append(chunk)
+                if 'read_count": 1' in chunk:
+                    break
+        reader = threading.Thread(target=read)
+        reader.start()
+        deadline = time.monotonic() + 2
+        while len(received) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for email_id in ('aanvraag', 'bevestiging'):
+            _update(hub, "UPDATE email_tracking SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE email_id = ?",
+                    email_id)
+        _update(hub, "UPDATE email_tracking SET read_at = CURRENT_TIMESTAMP, read_count = 1 WHERE email_id = 'aanvraag'")
+        hub.notify()
+        reader.join(3)
+        stream.close()
+
+        events = [(chunk.split('\n')[0][len('event: '):], json.loads(chunk.split('\n')[1][len('data: '):]))
+                  for chunk in received if chunk.startswith('event: ')]
+        assert events[0] == ('email', {'email_id': 'aanvraag', 'status': 'queued', 'attempts': 0, 'sent_at': None,
+                                       'delivered_at': None, 'read_at': None, 'read_count': 0})
+        assert events[2] == ('verzending', {'status': 'pending'})
+        outcomes = [data['status'] for name, data in events if name == 'verzending']
+        assert outcomes[-1] == 'sent'
+        assert events[-1][1]['read_count'] == 1
+        assert hub.stats()['connections'] == 0
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_long_poll_stops_after_first_change():
+    """Onder sync workers sluit de stream na de eerste wijziging (met wat tegelijk binnenkwam) of na de tijdslimiet."""
+    hub, directory = _hub()
+    try:
+        stream = hub.stream(1, ['aanvraag', 'bevestiging'], seconds=5, heartbeat_seconds=0.2, long_poll=True)
+        assert next(stream) == "retry: 1000\n\n"
+        for _ in range(3):  # snapshot: twee berichten en de uitkomst
+            next(stream)
+        _update(hub, "UPDATE email_tracking SET status = 'sent', sent_at = CURRENT_TIMESTAMP")
+        hub.notify()
+        start = time.monotonic()
+        rest = list(stream)
+        assert time.monotonic() - start < 1
+        names = [chunk.split('\n')[0] for chunk in rest if chunk.startswith('event: ')]
+        assert names == ['event: email', 'event: email', 'event: verzending'] and '"sent"' in rest[-1]
+        assert hub.stats()['connections'] == 0
+
+        start = time.monotonic()
+        chunks = list(hub.stream(1, ['aanvraag'], seconds=0.5, heartbeat_seconds=0.2, long_poll=True))
+        assert 0.5 <= time.monotonic() - start < 1.5 and ': ping\n\n' in chunks
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_old_events_are_pruned_without_subscribers():
+    """De trigger ruimt oude events op bij het schrijven, ook zonder open verbindingen (en zonder thread)."""
+    hub, directory = _hub(prune_every=10)
+    try:
+        _update(hub, "INSERT INTO email_events (email_id, user_id, status, created_at) "
+                     "VALUES ('oud', 1, 'sent', datetime('now', '-2 days'))")
+        for n in range(25):
+            _update(hub, "UPDATE email_tracking SET read_count = ? WHERE email_id = 'ander'", n + 1)
+        conn = sqlite3.connect(hub.db_path)
+        old = conn.execute("SELECT COUNT(*) FROM email_events WHERE email_id = 'oud'").fetchone()[0]
+        recent = conn.execute("SELECT COUNT(*) FROM email_events WHERE email_id = 'ander'").fetchone()[0]
+        conn.close()
+        assert old == 0 and recent == 25
+        assert hub._thread is None and hub.stats()['connections'] == 0
+
+        # Een nieuwe hub met een andere bewaartermijn vervangt de trigger
+        EmailEventHub(hub.db_path, retention_hours=0.5, prune_every=1)
+        _update(hub, "UPDATE email_events SET created_at = datetime('now', '-1 hours') WHERE id <= 20")
+        _update(hub, "UPDATE email_tracking SET read_count = 100 WHERE email_id = 'ander'")
+        conn = sqlite3.connect(hub.db_path)
+        assert conn.execute('SELECT COUNT(*) FROM email_events').fetchone()[0] == 7  # id 21-26 en de nieuwe
+        conn.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_events_reach_only_subscribed_user()
+    test_stream_snapshot_then_updates()
+    test_long_poll_stops_after_first_change()
+    test_old_events_are_pruned_without_subscribers()
@@ -0,0 +1,94 @@
+import re
+
+from jinja2 import UndefinedError
+
+from modules.email_templates import create_environment, inline_css, parse_css, render_email, resolve_extends
+from modules.form_schema import convert_form
+
+PIXEL_URL = 'https://example.org/email/track/abc123'
+
+
+def _form():
+    return convert_form({
+        'voornamen': 'Jan',
+        'achternaam': 'de <Vries>',
+        'bedrijfsnaam': 'Beveiliging & Co',
+        'vergunning_type': 'ND',
+        'vergunning_nummer': '1234',
+        'datum_aanvraag': '19-10-2026',
+        'type_aanvraag': 'Eerste aanvraag',
+        'afdeling_select': 'Politie Midden-Nederland',
+        'email_opties_select': 'atk@example.org',
+    }).email
+
+
+def test_aanvraag_contains_form_values_and_tracking_pixel():
+    """Tekst en HTML bevatten de formulierwaarden en bijlagen; de HTML escapet ze en heeft de trackingpixel."""
+    text, html = render_email('aanvraag', form=_form(), datum='19-10-2026 10:15',
+                              bijlagen=[('pasfoto', 'pasfoto_1.jpg'), ('id', 'id_1.pdf')],
+                              reply_to='werkgever@example.org', tracking_pixel_url=PIXEL_URL)
+    for value in ('Medewerker: Jan de <Vries>', 'Bedrijf: Beveiliging & Co', 'Vergunningnummer: ND 1234',
+                  'Type aanvraag: Eerste aanvraag', 'Afdeling: Politie Midden-Nederland', '- pasfoto: pasfoto_1.jpg',
+                  '- id: id_1.pdf', 'verwacht op: werkgever@example.org', 'Datum: 19-10-2026 10:15'):
+        assert value in text, value
+    assert PIXEL_URL not in text
+
+    assert 'Jan de &lt;Vries&gt;' in html and 'Jan de <Vries>' not in html
+    assert 'Beveiliging &amp; Co' in html
+    assert '<li>pasfoto: pasfoto_1.jpg</li>' in html and 'mailto:werkgever@example.org' in html
+    assert html.count(PIXEL_URL) == 1
+    assert re.search(rf'<img src="{re.escape(PIXEL_URL)}" width="1" height="1" style="display:none;"', html)
+
+
+def test_css_is_inlined_without_classes():
+    """De stijlen uit email.css staan als style-attribuut op de elementen; class-attributen en <style> zijn weg."""
+    _, html = render_email('bevestiging', form=_form(), datum='19-10-2026 10:15')
+    assert 'class=' not in html and '<style' not in html
+    assert '<body style="font-family: Arial, sans-serif;' in html
+    assert re.search(r'<div style="[^"]*background-color: #4caf50;[^"]*">', html)  # .header-success
+    assert 'Verzonden naar:</strong> atk@example.org' in html
+
+
+def test_no_tracking_pixel_without_url():
+    text, html = render_email('bevestiging', form=_form(), datum='19-10-2026 10:15')
+    assert '<img' not in html
+    assert 'Beste Jan de <Vries>,' in text and 'Verzonden naar: atk@example.org' in text
+
+
+def test_missing_context_is_an_error():
+    """StrictUndefined: een ontbrekende variabele geeft een fout in plaats van een lege regel in de mail."""
+    try:
+        render_email('aanvraag', form=_form(), datum='19-10-2026 10:15', bijlagen=[])
+    except UndefinedError as e:
+        assert 'reply_to' in str(e)
+    else:
+        raise AssertionError('reply_to ontbreekt maar de mail werd gerenderd')
+
+
+def test_inline_css_keeps_existing_style():
+    rules = parse_css('p { color: #333; } .note { padding: 4px; }')
+    html = inline_css('<p class="note" style="margin: 0;">x</p><br/><span>y</span>', rules)
+    assert html == '<p style="color: #333; padding: 4px; margin: 0;">x</p><br/><span>y</span>'
+
+
+def test_extends_is_resolved_when_loading():
+    """base.html wordt bij het laden ingevuld; met super() of geneste blokken blijft het gewone Jinja-overerving."""
+    environment = create_environment()
+    source, _, _ = environment.loader.get_source(environment, 'bevestiging.html')
+    assert 'extends' not in source and '{% block' not in source
+    assert source.startswith('<!DOCTYPE html>') and '<title>Bevestiging aanvraag</title>' in source
+
+    parent = '<title>{% block title %}Standaard{% endblock %}</title>\n{% block content %}{% endblock %}\n</body>'
+    child = '{% extends "base.html" %}\n{% block content %}\n<p>{{ x }}</p>\n{% endblock %}\n'
+    assert resolve_extends(child, lambda name: parent) == '<title>Standaard</title>\n<p>{{ x }}</p>\n</body>'
+    assert resolve_extends('{% extends "base.html" %}{% block title %}{{ super() }}{% endblock %}', lambda name: parent) is None
+    assert resolve_extends('<p>geen overerving</p>', lambda name: parent) is None
+
+
+if __name__ == "__main__":
+    test_aanvraag_contains_form_values_and_tracking_pixel()
+    test_css_is_inlined_without_classes()
+    test_no_tracking_pixel_without_url()
+    test_missing_context_is_an_error()
+    test_inline_css_keeps_existing_style()
+    test_extends_is_resolved_when_loading()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from standins import stripe_event
+from modules.database import init_db
+from modules.entitlements import ACTIVE, EXPIRED, GRACE, UNPAID, Entitlement, UserCache
+from modules.stripe_events import StripeEventInbox
+
+
+def test_entitlement_status_over_time():
+    """Toegang tot de einddatum, daarna de respijttermijn, daarna niet meer; zonder betaling nooit."""
+    expires = datetime(2026, 3, 1, 12, 0, 0)
+    entitlement = Entitlement.from_row({'is_paid_user': 1, 'subscription_expires': '2026-03-01 12:00:00'},
+                                       grace_days=3)
+    assert entitlement.status(expires - timedelta(days=30)) == ACTIVE
+    assert entitlement.status(expires + timedelta(days=2)) == GRACE and entitlement.allows(expires + timedelta(days=2))
+    assert entitlement.status(expires + timedelta(days=4)) == EXPIRED
+    assert not entitlement.allows(expires + timedelta(days=4))
+    assert Entitlement(1).status() == ACTIVE  # betaald zonder einddatum (oude accounts)
+    assert Entitlement(0, '2099-01-01 00:00:00').status() == UNPAID
+    assert Entitlement(1, 'geen datum').status() == ACTIVE
+
+
+class _User:
+    def __init__(self, row):
+        self.id = row['id']
+        self.entitlement = Entitlement.from_row(row)
+
+
+def test_cache_is_invalidated_by_payment_webhook():
+    """Eén databaseread per gebruiker; een verwerkte betaling laat de volgende lookup de nieuwe toegang lezen."""
+    directory = tempfile.mkdtemp(prefix='entitlements_test_')
+    db_path = os.path.join(directory, 'test.db')
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (id, name, email, hashed_password) VALUES (1, 'Test BV', 'test@example.org', 'x')")
+    conn.execute("INSERT INTO users (id, name, email, hashed_password) VALUES (2, 'Ander BV', 'ander@example.org', 'x')")
+    conn.commit()
+    conn.close()
+
+    reads = []
+
+    def load(user_id):
+        reads.append(user_id)
+        conn = sqlite3.connect(db_path)
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+        conn.close()
+        return _User(row) if row else None
+
+    cache = UserCache(ttl=60)
+    inbox = StripeEventInbox(db_path, poll_seconds=0.1)
+    inbox.add_listener(cache.on_stripe_event)
+    try:
+        for _ in range(50):
+            assert not cache.get('1', load).entitlement.allows()
+            cache.get('2', load)
+        assert cache.get('999', load) is None
+        assert reads == ['1', '2', '999'] and cache.stats()['hits'] == 98
+
+        inbox.receive(stripe_event('payment_intent.succeeded', {
+            'id': 'pi_test', 'object': 'payment_intent', 'amount': 2500, 'currency': 'eur', 'status': 'succeeded',
+            'metadata': {'user_id': '1'}}))
+        assert inbox.process_due() == 1
+        user = cache.get(1, load)
+        assert user.entitlement.status() == ACTIVE and user.entitlement.expires > datetime.now() + timedelta(days=360)
+        cache.get(2, load)
+        assert reads == ['1', '2', '999', 1]  # alleen gebruiker 1 opnieuw gelezen
+
+        expired = UserCache(ttl=0)
+        expired.get(2, load)
+        expired.get(2, load)
+        assert reads[-2:] == [2, 2]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class _CachedUser:
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+def test_user_cache_evicts_expired_and_oldest_users():
+    """Verlopen gebruikers verdwijnen bij de volgende put(); boven max_users gaat de eerst geladen eruit."""
+    cache = UserCache(ttl=60, max_users=3)
+    for user_id in range(5):
+        cache.get(user_id, _CachedUser)
+    assert cache.stats()['users'] == 3
+    assert list(cache._users) == ['2', '3', '4']
+
+    now = time.monotonic()
+    cache.put(_CachedUser(2), now - 120)  # al verlopen
+    cache.put(_CachedUser(5), now)
+    assert list(cache._users) == ['3', '4', '5']  # 2 verlopen, dus 3 en 4 blijven
+    cache.put(_CachedUser(3), now - 120)
+    cache.get(3, lambda user_id: None)  # verlopen en niet meer in de database: ook uit de cache
+    assert '3' not in cache._users and cache.stats()['users'] == 2
+
+
+if __name__ == "__main__":
+    test_entitlement_status_over_time()
+    test_cache_is_invalidated_by_payment_webhook()
+    test_user_cache_evicts_expired_and_oldest_users()
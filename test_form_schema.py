@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from modules.docx_template import CompiledTemplate
+from modules.form_schema import CHECKED, FORM_SCHEMA, Field, compile_schema, convert_form
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'atk_template.docx')
+
+FORM_DATA = {
+    'voornamen': 'Jan',
+    'achternaam': 'Jansen',
+    'bedrijfsnaam': 'Beveiliging & Co',
+    'vergunning_type': 'ND',
+    'vergunning_nummer': '1234',
+    'woonplaats_medewerker': 'Utrecht',
+    'afdeling_select': 'Politie Midden-Nederland',
+    'email_opties_select': 'atk@example.org',
+    'type_aanvraag': 'Verlenging/herscreening',
+    'in_opleiding': 'on',
+    'persoonsbeveiliger': 'nee',
+    'certificaat_winkelsurveillant': True,
+    'pasfoto': 'uploads/pasfoto.jpg',
+    'id': '',
+    'datum_aanvraag': '19-10-2026',
+}
+
+
+def test_convert_maps_sources_and_kinds():
+    """Tekst komt uit de bronsleutel, vinkjes en keuzes worden het merkteken in de DOCX en een bool in de e-mail."""
+    view = convert_form(FORM_DATA)
+    docx, email = view.docx, view.email
+
+    assert docx['woonplaats'] == email['woonplaats'] == 'Utrecht'
+    assert docx['bedrijfsnaam'] == 'Beveiliging & Co'
+    assert docx['bsn'] == '' and email['bsn'] == ''  # ontbrekende tekst wordt leeg
+    assert email['afdeling'] == 'Politie Midden-Nederland' and 'afdeling' not in docx
+    assert email['email_afdeling'] == 'atk@example.org' and 'email_afdeling' not in docx
+    assert email['type_aanvraag'] == 'Verlenging/herscreening' and 'type_aanvraag' not in docx
+
+    # Keuze: alleen het gekozen type aanvraag is aangevinkt
+    assert (docx['eerste_aanvraag'], docx['verlenging_aanvraag'], docx['vervanging_aanvraag']) == ('', CHECKED, '')
+    assert (email['eerste_aanvraag'], email['verlenging_aanvraag']) == (False, True)
+    # Vinkje: 'on', True en 'ja' zijn waar; het merkteken verschilt per veld
+    assert docx['in_opleiding'] == 'ja' and email['in_opleiding'] is True
+    assert docx['persoonsbeveiliger'] == '' and email['persoonsbeveiliger'] is False
+    assert docx['certificaat_winkelsurveillant'] == docx['bijlagen_certificaat_winkelsurveillant'] == CHECKED
+    # Aanwezig: een niet-lege waarde
+    assert docx['bijlagen_pasfoto'] == CHECKED and email['bijlagen_pasfoto'] is True
+    assert docx['bijlagen_id'] == '' and email['bijlagen_handtekening'] is False
+
+    assert email['naam'] == 'Jan Jansen' and email['vergunning'] == 'ND 1234'
+    assert 'naam' not in docx
+
+
+def test_pdf_sections_only_contain_filled_fields():
+    """Alleen ingevulde velden met een label, in schemavolgorde; vinkjes worden 'Ja', lege secties vallen weg."""
+    sections = dict(convert_form(FORM_DATA).pdf_sections)
+    assert [title for title, _ in convert_form(FORM_DATA).pdf_sections] == [
+        'Aanvraag', 'Persoonlijke gegevens', 'Contactgegevens', 'Werkgever gegevens', 'Pas en opleiding']
+    assert sections['Aanvraag'] == [('Datum aanvraag', '19-10-2026'), ('Type aanvraag', 'Verlenging/herscreening'),
+                                    ('Afdeling', 'Politie Midden-Nederland')]
+    assert sections['Persoonlijke gegevens'] == [('Achternaam', 'Jansen'), ('Voornamen', 'Jan')]
+    assert sections['Contactgegevens'] == [('Woonplaats', 'Utrecht')]
+    assert sections['Pas en opleiding'] == [('In opleiding', 'Ja'), ('Certificaat winkelsurveillant', 'Ja')]
+
+    assert convert_form({'voornamen': 'Jan'}).pdf_sections == [('Persoonlijke gegevens', [('Voornamen', 'Jan')])]
+
+
+def test_schema_covers_template_placeholders():
+    """Elke placeholder in het Word template heeft een veld; een onbekende sectie is een fout bij het compileren."""
+    assert CompiledTemplate(TEMPLATE_PATH).placeholders <= set(FORM_SCHEMA.placeholders)
+    assert set(convert_form({}).docx) == set(FORM_SCHEMA.placeholders)
+    with pytest.raises(ValueError):
+        compile_schema([Field('x', 'X', 'Bestaat niet')])
+
+
+if __name__ == "__main__":
+    test_convert_maps_sources_and_kinds()
+    test_pdf_sections_only_contain_filled_fields()
+    test_schema_covers_template_placeholders()
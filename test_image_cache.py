@@ -0,0 +1,78 @@
+import io
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+import modules.image_cache as image_cache
+import modules.imaging as imaging
+from modules.image_cache import ImageCache
+from modules.upload_tool import process_upload
+
+
+def test_hits_misses_and_lru_eviction():
+    """Treffers en missers tellen mee; boven max_bytes gaat het minst recent gebruikte item eruit."""
+    directory = tempfile.mkdtemp(prefix='imagecache_test_')
+    try:
+        cache = ImageCache(directory, max_bytes=250)
+        keys = [ImageCache.make_key(bytes([n]), 'pasfoto', 1, 'JPEG', 'pillow') for n in range(3)]
+        assert cache.get(keys[0]) is None
+        cache.put(keys[0], b'a' * 100)
+        cache.put(keys[1], b'b' * 100)
+        assert cache.get(keys[0]) == b'a' * 100  # keys[0] is nu het laatst gebruikt
+        cache.put(keys[2], b'c' * 100)
+        assert cache.get(keys[1]) is None and not os.path.exists(os.path.join(directory, keys[1]))
+        assert cache.get(keys[2]) == b'c' * 100
+        cache.put('te-groot.png', b'x' * 300)
+        assert cache.get('te-groot.png') is None
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['entries'], stats['bytes']) == (2, 3, 2, 200)
+
+        # Na een herstart bouwt een nieuwe instantie de index op uit de bestanden op schijf
+        restarted = ImageCache(directory, max_bytes=250)
+        assert restarted.stats()['entries'] == 2 and restarted.get(keys[0]) == b'a' * 100
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_key_depends_on_backend_and_version():
+    key = ImageCache.make_key(b'foto', 'pasfoto', 5, 'JPEG', 'pillow')
+    assert key != ImageCache.make_key(b'foto', 'pasfoto', 5, 'JPEG', 'vips')
+    assert key != ImageCache.make_key(b'foto', 'pasfoto', 4, 'JPEG', 'pillow')
+    assert key != ImageCache.make_key(b'foto', 'handtekening', 5, 'JPEG', 'pillow')
+
+
+def test_process_upload_caches_per_backend():
+    """Een herhaalde upload komt uit de cache; na een wissel van IMAGING_BACKEND niet het resultaat van de ander."""
+    directory = tempfile.mkdtemp(prefix='imagecache_test_')
+    saved = (image_cache._cache, imaging.IMAGING_BACKEND)
+    image_cache._cache = ImageCache(directory)
+    try:
+        output = io.BytesIO()
+        Image.new('RGB', (1000, 400), (20, 60, 140)).save(output, format='PNG')
+        contents = output.getvalue()
+
+        def upload():
+            file = io.BytesIO(contents)
+            file.filename = 'logo.png'
+            return process_upload(file, 'bedrijfslogo')
+
+        backends = imaging.available_backends()
+        for backend in backends:
+            imaging.IMAGING_BACKEND = backend
+            first = upload()
+            assert first['success'] and first['resized_size'] == (945, 378)
+            assert upload()['data'] == first['data']
+        stats = image_cache._cache.stats()
+        assert stats['misses'] == len(backends) and stats['hits'] == len(backends)
+        assert stats['entries'] == len(backends)
+    finally:
+        image_cache._cache, imaging.IMAGING_BACKEND = saved
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_hits_misses_and_lru_eviction()
+    test_key_depends_on_backend_and_version()
+    test_process_upload_caches_per_backend()
@@ -0,0 +1,143 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from modules.imaging import PASFOTO_ASPECT, PASFOTO_TARGET_BYTES, available_backends, get_backend, process_image, requirements
+
+
+def _transparent_signature(mode='RGBA'):
+    """Handtekening als PNG zoals een tekenprogramma die exporteert: zwarte inkt op een transparant canvas."""
+    image = Image.new('RGBA', (1200, 500), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.line([(300, 260), (520, 180), (700, 300), (900, 220)], fill=(0, 0, 0, 255), width=10)
+    draw.line([(300, 320), (900, 320)], fill=(40, 40, 160, 128), width=6)  # half transparante onderstreping
+    if mode != 'RGBA':
+        image = image.convert(mode)
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def _signature_photo(width=1600, height=800):
+    """Telefoonfoto van een handtekening: grijs papier met lichtverloop en ruis, donkere pen in het midden."""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    shade = 150 + 60 * (xx / width) - 30 * (yy / height)
+    rgb = np.stack([shade + 8, shade + 4, shade], axis=-1) + rng.normal(0, 6, (height, width, 3))
+    photo = Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8), 'RGB')
+    draw = ImageDraw.Draw(photo)
+    t = np.linspace(0, 4 * np.pi, 300)
+    points = list(zip(width * (0.3 + 0.4 * t / t[-1]), height * (0.5 + 0.1 * np.sin(3 * t))))
+    draw.line(points, fill=(30, 30, 60), width=8)
+    output = io.BytesIO()
+    photo.filter(ImageFilter.GaussianBlur(1)).save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+def test_signature_photo_becomes_cropped_bilevel_png():
+    """Papier wordt wit, de pen zwart: een 1-bit PNG binnen de eisen, bijgesneden tot de pennenstreek."""
+    contents = _signature_photo()
+    for backend in available_backends():
+        result = process_image(contents, 'handtekening', 'handtekening.jpg', backend=backend)
+        image = Image.open(io.BytesIO(result['data']))
+        assert result['format'] == 'PNG' and result['ext'] == '.png' and image.format == 'PNG'
+        assert image.mode == '1', backend
+        width, height = image.size
+        minimum, maximum = requirements['handtekening']['min'], requirements['handtekening']['max']
+        assert minimum[0] <= width <= maximum[0] and minimum[1] <= height <= maximum[1], (backend, image.size)
+        pixels = np.asarray(image.convert('L'))
+        ink = (pixels < 128).mean()
+        # Geen papierruis als inkt, wel de streek; de uitsnede raakt de streek aan alle kanten bijna
+        assert 0.02 < ink < 0.3, (backend, ink)
+        assert (pixels[:, :width // 10] < 128).any() and (pixels[:, -width // 10:] < 128).any(), backend
+        assert len(result['data']) < len(contents) / 10
+
+
+def test_blank_signature_is_only_resized():
+    """Zonder inkt (leeg vel) geen uitsnede of drempel: alleen schalen binnen de eisen."""
+    output = io.BytesIO()
+    Image.new('RGB', (1000, 400), (240, 240, 235)).save(output, format='PNG')
+    for backend in available_backends():
+        result = process_image(output.getvalue(), 'handtekening', 'leeg.png', backend=backend)
+        assert tuple(result['size']) == (717, 287), backend
+        assert Image.open(io.BytesIO(result['data'])).mode != '1'
+
+
+def _pasfoto_photo():
+    """Liggend opgeslagen telefoonfoto (EXIF-oriëntatie 6) met een witte scanrand rond een portret."""
+    rng = np.random.default_rng(1)
+    portrait = Image.fromarray(np.clip(rng.normal(200, 8, (1600, 1200, 3)), 0, 255).astype(np.uint8), 'RGB')
+    draw = ImageDraw.Draw(portrait)
+    draw.ellipse((400, 300, 800, 1000), fill=(200, 150, 120))
+    draw.rectangle((250, 1050, 950, 1600), fill=(40, 40, 80))
+    framed = Image.new('RGB', (1400, 1800), (255, 255, 255))
+    framed.paste(portrait, (100, 100))
+    stored = framed.transpose(Image.Transpose.ROTATE_90)  # zo slaat de camera hem op; oriëntatie 6 draait terug
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    output = io.BytesIO()
+    stored.save(output, format='JPEG', quality=95, exif=exif)
+    return output.getvalue()
+
+
+def test_pasfoto_is_upright_trimmed_and_small():
+    """Rechtop gezet, rand weg, 35x45 binnen de eisen, progressieve JPEG zonder EXIF onder de doelgrootte."""
+    contents = _pasfoto_photo()
+    for backend in available_backends():
+        result = process_image(contents, 'pasfoto', 'pasfoto.png', backend=backend)
+        image = Image.open(io.BytesIO(result['data']))
+        assert image.format == 'JPEG' and result['ext'] == '.jpg'
+        assert image.info.get('progressive') or image.info.get('progression'), backend
+        assert not image.getexif(), backend
+        width, height = image.size
+        assert abs(width / height - PASFOTO_ASPECT) < 0.01, (backend, image.size)
+        assert requirements['pasfoto']['min'][0] <= width <= requirements['pasfoto']['max'][0]
+        assert len(result['data']) <= PASFOTO_TARGET_BYTES
+        pixels = np.asarray(image.convert('L')).astype(int)
+        assert pixels[:5].mean() < 240 and pixels[:, :5].mean() < 240, backend  # witte rand weggesneden
+        assert pixels[-height // 5:].mean() < pixels[:height // 5].mean() - 40, backend  # kleding onderin: rechtop
+
+
+def test_transparent_signature_keeps_white_background():
+    """Transparante pixels zijn papier, geen inkt: de uitvoer is grotendeels wit en bijgesneden tot de lijn."""
+    contents = _transparent_signature()
+    for backend in available_backends():
+        result = process_image(contents, 'handtekening', 'handtekening.png', backend=backend)
+        pixels = np.asarray(Image.open(io.BytesIO(result['data'])).convert('L'))
+        white = (pixels > 128).mean()
+        print(f"{backend}: {result['size'][0]}x{result['size'][1]}, {white:.0%} wit")
+        assert white > 0.8, backend
+        # Bijgesneden tot de inkt (600x120 px plus lijndikte), dus niet de verhouding van het hele canvas
+        width, height = result['size']
+        assert 3.5 < width / height < 6, backend
+
+
+def test_backends_match_on_alpha():
+    """Pillow en pyvips geven voor RGBA- en LA-invoer dezelfde grijswaarden en (vrijwel) dezelfde handtekening."""
+    backends = available_backends()
+    if 'vips' not in backends:
+        # pytest.importorskip vangt de OSError van pyvips zonder libvips niet af
+        pytest.skip('pyvips/libvips niet beschikbaar')
+    for mode in ('RGBA', 'LA'):
+        contents = _transparent_signature(mode)
+        grays = {name: get_backend(name).to_array(get_backend(name).load(contents), gray=True) for name in backends}
+        assert grays['pillow'].shape == grays['vips'].shape == (500, 1200)
+        assert np.abs(grays['pillow'].astype(int) - grays['vips'].astype(int)).max() <= 1, mode
+        assert grays['pillow'][0, 0] == 255  # transparant is wit
+        results = {name: process_image(contents, 'handtekening', 'h.png', backend=name) for name in backends}
+        assert results['pillow']['size'] == results['vips']['size'], mode
+        pixels = {name: np.asarray(Image.open(io.BytesIO(result['data'])).convert('L'))
+                  for name, result in results.items()}
+        different = (pixels['pillow'] != pixels['vips']).mean()
+        print(f"{mode}: {different:.2%} van de pixels verschilt tussen de backends (resize-kernel)")
+        assert different < 0.02, mode
+
+
+if __name__ == "__main__":
+    test_signature_photo_becomes_cropped_bilevel_png()
+    test_blank_signature_is_only_resized()
+    test_pasfoto_is_upright_trimmed_and_small()
+    test_transparent_signature_keeps_white_background()
+    test_backends_match_on_alpha()
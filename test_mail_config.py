@@ -0,0 +1,96 @@
+import base64
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+import modules.email_config as email_config
+from modules.email_config import MailConfig, encrypt_aes, install_reload_signal
+
+KEY = base64.b64encode(b'0123456789abcdef0123456789abcdef').decode()
+
+
+def _write_env(path, password, server='smtp.example.org'):
+    with open(path, 'w') as f:
+        f.write(f"SMTP_SERVER={server}\nSMTP_USER=aanvraag@example.org\n")
+        f.write(f"SMTP_KEY={KEY}\nSMTP_PASSWORD={encrypt_aes(password, KEY)}\n")
+        f.write("EMAIL_USER=noreply@example.org\nEMAIL_PASSWORD=gmail-geheim\n")
+
+
+def _wait_for(condition, timeout=3):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_mail_config_decrypts_once():
+    """Na het laden is een opvraging puur geheugen: geen .env, geen AES."""
+    directory = tempfile.mkdtemp(prefix='mailconfig_test_')
+    original_env, original_decrypt = email_config._PROCESS_ENV, email_config.decrypt_aes
+    calls = []
+
+    def counting_decrypt(*args):
+        calls.append(args)
+        return original_decrypt(*args)
+
+    email_config._PROCESS_ENV = {}
+    email_config.decrypt_aes = counting_decrypt
+    try:
+        path = os.path.join(directory, '.env')
+        _write_env(path, 'geheim')
+        config = MailConfig(path, watch_seconds=3600)
+        start = time.perf_counter()
+        for _ in range(1000):
+            smtp = config.get()
+            gmail = config.get('gmail')
+        per_call_us = (time.perf_counter() - start) / 2000 * 1e6
+        print(f"get(): {per_call_us:.2f} µs per opvraging, {len(calls)} keer ontsleuteld")
+        assert smtp['password'] == 'geheim' and smtp['server'] == 'smtp.example.org'
+        assert gmail['user'] == 'noreply@example.org' and gmail['password'] == 'gmail-geheim'
+        assert len(calls) == 1
+    finally:
+        email_config._PROCESS_ENV, email_config.decrypt_aes = original_env, original_decrypt
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_mail_config_reloads_on_mtime_and_sighup():
+    """Een gewijzigde .env wordt door de watcher opgepikt; SIGHUP laadt direct opnieuw."""
+    directory = tempfile.mkdtemp(prefix='mailconfig_test_')
+    original_env, original_config = email_config._PROCESS_ENV, email_config._config
+    previous_handler = signal.getsignal(signal.SIGHUP)
+    email_config._PROCESS_ENV = {}
+    try:
+        path = os.path.join(directory, '.env')
+        _write_env(path, 'oud')
+        config = MailConfig(path, watch_seconds=0.05)
+        changes = []
+        config.add_listener(lambda: changes.append(config.get()['password']))
+        assert config.get()['password'] == 'oud'
+
+        _write_env(path, 'nieuw')
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+        assert _wait_for(lambda: config.get()['password'] == 'nieuw')
+        assert changes == ['nieuw']
+
+        # SIGHUP: mtime gelijk houden, zodat alleen het signaal de herlaadactie kan veroorzaken
+        mtime = os.stat(path).st_mtime_ns
+        _write_env(path, 'na-sighup', server='smtp2.example.org')
+        os.utime(path, ns=(mtime, mtime))
+        config.watch_seconds = 3600
+        time.sleep(0.1)  # watcher wacht nu op een verzoek
+        email_config._config = config
+        assert install_reload_signal()
+        os.kill(os.getpid(), signal.SIGHUP)
+        assert _wait_for(lambda: config.get()['server'] == 'smtp2.example.org')
+        assert changes == ['nieuw', 'na-sighup']
+    finally:
+        signal.signal(signal.SIGHUP, previous_handler)
+        email_config._PROCESS_ENV, email_config._config = original_env, original_config
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_mail_config_decrypts_once()
+    test_mail_config_reloads_on_mtime_and_sighup()
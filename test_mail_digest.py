@@ -0,0 +1,91 @@
+import email
+import os
+import shutil
+import sqlite3
+import tempfile
+from email import policy
+
+from modules.database import init_db
+from modules.mail_digest import MailDigest
+from modules.mail_queue import MailQueue, combined_status
+from modules.mail_transport import MemoryTransport
+
+
+def _digest(**kwargs):
+    """Bundelaar op een eigen wachtrij en database met het schema van de app."""
+    directory = tempfile.mkdtemp(prefix='maildigest_test_')
+    db_path = os.path.join(directory, 'test.db')
+    init_db(db_path)
+    queue = MailQueue(db_path, os.path.join(directory, 'spool'), max_attempts=3, poll_seconds=0.1)
+    transport = MemoryTransport()
+    queue.register_account('default', lambda: transport)
+    digest = MailDigest(queue, db_path, os.path.join(directory, 'digest'), addresses='*', **kwargs)
+    return digest, transport, directory
+
+
+def _add(digest, directory, to_email, naam, size=1000):
+    path = os.path.join(directory, f"{naam}.pdf")
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    form = {'naam': naam, 'afdeling': 'Korpscheftaken', 'bedrijfsnaam': 'Test BV', 'vergunning': 'ND1234',
+            'datum_aanvraag': '01-01-2025', 'type_aanvraag': 'Nieuw'}
+    email_id = digest.add(to_email=to_email, subject=f"Aanvraag Beveiligingspas - {naam}", form=form,
+                          attachments=[path], reply_to=f"{naam.lower()}@example.org",
+                          tracking_pixel_url=f"https://example.org/pixel/{naam}")
+    os.remove(path)  # de bundel werkt met een eigen kopie
+    return email_id
+
+
+def _status(digest, email_id):
+    conn = sqlite3.connect(digest.db_path)
+    status = conn.execute('SELECT status FROM email_tracking WHERE email_id = ?', (email_id,)).fetchone()[0]
+    conn.close()
+    return status
+
+
+def test_digest_bundles_per_address():
+    """Aanvragen wachten tot het venster verstreken is en gaan dan per adres als één bericht de wachtrij in."""
+    digest, transport, directory = _digest(window_minutes=60)
+    try:
+        ids = [_add(digest, directory, 'noord@example.org', naam) for naam in ('Jansen', 'De Vries')]
+        ids.append(_add(digest, directory, 'zuid@example.org', 'Bakker'))
+        assert digest.flush() == 0
+        assert digest.pending() == {'noord@example.org': 2, 'zuid@example.org': 1}
+        assert _status(digest, ids[0]) == 'digest'
+        assert combined_status(['digest', 'sent']) == 'digest'
+
+        assert digest.flush(force=True) == 2
+        assert digest.pending() == {} and os.listdir(digest.directory) == []
+        assert digest.queue.process_due() == 2
+        assert [_status(digest, email_id) for email_id in ids] == ['sent'] * 3
+
+        messages = {m['to'][0]: email.message_from_bytes(m['data'], policy=policy.default) for m in transport.outbox}
+        noord = messages['noord@example.org']
+        assert noord['Subject'] == 'Aanvragen Beveiligingspas - 2 aanvragen'
+        filenames = [part.get_filename() for part in noord.iter_attachments()]
+        assert filenames == ['01 - Jansen.pdf', '02 - De Vries.pdf']
+        html = noord.get_body(('html',)).get_content()
+        assert 'Jansen' in html and 'https://example.org/pixel/De Vries' in html
+        assert 'Bakker' in messages['zuid@example.org'].get_body(('plain',)).get_content()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_digest_splits_on_size():
+    """Past de bundel niet in één bericht, dan gaat de rest in een volgend bericht naar hetzelfde adres."""
+    digest, transport, directory = _digest(window_minutes=0, max_bytes=200_000)
+    try:
+        for naam in ('Jansen', 'De Vries', 'Bakker'):
+            _add(digest, directory, 'noord@example.org', naam, size=60_000)
+        assert digest.flush() == 2
+        assert digest.queue.process_due() == 2
+        counts = sorted(len(list(email.message_from_bytes(m['data'], policy=policy.default).iter_attachments()))
+                        for m in transport.outbox)
+        assert counts == [1, 2]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_digest_bundles_per_address()
+    test_digest_splits_on_size()
@@ -0,0 +1,217 @@
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import time
+from email.message import EmailMessage
+
+from standins import LocalSMTPServer
+from modules.database import init_db
+from modules.mail_queue import PRIORITY_HIGH, PRIORITY_LOW, MailQueue, combined_status
+from modules.mail_transport import MemoryTransport
+from modules.send_rate import SendRateLimiter
+from modules.smtp_pool import SMTPPool
+
+
+def _queue(concurrency=2, rate_limiter=None):
+    """Wachtrij in een eigen tijdelijke database met het schema van de app."""
+    directory = tempfile.mkdtemp(prefix='mailqueue_test_')
+    db_path = os.path.join(directory, 'test.db')
+    init_db(db_path)
+    return MailQueue(db_path, os.path.join(directory, 'spool'), max_attempts=3, poll_seconds=0.1,
+                     concurrency=concurrency, rate_limiter=rate_limiter), directory
+
+
+def _tracking(queue, email_id):
+    conn = sqlite3.connect(queue.db_path)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute('SELECT * FROM email_tracking WHERE email_id = ?', (email_id,)).fetchone()
+    conn.close()
+    return row
+
+
+def _message(to='afdeling@example.org'):
+    msg = EmailMessage()
+    msg['From'] = 'aanvraag@example.org'
+    msg['To'] = to
+    msg['Bcc'] = 'archief@example.org'
+    msg['Subject'] = 'Aanvraag Beveiligingspas - Test'
+    msg.set_content('Testbericht')
+    return msg
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_mail_queue_delivers_and_tracks():
+    """enqueue() wacht niet op SMTP; de worker levert af en werkt email_tracking bij."""
+    server = LocalSMTPServer()
+    queue, directory = _queue()
+    pool = SMTPPool('127.0.0.1', server.port, 'gebruiker', 'geheim', starttls=False)
+    queue.register_account('default', lambda: pool)
+    try:
+        start = time.perf_counter()
+        email_id = queue.enqueue(_message(), tracking={'to_email': 'afdeling@example.org',
+                                                       'subject': 'Aanvraag', 'user_id': 1, 'form_data_id': 'f1'})
+        enqueue_ms = (time.perf_counter() - start) * 1000
+        assert _tracking(queue, email_id)['status'] == 'queued'
+        assert _tracking(queue, email_id)['sent_at'] is None
+
+        queue.start()
+        deadline = time.monotonic() + 5
+        while queue.status(email_id)['status'] != 'sent' and time.monotonic() < deadline:
+            time.sleep(0.02)
+        print(f"enqueue: {enqueue_ms:.1f} ms (SMTP-handshake stand-in: {pool.stats()['avg_handshake_ms']:.0f} ms)")
+
+        row = _tracking(queue, email_id)
+        assert row['status'] == 'sent' and row['sent_at'] and row['attempts'] == 1
+        assert len(server.messages) == 1
+        assert b'Bcc' not in server.messages[0]  # Bcc alleen in de envelop
+        assert not os.listdir(queue.spool_dir)
+    finally:
+        queue.stop()
+        pool.close()
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_mail_queue_retries_with_backoff():
+    """Een onbereikbare server geeft 'retry' met een latere poging; daarna gaat het bericht alsnog weg."""
+    server = LocalSMTPServer()
+    queue, directory = _queue()
+    down = SMTPPool('127.0.0.1', _free_port(), starttls=False, connect_timeout=1)
+    up = SMTPPool('127.0.0.1', server.port, starttls=False)
+    current = [down]
+    queue.register_account('default', lambda: current[0])
+    try:
+        email_id = queue.enqueue(_message(), tracking={'to_email': 'afdeling@example.org', 'subject': 'Aanvraag'})
+        assert queue.process_due() == 1
+        status = queue.status(email_id)
+        assert status['status'] == 'retry' and status['attempts'] == 1 and status['last_error']
+        assert queue.process_due() == 0  # backoff: nog niet aan de beurt
+
+        current[0] = up
+        conn = sqlite3.connect(queue.db_path)
+        conn.execute('UPDATE mail_queue SET next_attempt_at = 0')
+        conn.commit()
+        conn.close()
+        assert queue.process_due() == 1
+        assert queue.status(email_id)['status'] == 'sent'
+        assert _tracking(queue, email_id)['attempts'] == 2
+    finally:
+        up.close()
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_mail_queue_dead_letter():
+    """Een geweigerde ontvanger (5xx) gaat direct naar dead; het spoolbestand blijft bewaard en kan opnieuw."""
+    server = LocalSMTPServer()
+    server.rejected.add('onbekend@example.org')
+    queue, directory = _queue()
+    pool = SMTPPool('127.0.0.1', server.port, starttls=False)
+    queue.register_account('default', lambda: pool)
+    try:
+        email_id = queue.enqueue(_message('onbekend@example.org'), recipients=['onbekend@example.org'],
+                                 tracking={'to_email': 'onbekend@example.org', 'subject': 'Aanvraag'})
+        queue.process_due()
+        assert queue.status(email_id)['status'] == 'dead'
+        assert _tracking(queue, email_id)['status'] == 'dead'
+        assert os.listdir(queue.spool_dir) == [f"{email_id}.eml"]
+        assert queue.stats()['dead'] == 1
+
+        server.rejected.clear()
+        assert queue.requeue(email_id)
+        queue.process_due()
+        assert queue.status(email_id)['status'] == 'sent'
+    finally:
+        pool.close()
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_mail_queue_concurrent_dispatch():
+    """Aanvraag en bevestiging gaan tegelijk weg: de bevestiging wacht niet op de SMTP-sessie van de aanvraag."""
+    server = LocalSMTPServer()
+    server.data_delay = 0.3  # verwerkingstijd van de ontvangende server per bericht
+    elapsed = {}
+    try:
+        for concurrency in (1, 2):
+            queue, directory = _queue(concurrency)
+            pool = SMTPPool('127.0.0.1', server.port, starttls=False)
+            queue.register_account('default', lambda: pool)
+            try:
+                queue.start()
+                start = time.perf_counter()
+                email_ids = [queue.enqueue(_message('afdeling@example.org')),
+                             queue.enqueue(_message('aanvrager@example.org'))]
+                deadline = time.monotonic() + 5
+                while (combined_status([queue.status(email_id)['status'] for email_id in email_ids]) != 'sent'
+                       and time.monotonic() < deadline):
+                    time.sleep(0.01)
+                elapsed[concurrency] = time.perf_counter() - start
+            finally:
+                queue.stop()
+                pool.close()
+                shutil.rmtree(directory, ignore_errors=True)
+        print(f"aanvraag + bevestiging afgeleverd: na elkaar {elapsed[1] * 1000:.0f} ms, "
+              f"tegelijk {elapsed[2] * 1000:.0f} ms")
+        assert elapsed[1] >= 0.6
+        assert elapsed[2] < 0.55
+    finally:
+        server.stop()
+
+
+def test_rate_limit_shared_between_workers():
+    """Twee workers delen één token bucket; binnen de limiet gaat de aanvraag vóór bevestiging en feedback."""
+    limiter = SendRateLimiter(lambda account: {'per_minute': 120, 'per_day': 4, 'burst': 2})
+    queue, directory = _queue(rate_limiter=limiter)
+    other = MailQueue(queue.db_path, queue.spool_dir, rate_limiter=limiter)  # tweede gunicorn worker
+    transport = MemoryTransport()
+    for worker in (queue, other):
+        worker.register_account('default', lambda: transport)
+    try:
+        queue.enqueue(_message('feedback@example.org'), priority=PRIORITY_LOW)
+        queue.enqueue(_message('aanvrager@example.org'))
+        queue.enqueue(_message('afdeling@example.org'), priority=PRIORITY_HIGH)
+        queue.enqueue(_message('andere-afdeling@example.org'), priority=PRIORITY_HIGH)
+        assert queue.process_due() == 2  # burst
+        assert other.process_due() == 0  # de bucket is gedeeld
+        stats = other.stats()
+        assert stats['depth'] == {'high': 0, 'normal': 1, 'low': 1}
+        assert stats['rate']['default']['throttled'] >= 1 and 0 < stats['rate']['default']['wait_seconds'] <= 0.5
+        assert 0 < other._next_due_in() <= 0.5
+
+        time.sleep(0.55)  # 120/min: een nieuw token per 0,5 s
+        assert other.process_due() == 1
+        time.sleep(0.55)
+        assert other.process_due() == 1
+        time.sleep(0.55)
+        assert other.process_due() == 0  # daglimiet van 4 bereikt
+        assert queue.stats()['rate']['default']['wait_seconds'] > 60
+        assert [m['to'][0] for m in transport.outbox] == ['afdeling@example.org', 'andere-afdeling@example.org',
+                                                          'aanvrager@example.org', 'feedback@example.org']
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_combined_status():
+    assert combined_status(['sent', 'sent']) == 'sent'
+    assert combined_status(['sent', 'retry']) == 'pending'
+    assert combined_status(['sent', 'dead']) == 'partial'
+    assert combined_status(['dead', 'sent']) == 'dead'
+    assert combined_status(['sent', None]) == 'sent'
+    assert combined_status([None, None]) is None
+
+
+if __name__ == "__main__":
+    test_mail_queue_delivers_and_tracks()
+    test_mail_queue_retries_with_backoff()
+    test_mail_queue_dead_letter()
+    test_mail_queue_concurrent_dispatch()
+    test_rate_limit_shared_between_workers()
+    test_combined_status()
@@ -0,0 +1,85 @@
+import email
+import os
+import shutil
+import tempfile
+from email import policy
+from email.message import EmailMessage
+
+from standins import LocalHTTPMailServer, LocalSMTPServer
+from modules.mail_queue import is_permanent_error
+from modules.mail_transport import (FileTransport, HTTPTransport, MailTransportError, MemoryTransport,
+                                    SMTPTransport, create_transport)
+from modules.smtp_pool import SMTPPool
+
+
+def _message():
+    msg = EmailMessage()
+    msg['From'] = 'aanvraag@example.org'
+    msg['To'] = 'afdeling@example.org'
+    msg['Bcc'] = 'archief@example.org'
+    msg['Subject'] = 'Aanvraag Beveiligingspas - Test'
+    msg.set_content('Testbericht')
+    return msg
+
+
+def _spool(directory):
+    path = os.path.join(directory, 'bericht.eml')
+    with open(path, 'wb') as f:
+        f.write(_message().as_bytes(policy=policy.SMTP))
+    return path
+
+
+def test_transports_deliver_same_message():
+    """Elke backend levert hetzelfde bericht af bij dezelfde envelop, zowel vanuit een object als vanaf de spool."""
+    directory = tempfile.mkdtemp(prefix='transport_test_')
+    smtp_server = LocalSMTPServer()
+    http_server = LocalHTTPMailServer()
+    pool = SMTPPool('127.0.0.1', smtp_server.port, starttls=False)
+    try:
+        spool_path = _spool(directory)
+        memory = MemoryTransport()
+        capture_dir = os.path.join(directory, 'capture')
+        transports = [memory, FileTransport(capture_dir), SMTPTransport(pool),
+                      HTTPTransport(http_server.url, http_server.api_key)]
+        for transport in transports:
+            assert transport.send_message(_message()) == {}
+            assert transport.send_file('aanvraag@example.org', ['afdeling@example.org'], spool_path) == {}
+            assert transport.stats()['sent'] == 2
+
+        assert memory.outbox[0]['to'] == ['afdeling@example.org', 'archief@example.org']
+        assert b'Bcc' not in memory.outbox[0]['data']
+        assert len(smtp_server.messages) == 2 and len(http_server.messages) == 2
+        assert http_server.envelopes[0] == ('aanvraag@example.org', 'afdeling@example.org, archief@example.org')
+
+        captured = sorted(os.listdir(capture_dir))
+        assert len(captured) == 2 and all(name.endswith('.eml') for name in captured)
+        with open(os.path.join(capture_dir, captured[0]), 'rb') as f:
+            parsed = email.message_from_binary_file(f, policy=policy.default)
+        assert parsed['X-Envelope-To'] == 'afdeling@example.org, archief@example.org'
+        assert parsed['Subject'] == 'Aanvraag Beveiligingspas - Test'
+    finally:
+        pool.close()
+        smtp_server.stop()
+        http_server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_http_transport_errors():
+    """Een verkeerde API-sleutel is permanent (dead letter), een serverfout niet."""
+    http_server = LocalHTTPMailServer()
+    try:
+        transport = HTTPTransport(http_server.url, 'verkeerde-sleutel')
+        try:
+            transport.send_message(_message())
+            assert False, 'verwacht MailTransportError'
+        except MailTransportError as e:
+            assert e.status == 401 and is_permanent_error(e)
+        assert not is_permanent_error(MailTransportError('HTTP 503', status=503))
+        assert create_transport({'transport': 'memory'}) is create_transport({'transport': 'memory'})
+    finally:
+        http_server.stop()
+
+
+if __name__ == "__main__":
+    test_transports_deliver_same_message()
+    test_http_transport_errors()
@@ -0,0 +1,104 @@
+import email
+import os
+import shutil
+import tempfile
+import tracemalloc
+from email import policy
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from io import BytesIO
+
+from standins import LocalSMTPServer
+from modules.mime_stream import StreamedMessage
+from modules.smtp_pool import SMTPPool
+
+
+def _message(attachments):
+    msg = StreamedMessage('related')
+    msg['From'] = 'ATK-WPBR Tool <aanvraag@example.org>'
+    msg['To'] = 'afdeling@example.org'
+    msg['Bcc'] = 'archief@example.org'
+    msg['Subject'] = 'Aanvraag Beveiligingspas - José Müller'
+    alt = MIMEMultipart('alternative')
+    alt.attach(MIMEText('Tekst\n.regel die met een punt begint', 'plain', 'utf-8'))
+    alt.attach(MIMEText('<p>HTML</p>', 'html', 'utf-8'))
+    msg.attach(alt)
+    for path in attachments:
+        msg.attach_file(path)
+    return msg
+
+
+def test_streamed_message_roundtrip():
+    """Het gestreamde bericht is geldige MIME: bijlagen komen byte voor byte terug, zonder Bcc en met CRLF."""
+    directory = tempfile.mkdtemp(prefix='mime_test_')
+    try:
+        files = {}
+        for name, size in (('pasfoto.jpg', 100_000), ('dossier überzicht.pdf', 57 * 1024 * 3 + 5), ('leeg.txt', 0)):
+            path = os.path.join(directory, name)
+            data = os.urandom(size)
+            with open(path, 'wb') as f:
+                f.write(data)
+            files[name] = data
+
+        out = BytesIO()
+        _message([os.path.join(directory, name) for name in files]).write_to(out)
+        raw = out.getvalue()
+        assert b'\n' not in raw.replace(b'\r\n', b'')
+        assert b'Bcc' not in raw.split(b'\r\n\r\n', 1)[0]
+
+        parsed = email.message_from_bytes(raw, policy=policy.default)
+        assert parsed['Subject'] == 'Aanvraag Beveiligingspas - José Müller'
+        assert parsed.get_body(('plain',)).get_content().endswith('.regel die met een punt begint')
+        received = {part.get_filename(): part.get_payload(decode=True) for part in parsed.iter_attachments()}
+        assert received == files
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_streamed_send_memory():
+    """Spoolen en verzenden van 3 x 4 MB bijlagen blijft onder een vaste geheugengrens."""
+    directory = tempfile.mkdtemp(prefix='mime_test_')
+    server = LocalSMTPServer()
+    server.store = False
+    pool = SMTPPool('127.0.0.1', server.port, starttls=False)
+    try:
+        attachments = []
+        for i in range(3):
+            path = os.path.join(directory, f'scan{i}.pdf')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(4 * 1024 * 1024))
+            attachments.append(path)
+        spool_path = os.path.join(directory, 'bericht.eml')
+
+        # Oude opbouw: MIMEApplication per bijlage + as_string()
+        tracemalloc.start()
+        legacy = MIMEMultipart('related')
+        for path in attachments:
+            with open(path, 'rb') as f:
+                legacy.attach(MIMEApplication(f.read(), Name=os.path.basename(path)))
+        legacy.as_string()
+        legacy_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del legacy
+
+        tracemalloc.start()
+        with open(spool_path, 'wb') as f:
+            _message(attachments).write_to(f)
+        pool.send_file('aanvraag@example.org', ['afdeling@example.org'], spool_path)
+        streamed_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print(f"Piekgeheugen 12 MB bijlagen: oud {legacy_peak / 1024 / 1024:.1f} MB, "
+              f"gestreamd {streamed_peak / 1024 / 1024:.2f} MB (bericht {os.path.getsize(spool_path) / 1024 / 1024:.1f} MB)")
+        assert server.sizes[-1] >= os.path.getsize(spool_path) - 16
+        assert streamed_peak < 2 * 1024 * 1024
+    finally:
+        pool.close()
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_streamed_message_roundtrip()
+    test_streamed_send_memory()
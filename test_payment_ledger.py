@@ -0,0 +1,128 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import stripe
+
+import modules.stripe_config as stripe_config
+from standins import LocalStripeServer, stripe_event
+from modules.database import init_db
+from modules.payment_ledger import PaymentLedger
+from modules.stripe_events import StripeEventInbox
+
+
+def _setup():
+    """Grootboek en inbox op een eigen database, met Stripe als lokale stand-in."""
+    directory = tempfile.mkdtemp(prefix='paymentledger_test_')
+    db_path = os.path.join(directory, 'test.db')
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (id, name, email, hashed_password) VALUES (1, 'Test BV', 'test@example.org', 'x')")
+    conn.execute("INSERT INTO users (id, name, email, hashed_password) VALUES (2, 'Ander BV', 'ander@example.org', 'x')")
+    conn.commit()
+    conn.close()
+
+    server = LocalStripeServer()
+    saved = (stripe_config.STRIPE_SECRET_KEY, stripe.api_key, stripe.api_base, stripe.default_http_client)
+    stripe_config.STRIPE_SECRET_KEY = stripe.api_key = server.api_key
+    stripe.api_base = server.url
+    stripe.default_http_client = stripe.new_default_http_client(timeout=(0.5, 2))
+    stripe_config.stripe_breaker.reset()
+
+    def teardown():
+        (stripe_config.STRIPE_SECRET_KEY, stripe.api_key, stripe.api_base, stripe.default_http_client) = saved
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+    return PaymentLedger(db_path), StripeEventInbox(db_path, poll_seconds=0.1), server, teardown
+
+
+def _query(ledger, sql, *params):
+    conn = sqlite3.connect(ledger.db_path)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute(sql, params).fetchone()
+    conn.close()
+    return row
+
+
+def test_open_intent_is_reused():
+    """Een tweede bezoek aan de betaalpagina gebruikt de openstaande intent; een ander bedrag krijgt een nieuwe."""
+    ledger, inbox, server, teardown = _setup()
+    try:
+        secret, error = ledger.open_intent(1, 'test@example.org')
+        assert error is None and secret
+        requests = server.requests
+        assert ledger.open_intent(1, 'test@example.org') == (secret, None)
+        assert server.requests == requests  # geen aanroep naar Stripe
+
+        # Een mislukte betaling mag opnieuw met dezelfde intent
+        intent_id = secret.split('_secret_')[0]
+        inbox.receive(stripe_event('payment_intent.payment_failed', dict(server.objects[intent_id])))
+        assert inbox.process_due() == 1
+        assert ledger.open_intent(1, 'test@example.org') == (secret, None)
+
+        other, error = ledger.open_intent(1, 'test@example.org', amount=5000)
+        assert error is None and other != secret and server.requests == requests + 1
+        assert ledger.open_intent(2, 'ander@example.org')[0] not in (secret, other)
+        print(f"Stripe-aanroepen: {ledger.stripe_calls} voor 5 keer de betaalpagina")
+    finally:
+        teardown()
+
+
+def test_confirm_from_webhook_and_fallback():
+    """Na de webhook antwoordt confirm() uit de database; zonder webhook één keer via Stripe."""
+    ledger, inbox, server, teardown = _setup()
+    try:
+        ledger.open_intent(1, 'test@example.org')
+        intent = dict(server.objects[_query(ledger, 'SELECT stripe_payment_intent_id FROM payments')[0]],
+                      status='succeeded')
+        inbox.add_listener(ledger.create_missing_customer)
+        inbox.receive(stripe_event('payment_intent.succeeded', intent))
+        assert inbox.process_due() == 1
+        requests = server.requests
+        assert ledger.confirm(1, intent['id']) == (True, None)
+        assert ledger.confirm(2, intent['id'])[0] is False  # niet van deze gebruiker
+        assert server.requests == requests
+        user = _query(ledger, 'SELECT * FROM users WHERE id = 1')
+        assert user['is_paid_user'] == 1 and user['subscription_status'] == 'active'
+        # De listener heeft na de betaling een Customer aangemaakt
+        assert user['stripe_customer_id'] and server.objects[user['stripe_customer_id']]['metadata'] == {'user_id': '1'}
+        assert _query(ledger, 'SELECT stripe_customer_id FROM payments')[0] == user['stripe_customer_id']
+
+        # Gebruiker 2: de redirect is er eerder dan de webhook
+        secret, _ = ledger.open_intent(2, 'ander@example.org')
+        intent_id = secret.split('_secret_')[0]
+        assert ledger.confirm(2, intent_id) == (False, 'Betaling niet succesvol of niet gevonden.')
+        server.objects[intent_id]['status'] = 'succeeded'
+        assert ledger.confirm(2, intent_id) == (True, None)
+        assert _query(ledger, 'SELECT is_paid_user FROM users WHERE id = 2')[0] == 1
+        requests = server.requests
+        assert ledger.confirm(2, intent_id) == (True, None)
+        assert server.requests == requests
+        # De late webhook verandert niets meer aan de status
+        inbox.receive(stripe_event('payment_intent.succeeded', dict(server.objects[intent_id])))
+        assert inbox.process_due() == 1
+        assert _query(ledger, 'SELECT status FROM payments WHERE user_id = 2')[0] == 'succeeded'
+    finally:
+        teardown()
+
+
+def test_customer_event_is_cached():
+    """customer.created zet de customer-id bij de gebruiker, ook zonder metadata (via het e-mailadres)."""
+    ledger, inbox, server, teardown = _setup()
+    try:
+        inbox.receive(stripe_event('customer.created', {'id': 'cus_dashboard', 'object': 'customer',
+                                                         'email': 'ander@example.org', 'metadata': {}}))
+        inbox.process_due()
+        assert _query(ledger, 'SELECT stripe_customer_id FROM users WHERE id = 2')[0] == 'cus_dashboard'
+        ledger.open_intent(2, 'ander@example.org')
+        intent_id = _query(ledger, 'SELECT stripe_payment_intent_id FROM payments')[0]
+        assert server.objects[intent_id]['customer'] == 'cus_dashboard'
+    finally:
+        teardown()
+
+
+if __name__ == "__main__":
+    test_open_intent_is_reused()
+    test_confirm_from_webhook_and_fallback()
+    test_customer_event_is_cached()
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from reportlab import rl_config
+
+import modules.pdf_dossier as pdf_dossier
+from modules.pdf_dossier import build_dossier
+
+SECTIONS = [
+    ('Aanvraag', [('Type aanvraag', 'Eerste aanvraag')]),
+    ('Persoonlijke gegevens', [('Achternaam', 'Jansen'), ('Voornamen', 'Jan')]),
+    ('Werkgever gegevens', [('Bedrijfsnaam', 'Beveiliging & Co')]),
+]
+
+
+def _attachments(directory):
+    """Verwerkte uploads zoals in uploads/: JPEG-pasfoto, 1-bit handtekening, transparant logo, PDF van twee pagina's."""
+    rng = np.random.default_rng(0)
+    paths = {}
+    paths['pasfoto'] = os.path.join(directory, 'pasfoto.jpg')
+    Image.fromarray(rng.integers(0, 256, (300, 230, 3), dtype=np.uint8)).save(paths['pasfoto'], quality=85)
+    paths['handtekening'] = os.path.join(directory, 'handtekening.png')
+    signature = np.full((120, 400), 255, np.uint8)
+    signature[50:70, 40:360] = 0
+    Image.fromarray(signature).convert('1').save(paths['handtekening'])
+    paths['logo'] = os.path.join(directory, 'logo.png')
+    logo = Image.new('RGBA', (300, 120), (0, 0, 0, 0))
+    logo.paste((20, 60, 140, 255), (50, 30, 250, 90))
+    logo.save(paths['logo'])
+    paths['id'] = os.path.join(directory, 'id.pdf')
+    Image.new('RGB', (600, 400), (200, 200, 200)).save(
+        paths['id'], save_all=True, append_images=[Image.new('RGB', (600, 400), (90, 90, 90))])
+    paths['word'] = os.path.join(directory, 'aanvraag.docx')
+    with open(paths['word'], 'wb') as f:
+        f.write(b'PK\x03\x04')
+    return paths
+
+
+def test_pages_bookmarks_and_section_order():
+    """Voorblad met de secties in volgorde, een pagina per afbeelding, dan de PDF-pagina's; bladwijzer per document."""
+    directory = tempfile.mkdtemp(prefix='dossier_test_')
+    try:
+        paths = _attachments(directory)
+        output = os.path.join(directory, 'dossier.pdf')
+        order = [paths['id'], paths['pasfoto'], paths['handtekening'], paths['logo'], paths['word']]
+        result = build_dossier(SECTIONS, order, output)
+        assert result['success'] and result['error'] is None
+        assert result['included'] == order[:4] and result['skipped'] == [paths['word']]
+        assert result['size'] == os.path.getsize(output)
+
+        reader = PdfReader(output)
+        assert result['pages'] == len(reader.pages) == 1 + 3 + 2
+        cover = reader.pages[0].extract_text()
+        positions = [cover.index(text) for text in ('Aanvraag Beveiligingspas', 'Type aanvraag', 'Persoonlijke gegevens',
+                                                     'Jansen', 'Werkgever gegevens', 'Beveiliging & Co',
+                                                     'Documenten in dit dossier', 'id.pdf', 'aanvraag.docx')]
+        assert positions == sorted(positions)
+        assert 'Los bijgevoegd' in cover
+        assert [reader.pages[i].extract_text().strip() for i in (1, 2, 3)] == ['pasfoto.jpg', 'handtekening.png', 'logo.png']
+        outline = [(item.title, reader.get_destination_page_number(item)) for item in reader.outline]
+        assert outline == [('Aanvraaggegevens', 0), ('pasfoto.jpg', 1), ('handtekening.png', 2), ('logo.png', 3),
+                           ('id.pdf', 4)]
+        assert reader.metadata.title == 'Aanvraag Beveiligingspas'
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_embedded_images_still_decode():
+    """De JPEG gaat byte voor byte de PDF in; handtekening en logo (op wit) decoderen met de juiste afmetingen."""
+    directory = tempfile.mkdtemp(prefix='dossier_test_')
+    try:
+        paths = _attachments(directory)
+        output = os.path.join(directory, 'dossier.pdf')
+        assert build_dossier(SECTIONS, [paths['pasfoto'], paths['handtekening'], paths['logo']], output)['success']
+        reader = PdfReader(output)
+        images = [page.images[0] for page in reader.pages[1:]]
+
+        xobject = next(iter(reader.pages[1]['/Resources']['/XObject'].values())).get_object()
+        with open(paths['pasfoto'], 'rb') as f:
+            assert list(xobject['/Filter']) == ['/DCTDecode'] and xobject._data == f.read()  # niet opnieuw gecodeerd
+        assert images[0].image.size == (230, 300)
+        signature = np.asarray(images[1].image.convert('L'))
+        assert signature.shape == (120, 400) and signature[60, 200] < 50 and signature[10, 10] > 200
+        assert images[2].image.size == (300, 120)
+        # Geen ASCII85 in de streams, en rl_config is na afloop weer zoals de rest van het proces het verwacht
+        for page in reader.pages[1:]:
+            for image in page['/Resources']['/XObject'].values():
+                assert '/ASCII85Decode' not in list(image.get_object()['/Filter'])
+        assert rl_config.useA85 == 1
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_without_pikepdf_and_with_protected_pdf():
+    """Zonder pikepdf gewoon een (niet gelineariseerd) dossier; een beveiligde PDF gaat los mee."""
+    directory = tempfile.mkdtemp(prefix='dossier_test_')
+    saved = pdf_dossier.pikepdf
+    pdf_dossier.pikepdf = None
+    try:
+        paths = _attachments(directory)
+        protected = os.path.join(directory, 'beveiligd.pdf')
+        writer = PdfWriter(clone_from=paths['id'])
+        writer.encrypt('geheim')
+        with open(protected, 'wb') as f:
+            writer.write(f)
+
+        output = os.path.join(directory, 'dossier.pdf')
+        assert pdf_dossier._linearize(output) is False
+        result = build_dossier(SECTIONS, [paths['pasfoto'], protected], output)
+        assert result['success'] and result['skipped'] == [protected]
+        assert result['pages'] == 2 and len(PdfReader(output).pages) == 2
+
+        corrupt = os.path.join(directory, 'kapot.jpg')
+        with open(corrupt, 'wb') as f:
+            f.write(b'geen afbeelding')
+        broken = build_dossier(SECTIONS, [corrupt], output)
+        assert not broken['success'] and broken['error']
+    finally:
+        pdf_dossier.pikepdf = saved
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_pages_bookmarks_and_section_order()
+    test_embedded_images_still_decode()
+    test_without_pikepdf_and_with_protected_pdf()
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from modules.prerender import Prerenderer
+
+
+def test_submit_result_and_discard():
+    """Het resultaat van een taak is op te halen; een onbekende job of taak en een vergeten job geven None."""
+    prerenderer = Prerenderer(workers=2)
+    prerenderer.submit('job', {'word': (lambda data: data.upper(), 'document'), 'som': (sum, [1, 2, 3])})
+    assert prerenderer.result('job', 'word') == 'DOCUMENT'
+    assert prerenderer.result('job', 'som') == 6
+    assert prerenderer.result('job', 'onbekend') is None
+    assert prerenderer.result('andere-worker', 'word') is None
+    assert prerenderer.result(None, 'word') is None
+
+    prerenderer.discard('job')
+    assert prerenderer.result('job', 'word') is None
+    prerenderer.discard('job')  # tweede keer: geen fout
+
+
+def test_timeout_and_error_fall_back_to_none():
+    """Niet klaar binnen de timeout of een exceptie in de taak: None, zodat de route zelf rendert."""
+    prerenderer = Prerenderer(workers=1)
+    release = threading.Event()
+
+    def fail():
+        raise ValueError('kapot template')
+
+    prerenderer.submit('job', {'traag': (release.wait,), 'fout': (fail,)})
+    started = time.monotonic()
+    assert prerenderer.result('job', 'traag', timeout=0.1) is None
+    assert time.monotonic() - started < 2
+    release.set()
+    assert prerenderer.result('job', 'traag') is True
+    assert prerenderer.result('job', 'fout') is None
+
+
+def test_resubmit_cancels_tasks_that_did_not_start():
+    """Een nieuwe inzending met hetzelfde id vervangt de job; wachtende taken van de oude job lopen niet meer."""
+    prerenderer = Prerenderer(workers=1)
+    release = threading.Event()
+    ran = []
+    blocker = prerenderer.submit('blokkeert', {'wacht': (release.wait,)})['wacht']
+    old = prerenderer.submit('job', {'word': (ran.append, 'oud')})['word']
+    prerenderer.submit('job', {'word': (lambda: 'nieuw',)})
+    assert old.cancelled()
+    release.set()
+    assert blocker.result(timeout=5)
+    assert prerenderer.result('job', 'word') == 'nieuw'
+    assert ran == []
+
+    # discard annuleert ook taken die nog in de rij staan
+    release.clear()
+    prerenderer.submit('blokkeert', {'wacht': (release.wait,)})
+    queued = prerenderer.submit('weg', {'word': (ran.append, 'weg')})['word']
+    prerenderer.discard('weg')
+    release.set()
+    assert queued.cancelled() and prerenderer.result('blokkeert', 'wacht') is True
+    assert ran == []
+
+
+def test_prune_only_drops_expired_finished_jobs():
+    """Bij submit() verdwijnen jobs ouder dan ttl, maar alleen als al hun taken klaar zijn."""
+    prerenderer = Prerenderer(workers=2, ttl=0.05)
+    release = threading.Event()
+    prerenderer.submit('klaar', {'word': (lambda: 'document',)})
+    prerenderer.submit('bezig', {'word': (release.wait,)})
+    assert prerenderer.result('klaar', 'word') == 'document'
+    time.sleep(0.1)
+    prerenderer.submit('nieuw', {'word': (lambda: 'nieuw',)})
+    assert set(prerenderer._jobs) == {'bezig', 'nieuw'}
+    release.set()
+    assert prerenderer.result('bezig', 'word') is True
+    time.sleep(0.1)
+    prerenderer.submit('laatste', {})
+    assert set(prerenderer._jobs) == {'laatste'}
+
+
+if __name__ == "__main__":
+    test_submit_result_and_discard()
+    test_timeout_and_error_fall_back_to_none()
+    test_resubmit_cancels_tasks_that_did_not_start()
+    test_prune_only_drops_expired_finished_jobs()
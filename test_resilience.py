@@ -0,0 +1,114 @@
+import time
+
+import stripe
+
+import modules.stripe_config as stripe_config
+from standins import LocalSMTPServer, LocalStripeServer
+from modules.mail_queue import is_permanent_error
+from modules.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, breaker_stats
+from modules.smtp_pool import SMTPPool
+
+
+def _raises(func, error_type):
+    start = time.perf_counter()
+    try:
+        func()
+    except error_type as e:
+        return e, time.perf_counter() - start
+    raise AssertionError(f"verwacht {error_type.__name__}")
+
+
+def test_circuit_breaker_states():
+    """Open na de drempel, één proefaanroep na reset_seconds, dicht na succes; andere fouten tellen niet."""
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_seconds=0.2,
+                             is_failure=lambda e: isinstance(e, TimeoutError))
+
+    def fail(error):
+        raise error
+
+    _raises(lambda: breaker.call(fail, ValueError('geweigerd')), ValueError)
+    _raises(lambda: breaker.call(fail, TimeoutError()), TimeoutError)
+    assert breaker.state == CLOSED
+    _raises(lambda: breaker.call(fail, TimeoutError()), TimeoutError)
+    assert breaker.state == OPEN
+    error, _ = _raises(lambda: breaker.call(lambda: 'ok'), CircuitOpenError)
+    assert 0 < error.retry_after <= 0.2
+
+    time.sleep(0.25)
+    breaker.before_call()  # proefaanroep
+    assert breaker.state == HALF_OPEN
+    _raises(breaker.before_call, CircuitOpenError)  # maar één tegelijk
+    breaker.record_failure(TimeoutError())
+    assert breaker.state == OPEN
+
+    time.sleep(0.25)
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED and breaker.stats()['opened'] == 2
+
+
+def test_smtp_timeout_and_breaker():
+    """Een mailserver die niet antwoordt kost per poging hooguit de connect-timeout; daarna faalt het direct."""
+    server = LocalSMTPServer()
+    server.fault = 'hang'
+    pool = SMTPPool('127.0.0.1', server.port, starttls=False, connect_timeout=0.3, read_timeout=0.3)
+    pool.breaker.failure_threshold = 2
+    try:
+        for _ in range(2):
+            _, elapsed = _raises(lambda: pool.sendmail('a@example.org', ['b@example.org'], b'test'), OSError)
+            assert elapsed < 1
+        error, elapsed = _raises(lambda: pool.sendmail('a@example.org', ['b@example.org'], b'test'),
+                                 CircuitOpenError)
+        print(f"SMTP hangt: poging na timeout, daarna circuit open in {elapsed * 1000:.2f} ms")
+        assert elapsed < 0.05
+        assert not is_permanent_error(error)  # de mailqueue probeert het later opnieuw
+        assert breaker_stats()[f"smtp:127.0.0.1:{server.port}"]['state'] == OPEN
+
+        # Storing voorbij: na reset_seconds komt de proefaanroep door en gaat de breaker dicht
+        server.fault = None
+        pool.breaker.reset_seconds = 0
+        assert pool.sendmail('a@example.org', ['b@example.org'], b'Subject: test\r\n\r\ntest') == {}
+        assert pool.breaker.state == CLOSED
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_stripe_timeout_and_breaker():
+    """Stripe-aanroepen gebruiken de ingestelde leestimeout en falen direct zodra de breaker open is."""
+    server = LocalStripeServer()
+    saved = (stripe_config.STRIPE_SECRET_KEY, stripe.api_key, stripe.api_base, stripe.default_http_client)
+    breaker = stripe_config.stripe_breaker
+    threshold = breaker.failure_threshold
+    stripe_config.STRIPE_SECRET_KEY = stripe.api_key = server.api_key
+    stripe.api_base = server.url
+    stripe.default_http_client = stripe.new_default_http_client(timeout=(0.5, 0.3))
+    breaker.reset()
+    breaker.failure_threshold = 2
+    try:
+        intent, error = stripe_config.create_payment_intent(metadata={'user_id': '1'})
+        assert error is None and intent['amount'] == stripe_config.PRICE_AMOUNT
+        assert stripe_config.get_payment_intent(intent['id'])['client_secret'] == intent['client_secret']
+
+        server.fault = 'hang'
+        for _ in range(2):
+            start = time.perf_counter()
+            intent, error = stripe_config.create_payment_intent()
+            assert intent is None and error and time.perf_counter() - start < 1.5
+        requests_before = server.requests
+        start = time.perf_counter()
+        intent, error = stripe_config.create_payment_intent()
+        print(f"Stripe hangt: circuit open, antwoord in {(time.perf_counter() - start) * 1000:.2f} ms ({error})")
+        assert intent is None and 'tijdelijk niet beschikbaar' in error
+        assert server.requests == requests_before
+        assert breaker_stats()['stripe']['state'] == OPEN
+    finally:
+        (stripe_config.STRIPE_SECRET_KEY, stripe.api_key, stripe.api_base, stripe.default_http_client) = saved
+        breaker.failure_threshold = threshold
+        breaker.reset()
+        server.stop()
+
+
+if __name__ == "__main__":
+    test_circuit_breaker_states()
+    test_smtp_timeout_and_breaker()
+    test_stripe_timeout_and_breaker()
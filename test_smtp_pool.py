@@ -0,0 +1,100 @@
+import time
+from email.message import EmailMessage
+
+from standins import LocalSMTPServer
+from modules import smtp_pool
+from modules.smtp_pool import SMTPPool, close_all_pools, get_smtp_pool
+
+
+def _message(i):
+    msg = EmailMessage()
+    msg['From'] = 'aanvraag@example.org'
+    msg['To'] = 'afdeling@example.org'
+    msg['Subject'] = f'Test {i}'
+    msg.set_content('Testbericht')
+    return msg
+
+
+def test_smtp_pool_reuse():
+    """Meerdere berichten achter elkaar gebruiken één geauthenticeerde verbinding."""
+    server = LocalSMTPServer()
+    pool = SMTPPool('127.0.0.1', server.port, 'gebruiker', 'geheim', starttls=False)
+    try:
+        count = 10
+        start = time.perf_counter()
+        for i in range(count):
+            pool.send_message(_message(i))
+        pooled = time.perf_counter() - start
+
+        stats = pool.stats()
+        print("=== SMTP pool ===")
+        print(f"Berichten: {count}, handshakes: {stats['handshakes']}, hergebruikt: {stats['reuses']}")
+        print(f"Gemiddelde handshake: {stats['avg_handshake_ms']:.1f} ms, bespaard: {stats['saved_ms']:.0f} ms "
+              f"(totaal {pooled * 1000:.0f} ms)")
+        assert stats['handshakes'] == 1
+        assert stats['reuses'] == count - 1
+        assert server.connections == 1
+        assert len(server.messages) == count
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_smtp_pool_reconnects_after_disconnect():
+    """Een door de server verbroken verbinding wordt vervangen zonder dat de verzending mislukt."""
+    server = LocalSMTPServer()
+    pool = SMTPPool('127.0.0.1', server.port, 'gebruiker', 'geheim', starttls=False, noop_after=3600)
+    try:
+        pool.send_message(_message(1))
+        server.drop_connections()
+        pool.send_message(_message(2))
+        stats = pool.stats()
+        assert stats['handshakes'] == 2
+        assert stats['reconnects'] == 1
+        assert len(server.messages) == 2
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_smtp_pool_noop_check():
+    """Na inactiviteit wordt de verbinding eerst met NOOP gecontroleerd; een dode verbinding wordt vervangen."""
+    server = LocalSMTPServer()
+    pool = SMTPPool('127.0.0.1', server.port, 'gebruiker', 'geheim', starttls=False, noop_after=0)
+    try:
+        pool.send_message(_message(1))
+        time.sleep(0.01)
+        pool.send_message(_message(2))
+        assert server.noops == 1
+        assert pool.stats()['handshakes'] == 1
+
+        server.drop_connections()
+        time.sleep(0.01)
+        pool.send_message(_message(3))
+        stats = pool.stats()
+        assert stats['handshakes'] == 2
+        assert stats['reconnects'] == 0  # al bij de NOOP-controle vervangen
+        assert len(server.messages) == 3
+    finally:
+        pool.close()
+        server.stop()
+
+
+def test_close_all_pools_forgets_pools():
+    """Na close_all_pools geeft get_smtp_pool een nieuwe pool in plaats van de gesloten."""
+    pool = get_smtp_pool('127.0.0.1', 2525, 'gebruiker', 'geheim', starttls=False)
+    assert get_smtp_pool('127.0.0.1', 2525, 'gebruiker', 'geheim', starttls=False) is pool
+    close_all_pools()
+    assert not smtp_pool._pools
+    fresh = get_smtp_pool('127.0.0.1', 2525, 'gebruiker', 'geheim', starttls=False)
+    try:
+        assert fresh is not pool
+    finally:
+        close_all_pools()
+
+
+if __name__ == "__main__":
+    test_smtp_pool_reuse()
+    test_smtp_pool_reconnects_after_disconnect()
+    test_smtp_pool_noop_check()
+    test_close_all_pools_forgets_pools()
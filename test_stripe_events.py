@@ -0,0 +1,126 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import modules.stripe_config as stripe_config
+from standins import sign_stripe_payload, stripe_event
+from modules.database import init_db
+from modules.stripe_events import DEFAULT_HANDLERS, StripeEventInbox
+
+WEBHOOK_SECRET = 'whsec_test_standin'
+
+
+def _inbox(handlers=None):
+    """Inbox op een eigen database met het schema van de app, één gebruiker en een open betaling."""
+    directory = tempfile.mkdtemp(prefix='stripeevents_test_')
+    db_path = os.path.join(directory, 'test.db')
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (id, name, email, hashed_password) VALUES (1, 'Test BV', 'test@example.org', 'x')")
+    conn.execute('''INSERT INTO payments (user_id, stripe_payment_intent_id, amount, currency, status)
+                   VALUES (1, 'pi_test', 2500, 'eur', 'requires_payment_method')''')
+    conn.commit()
+    conn.close()
+    return StripeEventInbox(db_path, handlers=handlers, poll_seconds=0.1), directory
+
+
+def _intent(status):
+    return {'id': 'pi_test', 'object': 'payment_intent', 'amount': 2500, 'currency': 'eur', 'status': status,
+            'metadata': {'user_id': '1'}}
+
+
+def _query(inbox, sql, *params):
+    conn = sqlite3.connect(inbox.db_path)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute(sql, params).fetchone()
+    conn.close()
+    return row
+
+
+def test_signed_fixture_events_verify():
+    """Lokaal ondertekende events komen door verify_webhook_signature; een ander secret of oude tijd niet."""
+    saved = stripe_config.STRIPE_WEBHOOK_SECRET
+    stripe_config.STRIPE_WEBHOOK_SECRET = WEBHOOK_SECRET
+    try:
+        payload = stripe_event('payment_intent.succeeded', _intent('succeeded'), event_id='evt_1')
+        event, error = stripe_config.verify_webhook_signature(payload, sign_stripe_payload(payload, WEBHOOK_SECRET))
+        assert error is None and event['id'] == 'evt_1'
+        event, error = stripe_config.verify_webhook_signature(payload, sign_stripe_payload(payload, 'whsec_anders'))
+        assert event is None and 'signature' in error
+        old = sign_stripe_payload(payload, WEBHOOK_SECRET, timestamp=int(time.time()) - 3600)
+        assert stripe_config.verify_webhook_signature(payload, old)[0] is None
+    finally:
+        stripe_config.STRIPE_WEBHOOK_SECRET = saved
+
+
+def test_inbox_deduplicates_and_keeps_order():
+    """Een herhaald event telt één keer; events gaan op volgorde van aanmaken, niet van binnenkomst."""
+    inbox, directory = _inbox()
+    try:
+        now = int(time.time())
+        succeeded = stripe_event('payment_intent.succeeded', _intent('succeeded'), event_id='evt_ok', created=now)
+        failed = stripe_event('payment_intent.payment_failed', _intent('requires_payment_method'),
+                              event_id='evt_fail', created=now - 10)
+        assert inbox.receive(succeeded.encode())
+        assert not inbox.receive(succeeded.encode())  # herhaling door Stripe
+        assert inbox.receive(failed)
+        assert inbox.stats()['pending'] == 2
+
+        processed = []
+        inbox.add_listener(lambda event: processed.append(event['id']))
+        assert inbox.process_due() == 2
+        assert processed == ['evt_fail', 'evt_ok']
+        assert _query(inbox, 'SELECT status FROM payments')['status'] == 'succeeded'
+        user = _query(inbox, 'SELECT * FROM users WHERE id = 1')
+        assert user['is_paid_user'] == 1 and user['subscription_status'] == 'active' and user['subscription_expires']
+
+        # Een late mislukte poging maakt een geslaagde betaling niet ongedaan
+        assert inbox.receive(stripe_event('payment_intent.payment_failed', _intent('requires_payment_method'),
+                                          created=now + 5))
+        assert inbox.process_due() == 1
+        assert _query(inbox, 'SELECT status FROM payments')['status'] == 'succeeded'
+        assert inbox.stats() == {'pending': 0, 'processing': 0, 'done': 3, 'failed': 0}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_inbox_retries_failed_handler():
+    """Een handler die faalt laat niets half achter; het event komt na de backoff opnieuw aan de beurt."""
+    calls = []
+
+    def flaky(conn, intent, event):
+        calls.append(event['id'])
+        if len(calls) == 1:
+            raise sqlite3.OperationalError('database is locked')
+
+    handlers = {'payment_intent.succeeded': DEFAULT_HANDLERS['payment_intent.succeeded'] + [flaky]}
+    inbox, directory = _inbox(handlers)
+    try:
+        inbox.receive(stripe_event('payment_intent.succeeded', _intent('succeeded'), event_id='evt_retry'))
+        assert inbox.process_due() == 1
+        row = _query(inbox, 'SELECT * FROM stripe_events')
+        assert row['status'] == 'pending' and row['attempts'] == 1 and 'locked' in row['last_error']
+        assert _query(inbox, 'SELECT status FROM payments')['status'] == 'requires_payment_method'  # teruggedraaid
+        assert inbox.process_due() == 0  # backoff
+
+        conn = sqlite3.connect(inbox.db_path)
+        conn.execute('UPDATE stripe_events SET next_attempt_at = 0')
+        conn.commit()
+        conn.close()
+        inbox.start()
+        deadline = time.monotonic() + 2
+        while inbox.stats()['done'] != 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert calls == ['evt_retry', 'evt_retry']
+        assert _query(inbox, 'SELECT status FROM payments')['status'] == 'succeeded'
+    finally:
+        inbox.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_signed_fixture_events_verify()
+    test_inbox_deduplicates_and_keeps_order()
+    test_inbox_retries_failed_handler()